@@ -188,3 +188,6 @@ SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 # External service tokens / config
 CANVAS_API_TOKEN = os.getenv('CANVAS_API_TOKEN', '')
 CANVAS_COURSE_IDS = os.getenv('CANVAS_COURSE_IDS', '')
+
+# Rows per page for the paginated JSON views
+STUDENT_PAGE_SIZE = int(os.getenv('STUDENT_PAGE_SIZE', '50'))
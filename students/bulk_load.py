@@ -0,0 +1,128 @@
+"""
+Bulk insert backends for ``import_canvas_data``.
+
+``bulk_create`` sends one parameterized INSERT per batch, and SQL Server's
+2100-parameter cap keeps those batches small (~80 enrollment rows). On
+mssql-django the ``odbc`` backend instead hands whole batches to the pyodbc
+connection with ``fast_executemany``, which ships the rows as one array
+bind. Any other database (SQLite locally) uses the ORM.
+
+``IMPORT_BULK_BACKEND`` (``auto`` | ``odbc`` | ``orm``) overrides the choice.
+"""
+import os
+import time
+
+from django.db import connection, models
+
+BACKENDS = ("auto", "odbc", "orm")
+
+
+def _odbc_available():
+    if connection.vendor != "microsoft":
+        return False
+    try:
+        import pyodbc  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def get_backend(name=None):
+    name = (name or os.getenv("IMPORT_BULK_BACKEND", "auto")).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown bulk backend '{name}'; expected one of {', '.join(BACKENDS)}")
+    if name == "auto":
+        return "odbc" if _odbc_available() else "orm"
+    if name == "odbc" and not _odbc_available():
+        raise ValueError("The odbc bulk backend needs mssql-django with pyodbc.")
+    return name
+
+
+def _insert_fields(model):
+    return [
+        f for f in model._meta.concrete_fields
+        if not isinstance(f, (models.AutoField, models.BigAutoField, models.SmallAutoField))
+    ]
+
+
+def _input_sizes(fields):
+    """
+    pyodbc ``setinputsizes`` entries for ``fields``. Without them,
+    ``fast_executemany`` infers every column's type from the first row, so a
+    leading NULL in a float or datetime column breaks the rows after it.
+    """
+    import pyodbc
+
+    sizes = []
+    for field in fields:
+        while field.is_relation:  # a foreign key binds as the column it points at
+            field = field.target_field
+        kind = field.get_internal_type()
+        if kind in ("AutoField", "IntegerField", "PositiveIntegerField", "SmallIntegerField"):
+            sizes.append((pyodbc.SQL_INTEGER, 0, 0))
+        elif kind in ("BigAutoField", "BigIntegerField", "PositiveBigIntegerField"):
+            sizes.append((pyodbc.SQL_BIGINT, 0, 0))
+        elif kind == "FloatField":
+            sizes.append((pyodbc.SQL_DOUBLE, 0, 0))
+        elif kind == "BooleanField":
+            sizes.append((pyodbc.SQL_BIT, 0, 0))
+        elif kind == "DateTimeField":
+            sizes.append((pyodbc.SQL_TYPE_TIMESTAMP, 27, 7))  # datetime2(7)
+        elif kind == "DateField":
+            sizes.append((pyodbc.SQL_TYPE_DATE, 0, 0))
+        else:  # CharField, EmailField, TextField, JSONField, ...; 0 = nvarchar(max)
+            sizes.append((pyodbc.SQL_WVARCHAR, getattr(field, "max_length", None) or 0, 0))
+    return sizes
+
+
+def _odbc_insert(model, objects):
+    fields = _insert_fields(model)
+    qn = connection.ops.quote_name
+    sql = "INSERT INTO {} ({}) VALUES ({})".format(
+        qn(model._meta.db_table),
+        ", ".join(qn(f.column) for f in fields),
+        ", ".join("?" for _ in fields),
+    )
+    # get_db_prep_save applies the backend's own conversions (aware -> UTC datetimes etc.)
+    rows = [
+        [f.get_db_prep_save(getattr(obj, f.attname), connection) for f in fields]
+        for obj in objects
+    ]
+    connection.ensure_connection()
+    cursor = connection.connection.cursor()  # raw pyodbc cursor on Django's connection/transaction
+    try:
+        cursor.fast_executemany = True
+        cursor.setinputsizes(_input_sizes(fields))
+        cursor.executemany(sql, rows)
+    finally:
+        cursor.close()
+
+
+class BulkInserter:
+    """
+    Insert model instances in batches through the chosen backend and keep
+    per-model row counts and elapsed time for the rows/sec report.
+    """
+
+    def __init__(self, backend=None, batch_size=2000):
+        self.backend = get_backend(backend)
+        self.batch_size = batch_size
+        self.stats = {}
+
+    def insert(self, model, objects):
+        objects = list(objects)
+        if not objects:
+            return 0
+        start = time.perf_counter()
+        if self.backend == "odbc":
+            for i in range(0, len(objects), self.batch_size):
+                _odbc_insert(model, objects[i:i + self.batch_size])
+        else:
+            model.objects.bulk_create(objects, batch_size=self.batch_size)
+        rows, seconds = self.stats.get(model._meta.label, (0, 0.0))
+        self.stats[model._meta.label] = (rows + len(objects), seconds + time.perf_counter() - start)
+        return len(objects)
+
+    def rate(self, model):
+        rows, seconds = self.stats.get(model._meta.label, (0, 0.0))
+        return rows, (rows / seconds if seconds else 0.0)
@@ -0,0 +1,276 @@
+"""
+Shared HTTP client for the Canvas REST API.
+
+The fetch commands and the messaging views all go through ``CanvasClient`` so
+every thread reuses a keep-alive ``requests.Session`` instead of opening a new
+TCP+TLS connection per request. Retry/backoff and timeouts live here too, so
+the commands no longer carry their own copies of the loop.
+"""
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+CANVAS_BASE_URL = os.getenv("CANVAS_BASE_URL", "https://usflearn.instructure.com/api/v1")
+
+# Statuses worth retrying on idempotent requests (rate limit + transient server errors)
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+def get_canvas_token():
+    return os.getenv("CANVAS_API_TOKEN") or getattr(settings, "CANVAS_API_TOKEN", "") or ""
+
+
+class CanvasClient:
+    """
+    Thread-safe Canvas client with one pooled session per thread.
+
+    Tunables default to the same env vars the commands already read:
+    CANVAS_TIMEOUT, CANVAS_RETRIES, CANVAS_BACKOFF and CANVAS_POOL_SIZE.
+    """
+
+    def __init__(self, token=None, base_url=None, timeout=None, retries=None,
+                 backoff=None, pool_size=None, logger=None, limiter=None, metrics=None):
+        self.token = token or get_canvas_token()
+        self.base_url = (base_url or CANVAS_BASE_URL).rstrip("/")
+        self.timeout = float(timeout if timeout is not None else os.getenv("CANVAS_TIMEOUT", "30"))
+        self.retries = int(retries if retries is not None else os.getenv("CANVAS_RETRIES", "3"))
+        self.backoff = float(backoff if backoff is not None else os.getenv("CANVAS_BACKOFF", "0.5"))
+        self.pool_size = int(pool_size if pool_size is not None else os.getenv("CANVAS_POOL_SIZE", "10"))
+        self.logger = logger or logging.getLogger(__name__)
+        self.limiter = limiter  # optional AdaptiveRateLimiter shared by all threads
+        self.metrics = metrics  # optional FetchMetrics
+        self._local = threading.local()
+
+    # --- sessions ---------------------------------------------------------
+
+    @property
+    def session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=self.pool_size,
+                pool_maxsize=self.pool_size,
+                max_retries=0,  # retries are handled in request() so 429s are covered too
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers["Authorization"] = f"Bearer {self.token}"
+            self._local.session = session
+        return session
+
+    def close(self):
+        session = getattr(self._local, "session", None)
+        if session is not None:
+            session.close()
+            self._local.session = None
+
+    # --- requests ---------------------------------------------------------
+
+    def url(self, path):
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def _sleep(self, attempts, resp=None):
+        delay = self.backoff * attempts
+        retry_after = resp.headers.get("Retry-After") if resp is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        time.sleep(delay)
+
+    def _send(self, method, url, **kwargs):
+        if self.metrics is None:
+            return self.session.request(method, url, **kwargs)
+        started = self.metrics.start(self.limiter)
+        try:
+            resp = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            self.metrics.finish(started, url, error=e)
+            raise
+        self.metrics.finish(started, url, resp)
+        return resp
+
+    def request(self, method, url, retry_on=RETRY_STATUSES, retry_errors=True, **kwargs):
+        """
+        Send one request, retrying ``retry_on`` statuses (and connection errors
+        when ``retry_errors``) up to ``self.retries`` times with linear backoff.
+        Returns the last response; re-raises the last RequestException.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        url = self.url(url)
+        attempts = 0
+        while True:
+            try:
+                if self.limiter is not None:
+                    with self.limiter.slot():
+                        resp = self._send(method, url, **kwargs)
+                    self.limiter.observe(resp)
+                else:
+                    resp = self._send(method, url, **kwargs)
+            except requests.exceptions.RequestException:
+                attempts += 1
+                if not retry_errors or attempts > self.retries:
+                    raise
+                if self.metrics is not None:
+                    self.metrics.retry("error")
+                self._sleep(attempts)
+                continue
+            if resp.status_code in retry_on and attempts < self.retries:
+                attempts += 1
+                if self.metrics is not None:
+                    self.metrics.retry(resp.status_code)
+                # on 429 the limiter already paused every thread (for at least Retry-After);
+                # don't stack a second backoff
+                if not (self.limiter is not None and resp.status_code == 429):
+                    self._sleep(attempts, resp)
+                continue
+            return resp
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        # POSTs are not idempotent: only retry when Canvas refused the request outright
+        kwargs.setdefault("retry_on", frozenset({429}))
+        kwargs.setdefault("retry_errors", False)
+        return self.request("POST", url, **kwargs)
+
+    def get_all(self, url, params=None):
+        """
+        Follow ``Link: rel=next`` pagination and collect every list item.
+
+        Returns ``(items, ok)``; on failure ``items`` holds whatever pages were
+        fetched before giving up.
+        """
+        items, ok, pages = self._follow(url, params)
+        self._record_listing(url, pages)
+        return items, ok
+
+    def _follow(self, url, params=None):
+        items, pages = [], 0
+        while url:
+            try:
+                resp = self.get(url, params=params)
+            except requests.exceptions.RequestException as e:
+                self.logger.error(f"Failed to fetch {url}: {e}")
+                return items, False, pages
+            if resp.status_code != 200:
+                self.logger.warning(f"Failed to fetch {url}. Status code: {resp.status_code}")
+                return items, False, pages
+            pages += 1
+            data = self._json(resp, url)
+            if data is None:
+                return items, False, pages
+            if isinstance(data, list):
+                items.extend(data)
+            else:
+                self.logger.warning(f"Unexpected response shape from {url}")
+            url = resp.links.get("next", {}).get("url")
+            params = None  # the next link already carries the query string
+        return items, True, pages
+
+    def get_all_pages(self, url, params=None, max_workers=4):
+        """
+        Like ``get_all`` but, when the first response advertises ``rel=last``
+        with a numeric page, fetches pages 2..last concurrently on
+        ``max_workers`` threads. Falls back to following ``rel=next`` when
+        Canvas only exposes opaque bookmarks. Items keep page order.
+        """
+        try:
+            resp = self.get(url, params=params)
+        except requests.exceptions.RequestException as e:
+            self.logger.error(f"Failed to fetch {url}: {e}")
+            return [], False
+        if resp.status_code != 200:
+            self.logger.warning(f"Failed to fetch {url}. Status code: {resp.status_code}")
+            return [], False
+        first = self._json(resp, url)
+        if first is None:
+            self._record_listing(url, 1)
+            return [], False
+        items = list(first) if isinstance(first, list) else []
+
+        last_url = resp.links.get("last", {}).get("url")
+        last_page = _page_number(last_url)
+        if last_page is None or max_workers <= 1:
+            next_url = resp.links.get("next", {}).get("url")
+            rest, ok, pages = self._follow(next_url) if next_url else ([], True, 0)
+            self._record_listing(url, 1 + pages)
+            return items + rest, ok
+        if last_page <= 1:
+            self._record_listing(url, 1)
+            return items, True
+
+        page_urls = [_with_page(last_url, n) for n in range(2, last_page + 1)]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(page_urls))) as executor:
+            pages = list(executor.map(self._get_page, page_urls))
+        ok = True
+        for page, page_ok in pages:
+            items.extend(page)
+            ok = ok and page_ok
+        self._record_listing(url, last_page)
+        return items, ok
+
+    def _record_listing(self, url, pages):
+        if self.metrics is not None:
+            self.metrics.listing(self.url(url), pages)
+
+    def _get_page(self, url):
+        try:
+            resp = self.get(url)
+        except requests.exceptions.RequestException as e:
+            self.logger.error(f"Failed to fetch {url}: {e}")
+            return [], False
+        if resp.status_code != 200:
+            self.logger.warning(f"Failed to fetch {url}. Status code: {resp.status_code}")
+            return [], False
+        data = self._json(resp, url)
+        if data is None:
+            return [], False
+        return (data if isinstance(data, list) else []), True
+
+    def _json(self, resp, url):
+        """Decoded body, or None (logged) when a 200 isn't JSON, e.g. a proxy or maintenance page."""
+        try:
+            return resp.json()
+        except ValueError as e:
+            self.logger.error(f"Failed to decode JSON from {url}: {e}")
+            return None
+
+
+def _page_number(url):
+    if not url:
+        return None
+    page = dict(parse_qsl(urlsplit(url).query)).get("page")
+    return int(page) if page and page.isdigit() else None
+
+
+def _with_page(url, page):
+    parts = urlsplit(url)
+    query = [(k, str(page) if k == "page" else v) for k, v in parse_qsl(parts.query, keep_blank_values=True)]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(token=None):
+    """Process-wide client per token, used by the views (sessions are still per thread)."""
+    token = token or get_canvas_token()
+    with _clients_lock:
+        client = _clients.get(token)
+        if client is None:
+            client = _clients[token] = CanvasClient(token=token)
+        return client
@@ -0,0 +1,323 @@
+"""
+Local stand-in for the parts of the Canvas API the fetch commands use.
+
+``FakeCanvas`` generates a deterministic synthetic roster (courses, students,
+assignments, submissions) and serves, under ``/api/v1``:
+
+- ``courses/:id/enrollments``
+- ``courses/:id/analytics/users/:id/assignments``
+- ``courses/:id/students/submissions`` (``student_ids[]``, ``include[]=assignment``)
+
+Listings are paginated with Canvas-style ``Link`` headers (``next``/``last``,
+``per_page`` capped at 100). Each response waits ``latency`` (+/- ``jitter``)
+seconds, a fraction of requests can be failed with 429 (with ``Retry-After``)
+or 5xx, and a leaky bucket like Canvas' per-token throttle reports
+``X-Rate-Limit-Remaining`` / ``X-Request-Cost`` and answers 429 when it
+overflows. ``write_rosters`` writes the matching ``*_StudentRoster.csv`` files.
+Used by ``fake_canvas_server`` and ``benchmark_fetch`` so load tests never
+touch the real instance.
+"""
+import csv
+import json
+import os
+import re
+import random
+import threading
+import time
+import zlib
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+MAX_PER_PAGE = 100
+FIRST_STUDENT_ID = 7000000
+FIRST_COURSE_ID = 9000
+
+ENROLLMENTS = re.compile(r"^/api/v1/courses/(\d+)/enrollments/?$")
+ANALYTICS = re.compile(r"^/api/v1/courses/(\d+)/analytics/users/(\d+)/assignments/?$")
+SUBMISSIONS = re.compile(r"^/api/v1/courses/(\d+)/students/submissions/?$")
+
+
+class FakeCanvas:
+    def __init__(self, courses=2, students=200, overlap=0.1, assignments=20, latency=0.05, jitter=0.0,
+                 error_429=0.0, error_5xx=0.0, bucket=700.0, leak_rate=10.0, request_cost=1.0, seed=0):
+        self.latency = max(0.0, float(latency))
+        self.jitter = max(0.0, float(jitter))
+        self.error_429 = float(error_429)
+        self.error_5xx = float(error_5xx)
+        self.bucket = float(bucket)  # 0 disables throttling
+        self.leak_rate = float(leak_rate)
+        self.request_cost = float(request_cost)
+        self.seed = seed
+
+        # each course gets `students` consecutive IDs; neighbouring courses share `overlap` of them
+        self.course_ids = [str(FIRST_COURSE_ID + i) for i in range(max(1, int(courses)))]
+        step = max(1, int(round(int(students) * (1 - float(overlap)))))
+        self.rosters = {
+            cid: [str(FIRST_STUDENT_ID + i * step + k) for k in range(int(students))]
+            for i, cid in enumerate(self.course_ids)
+        }
+        self.assignments_per_course = max(0, int(assignments))
+
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._level = 0.0
+        self._leaked_at = time.monotonic()
+        self.reset_stats()
+
+    # --- synthetic data -----------------------------------------------------
+
+    def _unit(self, *parts):
+        """Stable pseudo-random float in [0, 1) for a (course, student, assignment) key."""
+        key = ":".join(str(p) for p in (self.seed,) + parts)
+        return (zlib.crc32(key.encode()) & 0xFFFFFFFF) / 2**32
+
+    def assignment(self, course_id, k):
+        return {
+            "id": int(course_id) * 1000 + k,
+            # titles are unique per course: the importers merge assignments by title
+            "name": f"{course_id} Module {k // 3 + 1} Quiz {k % 3 + 1}",
+            "points_possible": 10.0,
+            "due_at": f"2025-{9 + k // 28:02d}-{k % 28 + 1:02d}T03:59:00Z",
+        }
+
+    def submission(self, course_id, student_id, k):
+        assignment = self.assignment(course_id, k)
+        roll = self._unit(course_id, student_id, k)
+        submitted = roll < 0.85
+        late = submitted and roll > 0.75
+        return {
+            "user_id": int(student_id),
+            "assignment_id": assignment["id"],
+            "submitted_at": assignment["due_at"].replace("T03:59", "T02:00") if submitted else None,
+            "score": round(10 * self._unit(student_id, k, "score"), 1) if submitted else None,
+            "late": late,
+            "missing": not submitted and roll > 0.95,
+            "cached_due_date": assignment["due_at"],
+            "assignment": assignment,
+        }
+
+    def enrollments(self, course_id):
+        items = []
+        for i, sid in enumerate(self.rosters[course_id]):
+            score = round(60 + 40 * self._unit(course_id, sid, "grade"), 2)
+            items.append({
+                "id": int(course_id) * 100000 + i,
+                "user_id": int(sid),
+                "course_id": int(course_id),
+                "type": "StudentEnrollment",
+                "role": "StudentEnrollment",
+                "enrollment_state": "active",
+                "last_activity_at": f"2025-11-{int(self._unit(course_id, sid, 'day') * 28) + 1:02d}T15:00:00Z",
+                "total_activity_time": int(36000 * self._unit(course_id, sid, "time")),
+                "sis_course_id": f"FAKE{course_id}",
+                "sis_section_id": f"FAKE{course_id}.001",
+                "sis_user_id": f"U{sid}",
+                "grades": {
+                    "current_score": score, "final_score": round(score * 0.9, 2),
+                    "current_grade": None, "final_grade": None,
+                    "unposted_current_score": score, "unposted_final_score": round(score * 0.9, 2),
+                    "unposted_current_grade": None, "unposted_final_grade": None,
+                },
+                "user": {"id": int(sid), "name": f"Student {sid}", "sortable_name": f"{sid}, Student"},
+            })
+        return items
+
+    def analytics(self, course_id, student_id):
+        items = []
+        for k in range(self.assignments_per_course):
+            sub = self.submission(course_id, student_id, k)
+            if sub["submitted_at"]:
+                status = "late" if sub["late"] else "on_time"
+            else:
+                status = "missing" if sub["missing"] else "floating"
+            items.append({
+                "assignment_id": sub["assignment_id"],
+                "title": sub["assignment"]["name"],
+                "points_possible": sub["assignment"]["points_possible"],
+                "due_at": sub["assignment"]["due_at"],
+                "status": status,
+                "submission": {"score": sub["score"], "submitted_at": sub["submitted_at"]},
+            })
+        return items
+
+    def submissions(self, course_id, student_ids, include_assignment):
+        roster = set(self.rosters[course_id])
+        items = []
+        for sid in student_ids:
+            if sid not in roster:
+                continue
+            for k in range(self.assignments_per_course):
+                sub = self.submission(course_id, sid, k)
+                if not include_assignment:
+                    sub.pop("assignment")
+                items.append(sub)
+        return items
+
+    def write_rosters(self, output_dir):
+        """
+        Write one ``<n>_StudentRoster.csv`` per course, like the registrar exports the
+        fetch commands read. A student shared by several courses is listed once, under
+        the first: the roster is one row per student (``Studentlist.sis_id`` is unique).
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        paths, listed = [], set()
+        for n, course_id in enumerate(self.course_ids, start=1):
+            path = os.path.join(output_dir, f"{n:03d}_StudentRoster.csv")
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(["Student Name", "Student ID", "Student SIS ID", "Email", "Section Name"])
+                for sid in self.rosters[course_id]:
+                    if sid in listed:
+                        continue
+                    listed.add(sid)
+                    writer.writerow([f"Student {sid}", sid, f"U{sid}", f"{sid}@example.edu", f"FAKE{course_id}.001"])
+            paths.append(path)
+        return paths
+
+    # --- throttling and stats -------------------------------------------------
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_sent = 0
+            self.statuses = defaultdict(int)
+            self.in_flight = 0
+            self.max_in_flight = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "bytes": self.bytes_sent,
+                "statuses": dict(self.statuses),
+                "max_in_flight": self.max_in_flight,
+            }
+
+    def _admit(self):
+        """Leaky-bucket check: (allowed, remaining budget) for one more request."""
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            if self.bucket <= 0:
+                return True, None
+            now = time.monotonic()
+            self._level = max(0.0, self._level - (now - self._leaked_at) * self.leak_rate)
+            self._leaked_at = now
+            if self._level + self.request_cost > self.bucket:
+                return False, self.bucket - self._level
+            self._level += self.request_cost
+            return True, self.bucket - self._level
+
+    def _fault(self):
+        with self._lock:
+            roll = self._rng.random()
+        if roll < self.error_429:
+            return 429
+        if roll < self.error_429 + self.error_5xx:
+            return 503
+        return None
+
+    def _delay(self):
+        if self.latency or self.jitter:
+            with self._lock:
+                spread = self._rng.uniform(-self.jitter, self.jitter) if self.jitter else 0.0
+            time.sleep(max(0.0, self.latency + spread))
+
+    def _done(self, status, size):
+        with self._lock:
+            self.in_flight -= 1
+            self.statuses[status] += 1
+            self.bytes_sent += size
+
+    # --- HTTP -----------------------------------------------------------------
+
+    def handle(self, handler):
+        parts = urlsplit(handler.path)
+        query = parse_qs(parts.query)
+        allowed, remaining = self._admit()
+        headers = {}
+        if remaining is not None:
+            headers["X-Rate-Limit-Remaining"] = f"{max(0.0, remaining):.3f}"
+            headers["X-Request-Cost"] = f"{self.request_cost:.3f}"
+        self._delay()
+
+        fault = None if allowed else 429
+        fault = fault or self._fault()
+        if fault:
+            if fault == 429:
+                headers["Retry-After"] = "1"
+            return self._respond(handler, fault, {"errors": [{"message": "Rate Limit Exceeded"
+                                                                if fault == 429 else "Service Unavailable"}]},
+                                 headers)
+
+        match = ENROLLMENTS.match(parts.path)
+        if match and match[1] in self.rosters:
+            return self._page(handler, parts, query, self.enrollments(match[1]), headers)
+        match = ANALYTICS.match(parts.path)
+        if match and match[1] in self.rosters:
+            if match[2] not in self.rosters[match[1]]:
+                return self._respond(handler, 404, {"errors": [{"message": "The specified resource does not exist."}]},
+                                     headers)
+            return self._page(handler, parts, query, self.analytics(match[1], match[2]), headers)
+        match = SUBMISSIONS.match(parts.path)
+        if match and match[1] in self.rosters:
+            items = self.submissions(
+                match[1], query.get("student_ids[]", []), "assignment" in query.get("include[]", [])
+            )
+            return self._page(handler, parts, query, items, headers)
+        return self._respond(handler, 404, {"errors": [{"message": "The specified resource does not exist."}]}, headers)
+
+    def _page(self, handler, parts, query, items, headers):
+        try:
+            page = max(1, int(query.get("page", ["1"])[0]))
+            per_page = min(MAX_PER_PAGE, max(1, int(query.get("per_page", ["10"])[0])))
+        except ValueError:
+            return self._respond(handler, 400, {"errors": [{"message": "invalid page"}]}, headers)
+        last = max(1, -(-len(items) // per_page))
+        host = handler.headers.get("Host") or "{}:{}".format(*handler.server.server_address[:2])
+
+        def link(n):
+            params = [(k, v) for k, values in query.items() if k not in ("page", "per_page") for v in values]
+            params += [("page", n), ("per_page", per_page)]
+            return f"http://{host}{parts.path}?{urlencode(params)}"
+
+        links = [f'<{link(page)}>; rel="current"', f'<{link(1)}>; rel="first"', f'<{link(last)}>; rel="last"']
+        if page < last:
+            links.append(f'<{link(page + 1)}>; rel="next"')
+        if page > 1:
+            links.append(f'<{link(page - 1)}>; rel="prev"')
+        headers["Link"] = ",".join(links)
+        return self._respond(handler, 200, items[(page - 1) * per_page:page * per_page], headers)
+
+    def _respond(self, handler, status, payload, headers):
+        body = json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json; charset=utf-8")
+        handler.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(body)
+        self._done(status, len(body))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API behind requests' connection pool
+
+    def do_GET(self):
+        self.server.canvas.handle(self)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(canvas, host="127.0.0.1", port=0):
+    """Serve ``canvas`` on a background thread; returns (server, base_url). Stop with ``server.shutdown()``."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.canvas = canvas
+    threading.Thread(target=server.serve_forever, name="fake-canvas", daemon=True).start()
+    bound_host, bound_port = server.server_address[:2]
+    return server, f"http://{bound_host}:{bound_port}/api/v1"
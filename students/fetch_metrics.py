@@ -0,0 +1,217 @@
+"""
+Per-request metrics for Canvas fetch runs.
+
+``CanvasClient`` reports every HTTP attempt here when it is given a
+``FetchMetrics`` (``metrics=``): endpoint (numeric IDs folded to ``:id``),
+status, latency, bytes received, transport errors by exception type,
+retries, 429s, and how many requests were in flight. ``get_all``/``get_all_pages`` add pages per listing. At the end
+of a run the commands write ``write_json`` next to the exports and, when
+asked, a Prometheus text-format dump with ``write_prometheus``.
+"""
+import re
+import json
+import time
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PAGE_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+_ID_SEGMENT = re.compile(r"^(?:\d+|sis_[a-z_]+:.+|self)$")
+
+
+def endpoint_of(url):
+    """'https://x/api/v1/courses/12/users/34/assignments?page=2' -> 'courses/:id/users/:id/assignments'."""
+    path = urlsplit(url).path
+    if "/api/v1/" in path:
+        path = path.split("/api/v1/", 1)[1]
+    return "/".join(":id" if _ID_SEGMENT.match(seg) else seg for seg in path.strip("/").split("/"))
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def _histogram(values, buckets):
+    counts = [0] * (len(buckets) + 1)
+    for v in values:
+        counts[bisect_left(buckets, v)] += 1
+    return counts
+
+
+class FetchMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self._t0 = time.monotonic()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.bytes = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.error_types = defaultdict(lambda: defaultdict(int))  # endpoint -> exception name -> count
+        self.retries = defaultdict(int)
+        self.pages = defaultdict(list)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.timeline = {}  # second -> [max in flight, requests started, limiter rate]
+
+    # --- hooks called by CanvasClient -------------------------------------
+
+    def start(self, limiter=None):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            second = int(time.monotonic() - self._t0)
+            sample = self.timeline.setdefault(second, [0, 0, None])
+            sample[0] = max(sample[0], self.in_flight)
+            sample[1] += 1
+            if limiter is not None:
+                sample[2] = round(limiter.rate, 2)
+        return time.monotonic()
+
+    def finish(self, started, url, resp=None, error=None):
+        elapsed = time.monotonic() - started
+        endpoint = endpoint_of(url)
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            self.latencies[endpoint].append(elapsed)
+            if resp is not None:
+                self.statuses[endpoint][resp.status_code] += 1
+                self.bytes[endpoint] += len(resp.content or b"")
+            else:
+                self.errors[endpoint] += 1
+                self.error_types[endpoint][type(error).__name__ if error is not None else "unknown"] += 1
+
+    def retry(self, reason):
+        with self._lock:
+            self.retries[str(reason)] += 1
+
+    def listing(self, url, pages):
+        with self._lock:
+            self.pages[endpoint_of(url)].append(pages)
+
+    # --- reports ----------------------------------------------------------
+
+    def snapshot(self, extra=None):
+        with self._lock:
+            endpoints = {}
+            for endpoint, values in self.latencies.items():
+                ordered = sorted(values)
+                endpoints[endpoint] = {
+                    "requests": len(values),
+                    "statuses": {str(k): v for k, v in sorted(self.statuses[endpoint].items())},
+                    "errors": self.errors[endpoint],
+                    "errors_by_type": dict(sorted(self.error_types[endpoint].items())),
+                    "bytes": self.bytes[endpoint],
+                    "latency_seconds": {
+                        "sum": round(sum(values), 4),
+                        "p50": _percentile(ordered, 0.50),
+                        "p95": _percentile(ordered, 0.95),
+                        "max": ordered[-1] if ordered else None,
+                        "buckets": dict(zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"],
+                                            _histogram(values, LATENCY_BUCKETS))),
+                    },
+                }
+            pages = {
+                endpoint: {
+                    "listings": len(values),
+                    "pages": sum(values),
+                    "max": max(values),
+                    "buckets": dict(zip([str(b) for b in PAGE_BUCKETS] + ["+Inf"], _histogram(values, PAGE_BUCKETS))),
+                }
+                for endpoint, values in self.pages.items()
+            }
+            total_requests = sum(e["requests"] for e in endpoints.values())
+            duration = time.monotonic() - self._t0
+            report = {
+                "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.started)),
+                "duration_seconds": round(duration, 3),
+                "totals": {
+                    "requests": total_requests,
+                    "requests_per_second": round(total_requests / duration, 2) if duration else None,
+                    "bytes": sum(self.bytes.values()),
+                    "rate_limited_429": sum(s.get(429, 0) for s in self.statuses.values()),
+                    "retries": sum(self.retries.values()),
+                    "errors": sum(self.errors.values()),
+                    "max_in_flight": self.max_in_flight,
+                },
+                "retries": dict(self.retries),
+                "endpoints": endpoints,
+                "pages_per_listing": pages,
+                "concurrency": [
+                    {"second": s, "max_in_flight": v[0], "requests": v[1], "limiter_rate": v[2]}
+                    for s, v in sorted(self.timeline.items())
+                ],
+            }
+        if extra:
+            report.update(extra)
+        return report
+
+    def write_json(self, path, extra=None):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(extra), f, indent=2)
+        return path
+
+    def write_prometheus(self, path, prefix="canvas"):
+        report = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+        def histogram(name, label, buckets_by_key):
+            for key, data in buckets_by_key.items():
+                running = 0
+                for le, count in data["buckets"].items():
+                    running += count
+                    lines.append(f'{prefix}_{name}_bucket{{{label}="{key}",le="{le}"}} {running}')
+                lines.append(f'{prefix}_{name}_sum{{{label}="{key}"}} {data["sum"]}')
+                lines.append(f'{prefix}_{name}_count{{{label}="{key}"}} {running}')
+
+        metric("requests_total", "counter", "HTTP responses by endpoint and status")
+        for endpoint, data in report["endpoints"].items():
+            for status, count in data["statuses"].items():
+                lines.append(f'{prefix}_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+            if data["errors"]:
+                lines.append(f'{prefix}_requests_total{{endpoint="{endpoint}",status="error"}} {data["errors"]}')
+
+        metric("request_errors_total", "counter", "Requests that got no response, by endpoint and exception type")
+        for endpoint, data in report["endpoints"].items():
+            for error, count in data["errors_by_type"].items():
+                lines.append(f'{prefix}_request_errors_total{{endpoint="{endpoint}",error="{error}"}} {count}')
+
+        metric("request_duration_seconds", "histogram", "Request latency by endpoint")
+        histogram("request_duration_seconds", "endpoint", {
+            endpoint: {"buckets": data["latency_seconds"]["buckets"], "sum": data["latency_seconds"]["sum"]}
+            for endpoint, data in report["endpoints"].items()
+        })
+
+        metric("response_bytes_total", "counter", "Response body bytes by endpoint")
+        for endpoint, data in report["endpoints"].items():
+            lines.append(f'{prefix}_response_bytes_total{{endpoint="{endpoint}"}} {data["bytes"]}')
+
+        metric("pages_per_listing", "histogram", "Pages followed per paginated listing")
+        histogram("pages_per_listing", "endpoint", {
+            endpoint: {"buckets": data["buckets"], "sum": data["pages"]}
+            for endpoint, data in report["pages_per_listing"].items()
+        })
+
+        metric("retries_total", "counter", "Retried attempts by reason (status code or error)")
+        for reason, count in report["retries"].items():
+            lines.append(f'{prefix}_retries_total{{reason="{reason}"}} {count}')
+
+        metric("rate_limited_total", "counter", "429 responses")
+        lines.append(f'{prefix}_rate_limited_total {report["totals"]["rate_limited_429"]}')
+        metric("max_in_flight", "gauge", "Highest number of concurrent requests")
+        lines.append(f'{prefix}_max_in_flight {report["totals"]["max_in_flight"]}')
+        metric("run_duration_seconds", "gauge", "Wall time of the fetch run")
+        lines.append(f'{prefix}_run_duration_seconds {report["duration_seconds"]}')
+
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        return path
@@ -0,0 +1,149 @@
+"""
+Chunked, column-typed readers for ``import_canvas_data``.
+
+Each input is read ``IMPORT_CHUNK_SIZE`` rows at a time. Dates, numbers and
+text are converted one column at a time with pandas, not one cell at a time
+with ``make_safe_aware`` / ``float()`` / ``pd.notna``. The frames come back
+with model field names as columns and plain Python values (``None`` for
+missing), ready for ``build_instances``. Peak memory is one chunk plus the
+instances built from it.
+"""
+import pandas as pd
+from pandas.api.types import is_datetime64_any_dtype, is_numeric_dtype
+
+from students.interchange import iter_table_chunks
+from students.models import natural_sort_key
+
+TZ_SUFFIX = r"(?:Z|[+-]\d{2}:?\d{2})$"
+
+ENROLLMENT_TEXT = ["type", "role", "sis_course_id", "sis_section_id", "sis_user_id"]
+ENROLLMENT_FLOATS = [
+    "current_grade", "current_score", "final_grade", "final_score",
+    "unposted_current_score", "unposted_current_grade",
+    "unposted_final_score", "unposted_final_grade",
+]
+
+
+def normalize_column(name):
+    """'Student ID' -> 'student_id', 'total_activity_time(in_hrs)' -> 'total_activity_time_in_hrs'."""
+    return (
+        str(name).strip().lower()
+        .replace(" ", "_").replace("(", "_").replace(")", "").replace("/", "_").replace("__", "_")
+    )
+
+
+def aware_datetimes(series, tz):
+    """
+    Parse a column to UTC timestamps. Values without an offset are taken as
+    local time in ``tz``, like ``make_aware`` did per cell; unparseable -> NaT.
+    """
+    if is_datetime64_any_dtype(series):
+        if series.dt.tz is None:
+            return series.dt.tz_localize(tz, ambiguous="NaT", nonexistent="NaT").dt.tz_convert("UTC")
+        return series.dt.tz_convert("UTC")
+    text = series.astype("string").str.strip()
+    has_tz = text.str.contains(TZ_SUFFIX, na=False)
+    parsed = pd.to_datetime(text.where(has_tz), utc=True, errors="coerce")
+    naive = text.notna() & (text != "") & ~has_tz
+    if naive.any():
+        local = pd.to_datetime(text.where(naive), errors="coerce")
+        local = local.dt.tz_localize(tz, ambiguous="NaT", nonexistent="NaT").dt.tz_convert("UTC")
+        parsed = parsed.where(has_tz, local)
+    return parsed
+
+
+def python_values(series):
+    """Object column of Python values with ``None`` for every missing cell."""
+    # datetimes become pd.Timestamp, a datetime subclass the ORM and pyodbc both accept
+    return series.astype(object).where(series.notna(), None)
+
+
+def text_ids(series):
+    """IDs as stripped strings; integral floats/ints lose any '.0'."""
+    if is_numeric_dtype(series):
+        series = pd.to_numeric(series, errors="coerce").astype("Int64")
+    return series.astype("string").str.strip()
+
+
+def numeric(frame, column):
+    if column not in frame.columns:
+        return pd.Series(float("nan"), index=frame.index)
+    return pd.to_numeric(frame[column], errors="coerce")
+
+
+def build_instances(model, frame):
+    columns = list(frame.columns)
+    return [
+        model(**dict(zip(columns, values)))
+        for values in zip(*(frame[col].tolist() for col in columns))
+    ]
+
+
+def typed_enrollments(chunk, tz):
+    """One enrollment frame (clean_data columns) -> Enrollment field columns."""
+    chunk = chunk.rename(columns=normalize_column)
+    out = pd.DataFrame(index=chunk.index)
+    out["student_id"] = text_ids(chunk["student_id"])
+    for col in ENROLLMENT_TEXT:
+        out[col] = chunk[col] if col in chunk.columns else None
+    out["last_activity_at"] = (
+        aware_datetimes(chunk["last_activity_at"], tz) if "last_activity_at" in chunk.columns else pd.NaT
+    )
+    out["total_activity_time"] = numeric(chunk, "total_activity_time_in_hrs")
+    out["inactive_days"] = numeric(chunk, "inactive_days").astype("Int64")
+    for col in ENROLLMENT_FLOATS:
+        out[col] = numeric(chunk, col)
+    out = out[out["student_id"].notna()]
+    return out.apply(python_values)
+
+
+def typed_submissions(chunk, tz, issues):
+    """
+    One frame with student_id / assignment_id / submitted_at / score / status
+    (CSV text or Python values) -> Submission field columns. Rows with an
+    unusable assignment id are dropped and listed in ``issues``.
+    """
+    assignment_ids = pd.to_numeric(chunk["assignment_id"], errors="coerce")
+    bad_id = assignment_ids.isna() | (assignment_ids != assignment_ids.round())
+    issues.setdefault("invalid_assignment_ids", []).extend(chunk.loc[bad_id, "assignment_id"].tolist())
+
+    raw_score = chunk["score"]
+    score = pd.to_numeric(raw_score, errors="coerce")
+    # the ETL writes missing scores as "nan"; those are blanks, not bad values
+    blank = raw_score.isna() | raw_score.astype(str).str.strip().str.lower().isin(["", "nan"])
+    issues["invalid_scores"] = issues.get("invalid_scores", 0) + int((~blank & score.isna()).sum())
+
+    status = chunk["status"]
+    out = pd.DataFrame({
+        "student_id": chunk["student_id"],
+        "assignment_id": assignment_ids,
+        "submitted_at": aware_datetimes(chunk["submitted_at"], tz),
+        "score": score,
+        "status": status.where(status.notna() & (status != ""), "floating"),
+    })[~bad_id]
+    out["assignment_id"] = out["assignment_id"].astype("int64")
+    return out.apply(python_values)
+
+
+def enrollment_frames(path, chunksize, tz):
+    for chunk in iter_table_chunks(path, chunksize):
+        yield typed_enrollments(chunk, tz)
+
+
+def assignment_frames(path, chunksize, tz, issues):
+    for chunk in iter_table_chunks(path, chunksize, csv_as_text=True):
+        ids = pd.to_numeric(chunk["id"], errors="coerce")
+        bad = ids.isna() | (ids != ids.round())
+        issues.setdefault("invalid_assignment_ids", []).extend(chunk.loc[bad, "id"].tolist())
+        out = pd.DataFrame({
+            "id": ids[~bad].astype("int64"),
+            "title": chunk.loc[~bad, "title"],
+            "due_date": aware_datetimes(chunk.loc[~bad, "due_date"], tz),
+        })
+        out["sort_key"] = out["title"].map(natural_sort_key, na_action="ignore").fillna("")
+        yield out.apply(python_values)
+
+
+def submission_frames(path, chunksize, tz, issues):
+    for chunk in iter_table_chunks(path, chunksize, csv_as_text=True):
+        yield typed_submissions(chunk, tz, issues)
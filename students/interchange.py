@@ -0,0 +1,221 @@
+"""
+Intermediate file format shared by the fetch, ETL and import commands.
+
+Tables are written as Parquet or Feather when ``pyarrow`` is installed and as
+CSV otherwise; ``CANVAS_EXPORT_FORMAT`` (or a command's ``--format``) picks
+one. Readers locate a table by its stem (``cleaned_enrollments_data``,
+``assignments_cleaned`` ...) in whichever format is newest on disk, so legacy
+``.xlsx`` exports keep working. Excel is only written on request, as a
+human-facing copy.
+"""
+import os
+import csv
+import logging
+
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {
+    "parquet": ".parquet",
+    "feather": ".feather",
+    "csv": ".csv",
+    "xlsx": ".xlsx",
+}
+FORMATS = ("parquet", "feather", "csv")
+
+
+def get_format(fmt=None):
+    fmt = (fmt or os.getenv("CANVAS_EXPORT_FORMAT", "parquet")).lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}'; expected one of {', '.join(FORMATS)}")
+    if fmt != "csv" and pyarrow is None:
+        logger.warning(f"pyarrow is not installed; writing CSV instead of {fmt}.")
+        return "csv"
+    return fmt
+
+
+def export_xlsx_default():
+    return os.getenv("CANVAS_EXPORT_XLSX", "False").lower() == "true"
+
+
+def table_path(directory, stem, fmt=None):
+    return os.path.join(directory, stem + EXTENSIONS[get_format(fmt)])
+
+
+def find_table(directory, stem):
+    """
+    Newest existing interchange file for ``stem``, or None. A ``.xlsx`` is
+    only returned when no Parquet/Feather/CSV copy exists (legacy exports).
+    """
+    for formats in (FORMATS, ("xlsx",)):
+        existing = [
+            path for path in (os.path.join(directory, stem + EXTENSIONS[fmt]) for fmt in formats)
+            if os.path.exists(path)
+        ]
+        if existing:
+            return max(existing, key=os.path.getmtime)
+    return None
+
+
+def incomplete_marker(directory, stem):
+    """
+    Marker file present while ``stem``'s last refresh failed part-way: the
+    table on disk (if any) is an older copy, not the current state.
+    """
+    return os.path.join(directory, stem + ".incomplete")
+
+
+def _stringify_nested(df):
+    # Arrow can't store ragged dicts/lists in one column; keep the repr Excel used to write
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == object and df[col].map(lambda v: isinstance(v, (dict, list))).any():
+            df[col] = df[col].map(lambda v: str(v) if isinstance(v, (dict, list)) else v)
+    return df
+
+
+def write_table(df, directory, stem, fmt=None, xlsx=False):
+    """Write ``df`` as ``<directory>/<stem>.<fmt>`` (plus ``.xlsx`` if asked); return the path."""
+    fmt = get_format(fmt)
+    path = table_path(directory, stem, fmt)
+    if fmt == "parquet":
+        _stringify_nested(df).to_parquet(path, index=False)
+    elif fmt == "feather":
+        _stringify_nested(df).reset_index(drop=True).to_feather(path)
+    else:
+        df.to_csv(path, index=False)
+    if xlsx:
+        df.to_excel(os.path.join(directory, stem + ".xlsx"), index=False)
+    return path
+
+
+def read_table(path, columns=None):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".parquet":
+        return pd.read_parquet(path, columns=columns)
+    if ext == ".feather":
+        return pd.read_feather(path, columns=columns)
+    if ext == ".csv":
+        return pd.read_csv(path, usecols=columns)
+    return pd.read_excel(path, usecols=columns)
+
+
+def iter_table_chunks(path, chunksize, columns=None, csv_as_text=False):
+    """
+    Yield ``path`` as DataFrames of at most ``chunksize`` rows. Parquet and
+    CSV are read incrementally; Feather streams its record batches; Excel is
+    loaded once and sliced. ``csv_as_text`` reads CSV cells as raw strings
+    (blank -> ""), the way ``csv.DictReader`` sees them.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".parquet":
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+        return
+    if ext == ".csv":
+        options = {"dtype": str, "keep_default_na": False} if csv_as_text else {}
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunksize, **options)
+        return
+    if ext == ".feather":
+        with pyarrow.memory_map(path) as source:
+            reader = pyarrow.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                df = reader.get_batch(i).to_pandas()
+                df = df[columns] if columns else df
+                for start in range(0, len(df), chunksize):
+                    yield df.iloc[start:start + chunksize]
+        return
+    df = read_table(path, columns)
+    for start in range(0, len(df), chunksize):
+        yield df.iloc[start:start + chunksize]
+
+
+class TableStreamWriter:
+    """
+    Append row batches to one table without holding it in memory.
+
+    ``dtypes`` fixes each column's type up front (``object`` for text,
+    ``float64``, ``Int64``) so every Arrow batch shares one schema even when
+    a batch happens to be all-null in some column.
+    """
+
+    def __init__(self, directory, stem, dtypes, fmt=None, xlsx=False):
+        self.fmt = get_format(fmt)
+        self.path = table_path(directory, stem, self.fmt)
+        self.columns = list(dtypes)
+        self.dtypes = dtypes
+        self.rows = 0
+        self._writer = None
+        self._file = None
+        self._workbook = None
+
+        if self.fmt == "csv":
+            self._file = open(self.path, "w", newline="", encoding="utf-8")
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(self.columns)
+        else:
+            fields = []
+            for col, dtype in dtypes.items():
+                if dtype == "float64":
+                    fields.append(pyarrow.field(col, pyarrow.float64()))
+                elif dtype == "Int64":
+                    fields.append(pyarrow.field(col, pyarrow.int64()))
+                else:
+                    fields.append(pyarrow.field(col, pyarrow.string()))
+            self.schema = pyarrow.schema(fields)
+            if self.fmt == "parquet":
+                self._writer = pyarrow.parquet.ParquetWriter(self.path, self.schema)
+            else:
+                self._file = pyarrow.OSFile(self.path, "wb")
+                self._writer = pyarrow.ipc.new_file(self._file, self.schema)
+
+        if xlsx:
+            import openpyxl
+
+            self._xlsx_path = os.path.join(directory, stem + ".xlsx")
+            self._workbook = openpyxl.Workbook(write_only=True)
+            self._sheet = self._workbook.create_sheet("Sheet1")
+            self._sheet.append(self.columns)
+
+    def write_rows(self, rows):
+        if not rows:
+            return
+        self.rows += len(rows)
+        if self._workbook is not None:
+            for row in rows:
+                self._sheet.append([row.get(col) for col in self.columns])
+        if self.fmt == "csv":
+            self._writer.writerows([[row.get(col) for col in self.columns] for row in rows])
+            return
+        batch = pd.DataFrame(rows, columns=self.columns)
+        for col, dtype in self.dtypes.items():
+            if dtype == "object":
+                batch[col] = batch[col].map(lambda v: None if v is None or v != v else str(v))
+            else:
+                batch[col] = pd.to_numeric(batch[col], errors="coerce").astype(dtype)
+        self._writer.write_table(pyarrow.Table.from_pandas(batch, schema=self.schema, preserve_index=False))
+
+    def close(self):
+        if self.fmt == "csv":
+            self._file.close()
+        else:
+            self._writer.close()
+            if self._file is not None:
+                self._file.close()
+        if self._workbook is not None:
+            self._workbook.save(self._xlsx_path)
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,59 @@
+"""
+Append-only JSON Lines files for streaming fetch results to disk.
+
+Fetch workers call ``JsonlWriter.write`` from many threads; each record is
+serialised compactly and appended as one line, so readers (``iter_jsonl``)
+can consume the file one record at a time without loading it whole.
+"""
+import os
+import json
+import threading
+
+
+class JsonlWriter:
+    def __init__(self, path, mode="w"):
+        self.path = path
+        torn_tail = False
+        if mode.startswith("a") and os.path.exists(path) and os.path.getsize(path):
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                torn_tail = f.read(1) != b"\n"
+        # line-buffered: every record reaches the OS as soon as it is written
+        self._file = open(path, mode, encoding="utf-8", buffering=1)
+        if torn_tail:
+            # a killed run left half a record; terminate it so the next one starts clean
+            self._file.write("\n")
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, separators=(",", ":"), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iter_jsonl(path, skip_invalid=False):
+    """
+    Yield one decoded record per non-blank line of ``path``. With
+    ``skip_invalid`` a line that fails to decode (e.g. the torn last line of a
+    run that was killed mid-write) is skipped instead of raising.
+    """
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                if not skip_invalid:
+                    raise
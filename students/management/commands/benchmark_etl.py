@@ -0,0 +1,73 @@
+import os
+import time
+import shutil
+import filecmp
+import tempfile
+
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+from students.interchange import FORMATS, find_table, read_table, write_table
+from students.management.commands.fetch_canvas_assignments import ETL_ENGINES, _etl_paths
+
+
+class Command(BaseCommand):
+    help = "Times each assignment ETL engine (row-by-row, vectorized, chunked) and checks their CSVs are byte-identical"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--input",
+            help="Cleaned assignments table (default: newest data_exports/assignments_cleaned.*)",
+        )
+        parser.add_argument(
+            "--rows", type=int, default=0,
+            help="Tile the input up to this many rows (new student IDs per copy) to test scaling",
+        )
+        parser.add_argument("--format", choices=FORMATS, default="parquet")
+        parser.add_argument("--repeat", type=int, default=1)
+        parser.add_argument("--group-by-due-date", action="store_true")
+
+    def handle(self, *args, **kwargs):
+        source = kwargs.get("input") or find_table(os.path.join(settings.BASE_DIR, "data_exports"), "assignments_cleaned")
+        if not source or not os.path.exists(source):
+            raise CommandError("No assignments_cleaned table found; pass --input.")
+        df = read_table(source)
+
+        target_rows = kwargs.get("rows") or 0
+        if target_rows > len(df) and len(df):
+            copies = []
+            for i in range(-(-target_rows // len(df))):
+                copy = df.copy()
+                copy["Student ID"] = copy["Student ID"].astype(str) + (f"-{i}" if i else "")
+                copies.append(copy)
+            df = pd.concat(copies, ignore_index=True).head(target_rows)
+
+        work_dir = tempfile.mkdtemp(prefix="craft_etl_bench_")
+        try:
+            outputs = {}
+            for engine, etl in ETL_ENGINES.items():
+                engine_dir = os.path.join(work_dir, engine)
+                os.makedirs(engine_dir)
+                table = write_table(df, engine_dir, "assignments_cleaned", kwargs["format"])
+                timings = []
+                for _ in range(max(1, kwargs["repeat"])):
+                    start = time.perf_counter()
+                    etl(table, group_by_due_date=kwargs["group_by_due_date"])
+                    timings.append(time.perf_counter() - start)
+                outputs[engine] = _etl_paths(table)
+                self.stdout.write(f"{engine:>10}: best {min(timings):.3f}s over {len(timings)} run(s), {len(df)} rows")
+
+            baseline, *others = outputs.values()
+            identical = all(
+                filecmp.cmp(a, b, shallow=False)
+                for paths in others
+                for a, b in zip(baseline, paths)
+            )
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        if identical:
+            self.stdout.write(self.style.SUCCESS("Outputs are byte-identical."))
+        else:
+            raise CommandError("ETL outputs differ between engines.")
@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+import students
+from students.fake_canvas import start_server
+from students.management.commands.fake_canvas_server import add_roster_arguments, roster_from_options
+
+COMMANDS = {
+    "enrollments": "fetch_canvas_enrollments",
+    "assignments": "fetch_canvas_assignments",
+}
+
+
+def _peak_rss_mib(rusage):
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 2**20 if sys.platform == "darwin" else 2**10
+    return rusage.ru_maxrss * scale / 2**20
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the Canvas fetch commands against a local fake Canvas (see fake_canvas_server) for each "
+        "CANVAS_WORKERS value and reports wall time, requests/sec and peak RSS"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", default=os.getenv("CANVAS_WORKERS", "10"),
+            help="Comma-separated CANVAS_WORKERS values to compare, e.g. 1,5,10,20",
+        )
+        parser.add_argument(
+            "--commands", default="enrollments,assignments",
+            help="Which fetches to time, in order: enrollments, assignments (assignments needs enrollments)",
+        )
+        parser.add_argument("--engine", choices=["analytics", "submissions"], default="analytics")
+        parser.add_argument("--repeat", type=int, default=1, help="Runs per workers value (best is reported)")
+        parser.add_argument("--output", help="Also write the results as JSON to this path")
+        parser.add_argument("--keep", action="store_true", help="Keep the per-run work directories")
+        add_roster_arguments(parser)
+
+    def handle(self, *args, **options):
+        try:
+            workers = [int(w) for w in str(options["workers"]).split(",") if w.strip()]
+        except ValueError:
+            raise CommandError("--workers must be comma-separated integers")
+        commands = [c.strip() for c in options["commands"].split(",") if c.strip()]
+        unknown = [c for c in commands if c not in COMMANDS]
+        if unknown or not commands:
+            raise CommandError(f"--commands takes {', '.join(COMMANDS)}; got {options['commands']!r}")
+        if "assignments" in commands and "enrollments" not in commands:
+            raise CommandError("assignments reads the enrollment exports, so enrollments must run first.")
+
+        canvas = roster_from_options(options)
+        server, base_url = start_server(canvas)
+        work_root = tempfile.mkdtemp(prefix="craft_fetch_bench_")
+        project_root = os.path.dirname(os.path.dirname(os.path.abspath(students.__file__)))
+        students_total = len({sid for roster in canvas.rosters.values() for sid in roster})
+        self.stdout.write(
+            f"🧪 Fake Canvas on {base_url}: {len(canvas.course_ids)} courses, {students_total} students, "
+            f"{canvas.assignments_per_course} assignments/course, latency {canvas.latency * 1000:.0f}ms"
+        )
+
+        def run(name, run_dir, worker_count):
+            """One command in a child process whose BASE_DIR is run_dir; returns the measurements."""
+            env = dict(os.environ)
+            env.update({
+                "DJANGO_SETTINGS_MODULE": "bench_settings",
+                "PYTHONPATH": os.pathsep.join(filter(None, [run_dir, project_root, env.get("PYTHONPATH")])),
+                "CANVAS_BASE_URL": base_url,
+                "CANVAS_API_TOKEN": "fake",
+                "CANVAS_COURSE_IDS": ",".join(canvas.course_ids),
+                "CANVAS_WORKERS": str(worker_count),
+                "CANVAS_FETCH_ENGINE": options["engine"],
+                "CANVAS_LOG_LEVEL": "WARNING",
+            })
+            env.pop("CANVAS_RATE_STATE_FILE", None)  # keep limiter state inside run_dir
+            before = canvas.stats()
+            log_path = os.path.join(run_dir, f"{name}.out")
+            start = time.perf_counter()
+            with open(log_path, "w", encoding="utf-8") as log:
+                proc = subprocess.Popen(
+                    [sys.executable, "-m", "django", COMMANDS[name]],
+                    cwd=project_root, env=env, stdout=log, stderr=subprocess.STDOUT,
+                )
+                if hasattr(os, "wait4"):
+                    _, status, rusage = os.wait4(proc.pid, 0)
+                    proc.returncode = os.waitstatus_to_exitcode(status)
+                    peak = _peak_rss_mib(rusage)
+                else:
+                    proc.wait()
+                    peak = None
+            elapsed = time.perf_counter() - start
+            after = canvas.stats()
+            if proc.returncode != 0:
+                with open(log_path, encoding="utf-8", errors="replace") as f:
+                    tail = "".join(f.readlines()[-20:])
+                raise CommandError(f"{COMMANDS[name]} exited with {proc.returncode}:\n{tail}")
+            requests = after["requests"] - before["requests"]
+            statuses = {
+                code: after["statuses"].get(code, 0) - before["statuses"].get(code, 0)
+                for code in after["statuses"]
+            }
+            return {
+                "command": name,
+                "workers": worker_count,
+                "wall_seconds": round(elapsed, 3),
+                "requests": requests,
+                "requests_per_second": round(requests / elapsed, 1) if elapsed else None,
+                "throttled_429": statuses.get(429, 0),
+                "errors_5xx": sum(n for code, n in statuses.items() if code >= 500),
+                "peak_rss_mib": round(peak, 1) if peak is not None else None,
+            }
+
+        results = []
+        try:
+            for worker_count in workers:
+                best = {}
+                for attempt in range(max(1, options["repeat"])):
+                    run_dir = os.path.join(work_root, f"w{worker_count}-r{attempt}")
+                    os.makedirs(run_dir)
+                    with open(os.path.join(run_dir, "bench_settings.py"), "w", encoding="utf-8") as f:
+                        f.write(f"from {settings.SETTINGS_MODULE} import *  # noqa\n")
+                        f.write(f"BASE_DIR = {run_dir!r}\n")
+                    canvas.write_rosters(os.path.join(run_dir, "data_exports"))
+                    for name in commands:
+                        result = run(name, run_dir, worker_count)
+                        if name not in best or result["wall_seconds"] < best[name]["wall_seconds"]:
+                            best[name] = result
+                for name in commands:
+                    results.append(best[name])
+                    r = best[name]
+                    rss = f"{r['peak_rss_mib']:.1f} MiB" if r["peak_rss_mib"] is not None else "n/a"
+                    self.stdout.write(
+                        f"  {name:>11} workers={worker_count:<3} {r['wall_seconds']:>8.2f}s  "
+                        f"{r['requests']:>6} req  {r['requests_per_second']:>7.1f} req/s  "
+                        f"429s={r['throttled_429']:<4} 5xx={r['errors_5xx']:<4} peak RSS {rss}"
+                    )
+        finally:
+            server.shutdown()
+            if options["keep"]:
+                self.stdout.write(f"Run directories kept in {work_root}")
+            else:
+                shutil.rmtree(work_root, ignore_errors=True)
+
+        if options.get("output"):
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump({"roster": {
+                    "courses": len(canvas.course_ids), "students": students_total,
+                    "assignments_per_course": canvas.assignments_per_course, "latency": canvas.latency,
+                    "jitter": canvas.jitter, "error_429": canvas.error_429, "error_5xx": canvas.error_5xx,
+                    "engine": options["engine"],
+                }, "results": results}, f, indent=2)
+            self.stdout.write(f"Results saved to: {options['output']}")
+        self.stdout.write(self.style.SUCCESS("✅ Benchmark complete."))
@@ -0,0 +1,115 @@
+import os
+import csv
+import time
+import shutil
+import tempfile
+import tracemalloc
+
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.utils.timezone import make_aware, is_naive, get_current_timezone
+
+from students.models import Submission
+from students.import_loader import build_instances, submission_frames
+
+
+def _legacy_submissions(path):
+    """The importer's previous per-row parse, kept here as the baseline."""
+    def make_safe_aware(value):
+        if pd.isna(value):
+            return None
+        dt = pd.to_datetime(value, errors="coerce")
+        if pd.isna(dt):
+            return None
+        return make_aware(dt) if is_naive(dt) else dt
+
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    objects = []
+    for row in rows:
+        try:
+            score = float(row.get("score"))
+            if not pd.notna(score):
+                score = None
+        except (TypeError, ValueError):
+            score = None
+        objects.append(Submission(
+            student_id=row.get("student_id"),
+            assignment_id=int(row.get("assignment_id")),
+            submitted_at=make_safe_aware(row.get("submitted_at")),
+            score=score,
+            status=row.get("status") or "floating",
+        ))
+    return objects
+
+
+class Command(BaseCommand):
+    help = "Times the importer's per-row submission parse against the chunked, column-typed loader (no DB writes)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--input",
+            help="Submissions CSV (default: data_exports/assignments_cleaned_submissions.csv)",
+        )
+        parser.add_argument("--rows", type=int, default=100000, help="Tile the input up to this many rows")
+        parser.add_argument("--chunk-size", type=int, default=50000)
+        parser.add_argument(
+            "--memory", action="store_true",
+            help="Also report tracemalloc peak (slows both loaders considerably)",
+        )
+
+    def handle(self, *args, **kwargs):
+        source = kwargs.get("input") or os.path.join(
+            settings.BASE_DIR, "data_exports", "assignments_cleaned_submissions.csv"
+        )
+        if not os.path.exists(source):
+            raise CommandError(f"Submissions CSV not found: {source}")
+        df = pd.read_csv(source, dtype=str, keep_default_na=False)
+        if df.empty:
+            raise CommandError("Submissions CSV is empty.")
+        target_rows = kwargs["rows"]
+        if target_rows > len(df):
+            copies = []
+            for i in range(-(-target_rows // len(df))):
+                copy = df.copy()
+                copy["student_id"] = copy["student_id"] + (f"-{i}" if i else "")
+                copies.append(copy)
+            df = pd.concat(copies, ignore_index=True).head(target_rows)
+
+        work_dir = tempfile.mkdtemp(prefix="craft_import_bench_")
+        try:
+            path = os.path.join(work_dir, "submissions.csv")
+            df.to_csv(path, index=False)
+            tz = get_current_timezone()
+
+            def chunked():
+                objects = []
+                for frame in submission_frames(path, kwargs["chunk_size"], tz, {}):
+                    objects.extend(build_instances(Submission, frame))
+                return objects
+
+            results = {}
+            for label, parse in (("per-row", lambda: _legacy_submissions(path)), ("chunked", chunked)):
+                if kwargs["memory"]:
+                    tracemalloc.start()
+                start = time.perf_counter()
+                objects = parse()
+                elapsed = time.perf_counter() - start
+                line = f"{label:>8}: {elapsed:.3f}s for {len(objects)} rows ({len(objects) / elapsed:,.0f} rows/sec"
+                if kwargs["memory"]:
+                    line += f", peak {tracemalloc.get_traced_memory()[1] / 2**20:.1f} MiB"
+                    tracemalloc.stop()
+                results[label] = objects
+                self.stdout.write(line + ")")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        fields = ["student_id", "assignment_id", "submitted_at", "score", "status"]
+        baseline, chunked_objects = results["per-row"], results["chunked"]
+        same = len(baseline) == len(chunked_objects) and all(
+            getattr(a, f) == getattr(b, f) for a, b in zip(baseline, chunked_objects) for f in fields
+        )
+        if not same:
+            raise CommandError("Per-row and chunked loaders produced different submissions.")
+        self.stdout.write(self.style.SUCCESS("Both loaders produced identical submissions."))
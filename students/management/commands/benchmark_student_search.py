@@ -0,0 +1,89 @@
+import time
+import random
+import statistics
+
+from django.core.management.base import BaseCommand, CommandError
+
+from students.search_index import SEARCH_FIELDS, StudentSearchIndex
+
+FIRST_NAMES = ["Maria", "James", "Aisha", "Wei", "Carlos", "Olivia", "Noah", "Priya", "Liam", "Sofia",
+               "Mateo", "Emma", "Yusuf", "Hannah", "Diego", "Chloe", "Ethan", "Zara", "Lucas", "Mia"]
+LAST_NAMES = ["Garcia", "Smith", "Nguyen", "Patel", "Johnson", "Kim", "Martinez", "Brown", "Lopez",
+              "Williams", "Chen", "Davis", "Rodriguez", "Wilson", "Anderson", "Thomas", "Moore", "Lee"]
+
+
+def synthetic_roster(size, seed=0):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(size):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        rows.append({
+            "name": f"{first} {last}",
+            "email": f"{first.lower()}{i}@usf.edu",
+            "sis_id": f"U{10000000 + i}",
+            "section_name": f"CGS2100.{i % 12:03d}F25.1 Computers",
+            "student_id": str(5000000 + i),
+        })
+    rows.sort(key=lambda r: (r["name"], r["student_id"]))
+    return rows
+
+
+class Command(BaseCommand):
+    help = "Times first-page directory searches on the in-memory n-gram index against a linear icontains-style scan"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=50000, help="Synthetic roster size")
+        parser.add_argument("--queries", type=int, default=500)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options["rows"] < 1:
+            raise CommandError("--rows must be positive")
+        rows = synthetic_roster(options["rows"], options["seed"])
+        start = time.perf_counter()
+        index = StudentSearchIndex(rows)
+        self.stdout.write(f"🔎 Indexed {len(rows):,} students in {time.perf_counter() - start:.2f}s")
+
+        rng = random.Random(options["seed"] + 1)
+        queries = []
+        for _ in range(options["queries"]):
+            row = rng.choice(rows)
+            field = rng.choice(SEARCH_FIELDS)
+            value = row[field].lower()
+            a = rng.randrange(len(value))
+            fragment = value[a:a + rng.randint(1, 8)].strip() or value[:3]
+            if rng.random() < 0.3:  # two-token query, e.g. "mar gar"
+                other = row["name"].lower().split()[-1][:3]
+                queries.append(("q", f"{fragment} {other}"))
+            else:
+                queries.append((field, fragment))
+
+        def scan(param, text):
+            tokens = text.lower().split()
+            fields = SEARCH_FIELDS if param == "q" else (param,)
+            return [
+                r for r in rows
+                if all(any(t in (r[f] or "").lower() for f in fields) for t in tokens)
+            ]
+
+        timings = {"index": [], "scan": []}
+        for param, text in queries:
+            index._cache.clear()  # time cold queries, not the per-query cache
+            start = time.perf_counter()
+            result = index.search(**{param: text})
+            result.page(0, 50)
+            timings["index"].append(time.perf_counter() - start)
+            found = list(result)
+            start = time.perf_counter()
+            expected = scan(param, text)
+            timings["scan"].append(time.perf_counter() - start)
+            if {r["student_id"] for r in found} != {r["student_id"] for r in expected}:
+                raise CommandError(f"Index and scan disagree for {param}={text!r}")
+
+        for label, values in timings.items():
+            values.sort()
+            self.stdout.write(
+                f"{label:>6}: p50 {statistics.median(values) * 1000:.3f}ms  "
+                f"p95 {values[int(len(values) * 0.95) - 1] * 1000:.3f}ms  max {values[-1] * 1000:.3f}ms"
+            )
+        self.stdout.write(self.style.SUCCESS(f"✅ {len(queries)} queries matched the linear scan."))
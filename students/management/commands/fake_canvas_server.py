@@ -0,0 +1,73 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from students.fake_canvas import FakeCanvas, start_server
+
+
+def add_roster_arguments(parser):
+    """Synthetic roster / fault options shared with benchmark_fetch."""
+    parser.add_argument("--courses", type=int, default=2)
+    parser.add_argument("--students", type=int, default=200, help="Students per course")
+    parser.add_argument("--overlap", type=float, default=0.1, help="Share of students also in the next course")
+    parser.add_argument("--assignments", type=int, default=20, help="Assignments per course")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +/- seconds around --latency")
+    parser.add_argument("--error-429", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--error-5xx", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--bucket", type=float, default=700.0,
+                        help="Leaky-bucket capacity behind X-Rate-Limit-Remaining (0 disables throttling)")
+    parser.add_argument("--leak-rate", type=float, default=10.0, help="Bucket units drained per second")
+    parser.add_argument("--request-cost", type=float, default=1.0, help="Bucket units each request costs")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def roster_from_options(options):
+    return FakeCanvas(
+        courses=options["courses"],
+        students=options["students"],
+        overlap=options["overlap"],
+        assignments=options["assignments"],
+        latency=options["latency"],
+        jitter=options["jitter"],
+        error_429=options["error_429"],
+        error_5xx=options["error_5xx"],
+        bucket=options["bucket"],
+        leak_rate=options["leak_rate"],
+        request_cost=options["request_cost"],
+        seed=options["seed"],
+    )
+
+
+class Command(BaseCommand):
+    help = "Serve a synthetic Canvas roster (enrollments, analytics, submissions) locally for load tests"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--roster-dir", help="Also write the matching *_StudentRoster.csv files here")
+        add_roster_arguments(parser)
+
+    def handle(self, *args, **options):
+        canvas = roster_from_options(options)
+        if options.get("roster_dir"):
+            for path in canvas.write_rosters(options["roster_dir"]):
+                self.stdout.write(f"Roster written: {path}")
+        server, base_url = start_server(canvas, options["host"], options["port"])
+        students = len({sid for roster in canvas.rosters.values() for sid in roster})
+        self.stdout.write(self.style.SUCCESS(
+            f"🧪 Fake Canvas on {base_url} — {len(canvas.course_ids)} courses, {students} students"
+        ))
+        self.stdout.write("Point the fetch commands at it with:")
+        self.stdout.write(f"  CANVAS_BASE_URL={base_url} CANVAS_API_TOKEN=fake "
+                          f"CANVAS_COURSE_IDS={','.join(canvas.course_ids)}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
+            stats = canvas.stats()
+            self.stdout.write(f"\nServed {stats['requests']} requests, {stats['bytes']:,} bytes, "
+                              f"statuses {stats['statuses']}, max in flight {stats['max_in_flight']}")
@@ -1,9 +1,9 @@
 
 import os
 import csv
+import argparse
 import json
 import logging
-import requests
 import pandas as pd
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import ast
@@ -15,12 +15,415 @@ from datetime import datetime
 import glob
 import re
 import zlib
-import time
+import threading
 from collections import defaultdict
 
-class Command(BaseCommand):
+from students.canvas_client import CanvasClient
+from students.fetch_metrics import FetchMetrics
+from students.profiling import ProfiledCommand
+from students.rate_limiter import AdaptiveRateLimiter
+from students.jsonl_stream import JsonlWriter, iter_jsonl
+from students.interchange import (
+    FORMATS, TableStreamWriter, export_xlsx_default, find_table, get_format, incomplete_marker,
+    iter_table_chunks, read_table, write_table,
+)
+
+CLEANED_DTYPES = {
+    "Student ID": "object",
+    "assignment_id": "Int64",
+    "title": "object",
+    "points_possible": "float64",
+    "due_at": "object",
+    "status": "object",
+    "score": "float64",
+    "submitted_at": "object",
+}
+CLEANED_COLUMNS = list(CLEANED_DTYPES)
+
+
+def _normalize_title(t: str) -> str:
+    if not t:
+        return ""
+    return re.sub(r"\s+", " ", t).strip().lower()
+
+
+def _date_only(x):
+    if pd.isna(x):
+        return ""
+    dt = pd.to_datetime(x, errors="coerce")
+    if pd.isna(dt):
+        return ""
+    return dt.strftime("%Y-%m-%d")
+
+
+def _canon_key_id(key):
+    # stable 32-bit positive int for Django PK
+    return zlib.crc32(key.encode("utf-8")) & 0xffffffff
+
+
+ANALYTICS_URL = "courses/{}/analytics/users/{}/assignments?per_page=100"
+SUBMISSIONS_URL = "courses/{}/students/submissions"
+
+
+def get_course_ids():
+    """CANVAS_COURSE_IDS (env, else settings) as a list of ID strings."""
+    raw = os.getenv("CANVAS_COURSE_IDS") or getattr(settings, "CANVAS_COURSE_IDS", "")
+    if isinstance(raw, (list, tuple)):
+        ids = [str(c).strip() for c in raw if str(c).strip()]
+    else:
+        ids = [cid.strip() for cid in str(raw).split(",") if cid.strip()]
+    if not ids:
+        raise CommandError("CANVAS_COURSE_IDS not configured or empty")
+    return ids
+
+
+def parse_shard(value):
+    """'2/4' -> (2, 4). Shards are numbered from 1."""
+    try:
+        shard, shards = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got '{value}'")
+    if not 1 <= shard <= shards:
+        raise argparse.ArgumentTypeError(f"shard must be between 1 and N, got '{value}'")
+    return shard, shards
+
+
+def in_shard(course_id, student_id, shard, shards):
+    # crc32 rather than hash(): stable across processes and machines
+    return zlib.crc32(f"{course_id}:{student_id}".encode("utf-8")) % shards == shard - 1
+
+
+def shard_path(output_dir, shard, shards):
+    return os.path.join(output_dir, f"assignments_raw.shard-{shard}-of-{shards}.jsonl")
+
+
+def _etl_paths(file_path):
+    base_path = os.path.splitext(file_path)[0]
+    return base_path + "_assignments.csv", base_path + "_submissions.csv"
+
+
+def extract_transform_load(file_path, group_by_due_date=False):
+    """
+    Row-at-a-time ETL (reference implementation for the vectorized path).
+
+    group_by_due_date=False  -> de-dupe purely by title (recommended)
+    group_by_due_date=True   -> de-dupe by (title, date-only(due_at))
+    """
+    df = read_table(file_path)
+    assignments_csv, submissions_csv = _etl_paths(file_path)
+
+    def _canon_id(title, due_at):
+        key = _normalize_title(title)
+        if group_by_due_date:
+            key = f"{key}|{_date_only(due_at)}"
+        return _canon_key_id(key)
+
+    # maps canonical_id -> (title, chosen_due_at)
+    canon_rows = {}
+    with open(assignments_csv, mode='w', newline='', encoding='utf-8') as assignments_file, \
+        open(submissions_csv, mode='w', newline='', encoding='utf-8') as submissions_file:
+
+        assignments_writer = csv.writer(assignments_file)
+        submissions_writer = csv.writer(submissions_file)
+
+        assignments_writer.writerow(['id', 'title', 'due_date'])
+        submissions_writer.writerow(['student_id', 'assignment_id', 'submitted_at', 'score', 'status'])
+
+        for _, row in df.iterrows():
+            student_id   = row.get('Student ID')
+            title        = row.get('title')
+            due_at       = row.get('due_at')
+            status       = row.get('status')
+            submitted_at = row.get('submitted_at')
+            score        = row.get('score')
+
+            canon = _canon_id(title, due_at)
+
+            # keep first title as display; choose earliest non-null due date
+            if canon not in canon_rows:
+                canon_rows[canon] = [canon, title, due_at]
+            else:
+                prev_due = canon_rows[canon][2]
+                if pd.isna(prev_due) and not pd.isna(due_at):
+                    canon_rows[canon][2] = due_at
+                elif not pd.isna(prev_due) and not pd.isna(due_at):
+                    if pd.to_datetime(due_at) < pd.to_datetime(prev_due):
+                        canon_rows[canon][2] = due_at
+
+            # every submission now points to canonical assignment id
+            submissions_writer.writerow([student_id, canon, submitted_at, score, status])
+
+        # write unique assignments once
+        for row_out in canon_rows.values():
+            assignments_writer.writerow(row_out)
+
+    print(f"ETL complete. Files saved as:\n {assignments_csv}\n {submissions_csv}")
+
+
+def extract_transform_load_vectorized(file_path, group_by_due_date=False):
+    """
+    Column-wise equivalent of extract_transform_load; writes byte-identical CSVs.
+
+    Titles are normalised with vectorised string ops, and the regex/crc32
+    canonical ID and due-date parsing run once per *distinct* value instead
+    of once per submission row. The earliest due date per canonical
+    assignment comes from a sort + drop_duplicates (ties keep the first row
+    seen, like the row loop's strict ``<``).
+    """
+    df = read_table(file_path)
+    assignments_csv, submissions_csv = _etl_paths(file_path)
+
+    def column(name):
+        return df[name] if name in df.columns else pd.Series([None] * len(df), index=df.index, dtype=object)
+
+    titles = column("title")
+    due = column("due_at")
+
+    keys = titles.fillna("").astype(str).str.replace(r"\s+", " ", regex=True).str.strip().str.lower()
+    if group_by_due_date:
+        due_dates = due.map({v: _date_only(v) for v in due.dropna().unique()}).fillna("")
+        keys = keys + "|" + due_dates
+    canon = keys.map({k: _canon_key_id(k) for k in keys.unique()})
+
+    # earliest non-null due date per canonical id; parse each distinct value once
+    parsed = due.map({v: pd.to_datetime(v, utc=True) for v in due.dropna().unique()})
+    frame = pd.DataFrame({"canon": canon, "title": titles, "due": due, "parsed": parsed})
+    frame["pos"] = range(len(frame))
+    first = frame.drop_duplicates("canon")
+    earliest = (
+        frame[frame["due"].notna()]
+        .sort_values(["canon", "parsed", "pos"], kind="mergesort")
+        .drop_duplicates("canon")
+        .set_index("canon")["due"]
+    )
+    chosen_due = [
+        earliest[c] if c in earliest.index else d
+        for c, d in zip(first["canon"].tolist(), first["due"].tolist())
+    ]
+
+    with open(assignments_csv, mode='w', newline='', encoding='utf-8') as assignments_file, \
+        open(submissions_csv, mode='w', newline='', encoding='utf-8') as submissions_file:
+
+        assignments_writer = csv.writer(assignments_file)
+        submissions_writer = csv.writer(submissions_file)
+
+        assignments_writer.writerow(['id', 'title', 'due_date'])
+        submissions_writer.writerow(['student_id', 'assignment_id', 'submitted_at', 'score', 'status'])
+
+        submissions_writer.writerows(zip(
+            column("Student ID").tolist(),
+            canon.tolist(),
+            column("submitted_at").tolist(),
+            column("score").tolist(),
+            column("status").tolist(),
+        ))
+        assignments_writer.writerows(zip(first["canon"].tolist(), first["title"].tolist(), chosen_due))
+
+    print(f"ETL complete. Files saved as:\n {assignments_csv}\n {submissions_csv}")
+
+
+def extract_transform_load_chunked(file_path, group_by_due_date=False, chunksize=50000):
+    """
+    extract_transform_load_vectorized over ``iter_table_chunks``: same CSVs, but
+    only one chunk of the cleaned table is in memory at a time. Submissions are
+    written as each chunk is transformed; per canonical assignment only the
+    first title and the earliest due date so far are kept (ties keep the row
+    seen first), and the assignments CSV is written at the end.
+    """
+    assignments_csv, submissions_csv = _etl_paths(file_path)
+    canon_rows = {}  # canonical id -> [title, due, parsed due]; insertion order = first seen
+    canon_ids = {}   # title key -> canonical id, so each distinct key is hashed once
+
+    with open(assignments_csv, mode='w', newline='', encoding='utf-8') as assignments_file, \
+        open(submissions_csv, mode='w', newline='', encoding='utf-8') as submissions_file:
+
+        assignments_writer = csv.writer(assignments_file)
+        submissions_writer = csv.writer(submissions_file)
+
+        assignments_writer.writerow(['id', 'title', 'due_date'])
+        submissions_writer.writerow(['student_id', 'assignment_id', 'submitted_at', 'score', 'status'])
+
+        for df in iter_table_chunks(file_path, chunksize):
+            def column(name):
+                return df[name] if name in df.columns else pd.Series([None] * len(df), index=df.index, dtype=object)
+
+            titles = column("title")
+            due = column("due_at")
+            keys = titles.fillna("").astype(str).str.replace(r"\s+", " ", regex=True).str.strip().str.lower()
+            if group_by_due_date:
+                due_dates = due.map({v: _date_only(v) for v in due.dropna().unique()}).fillna("")
+                keys = keys + "|" + due_dates
+            for k in keys.unique():
+                if k not in canon_ids:
+                    canon_ids[k] = _canon_key_id(k)
+            canon = keys.map(canon_ids)
+
+            parsed = due.map({v: pd.to_datetime(v, utc=True) for v in due.dropna().unique()})
+            frame = pd.DataFrame({"canon": canon, "title": titles, "due": due, "parsed": parsed})
+            frame["pos"] = range(len(frame))
+            for c, title, d, p in frame.drop_duplicates("canon")[["canon", "title", "due", "parsed"]].itertuples(index=False):
+                if c not in canon_rows:
+                    canon_rows[c] = [title, d, p]
+            earliest = (
+                frame[frame["due"].notna()]
+                .sort_values(["canon", "parsed", "pos"], kind="mergesort")
+                .drop_duplicates("canon")
+            )
+            for c, d, p in earliest[["canon", "due", "parsed"]].itertuples(index=False):
+                entry = canon_rows[c]
+                if pd.isna(entry[1]) or p < entry[2]:
+                    entry[1], entry[2] = d, p
+
+            submissions_writer.writerows(zip(
+                column("Student ID").tolist(),
+                canon.tolist(),
+                column("submitted_at").tolist(),
+                column("score").tolist(),
+                column("status").tolist(),
+            ))
+
+        assignments_writer.writerows((c, title, d) for c, (title, d, _) in canon_rows.items())
+
+    print(f"ETL complete. Files saved as:\n {assignments_csv}\n {submissions_csv}")
+
+
+def _submission_status(sub):
+    # same vocabulary the analytics endpoint reports
+    if sub.get("submitted_at"):
+        return "late" if sub.get("late") else "on_time"
+    if sub.get("missing"):
+        return "missing"
+    return "floating"
+
+
+def analytics_item(sub):
+    """Reshape one submissions-listing entry (include[]=assignment) like an analytics item."""
+    assignment = sub.get("assignment") or {}
+    return {
+        "assignment_id": sub.get("assignment_id"),
+        "title": assignment.get("name"),
+        "points_possible": assignment.get("points_possible"),
+        # cached_due_date honours per-student overrides, like analytics does
+        "due_at": sub.get("cached_due_date") or assignment.get("due_at"),
+        "status": _submission_status(sub),
+        "submission": {
+            "score": sub.get("score"),
+            "submitted_at": sub.get("submitted_at"),
+        },
+    }
+
+
+def assignment_rows(student_id, assignments):
+    """Flatten one student's analytics items into assignments_cleaned rows."""
+    for item in assignments or []:
+        submission = item.get("submission", {})
+        yield {
+            "Student ID": student_id,
+            "assignment_id": item.get("assignment_id"),
+            "title": item.get("title"),
+            "points_possible": item.get("points_possible"),
+            "due_at": item.get("due_at"),
+            "status": item.get("status"),
+            "score": submission.get("score"),
+            "submitted_at": submission.get("submitted_at"),
+        }
+
+
+def fetch_submissions_chunk(client, course_id, chunk):
+    """
+    One paginated submissions listing for a chunk of students, reshaped into
+    analytics items per student: ({student_id: [item, ...]}, ok). Chunks are
+    disjoint, so with ok each student's list is complete; without it any
+    student's items may have been cut off.
+    """
+    params = [("student_ids[]", sid) for sid in chunk]
+    params += [("include[]", "assignment"), ("per_page", "100")]
+    items, ok = client.get_all(SUBMISSIONS_URL.format(course_id), params=params)
+
+    results = {sid: [] for sid in chunk}
+    for sub in items:
+        sid = str(sub.get("user_id"))
+        if sid in results:
+            results[sid].append(analytics_item(sub))
+    return results, ok
+
+
+ETL_ENGINES = {
+    "rows": extract_transform_load,
+    "vectorized": extract_transform_load_vectorized,
+    "chunked": extract_transform_load_chunked,
+}
+
+
+class Command(ProfiledCommand, BaseCommand):
     help = 'Fetches Canvas assignment data for students and saves raw + cleaned output'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--engine",
+            choices=["analytics", "submissions"],
+            default=os.getenv("CANVAS_FETCH_ENGINE", "analytics"),
+            help="analytics: one call per (course, student); "
+                 "submissions: course-wide submissions listing for many students per request",
+        )
+        parser.add_argument(
+            "--stream",
+            action="store_true",
+            help="Append each (course, student) result to assignments_raw.jsonl as it arrives "
+                 "and clean it incrementally instead of holding the whole run in memory",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Skip (course, student) units already recorded in the checkpoint journal "
+                 "(assignments_checkpoint.jsonl, or assignments_raw.jsonl with --stream)",
+        )
+        parser.add_argument(
+            "--format", choices=FORMATS, default=None,
+            help="Interchange format for the cleaned table (default: CANVAS_EXPORT_FORMAT or parquet)",
+        )
+        parser.add_argument(
+            "--xlsx", action="store_true", default=export_xlsx_default(),
+            help="Also write a human-facing assignments_cleaned.xlsx",
+        )
+        parser.add_argument(
+            "--etl",
+            choices=list(ETL_ENGINES),
+            default=None,
+            help="ETL implementation for the assignments/submissions CSVs (outputs are identical; "
+                 "default: chunked with --stream or --merge-shards, so the cleaned table is never "
+                 "loaded whole, else vectorized)",
+        )
+        parser.add_argument(
+            "--refresh",
+            choices=["full", "activity"],
+            default=os.getenv("CANVAS_REFRESH_MODE", "full"),
+            help="activity: only refetch students whose enrollment activity changed since the last "
+                 "run and carry everyone else over from the previous raw output",
+        )
+        parser.add_argument(
+            "--full-sweep-days", type=float, default=float(os.getenv("CANVAS_FULL_SWEEP_DAYS", "7")),
+            help="With --refresh activity, still refetch everyone when the last full run is older than this",
+        )
+        parser.add_argument(
+            "--shard", type=parse_shard, default=None, metavar="i/N",
+            help="Fetch only the i-th of N deterministic slices of the (course, student) work list "
+                 "into assignments_raw.shard-i-of-N.jsonl; combine them with --merge-shards N",
+        )
+        parser.add_argument(
+            "--merge-shards", type=int, default=None, metavar="N",
+            help="Don't fetch: merge the N shard outputs into the usual raw JSONL, cleaned table and CSVs",
+        )
+        parser.add_argument(
+            "--metrics-prom", default=os.getenv("CANVAS_METRICS_PROM") or None, metavar="PATH",
+            help="Also write the run's request metrics in Prometheus text format to PATH",
+        )
+        parser.add_argument(
+            "--all-pairs",
+            action="store_true",
+            help="Query every roster student in every course instead of routing by enrollment exports",
+        )
+
     def handle(self, *args, **kwargs):
         # === CONFIGURATION ===
         base_dir = settings.BASE_DIR
@@ -31,31 +434,40 @@ class Command(BaseCommand):
 
         log_file = os.path.join(log_dir, 'assignments_api.log')
         raw_json_file = os.path.join(output_dir, 'assignments_raw.json')
-        excel_file = os.path.join(output_dir, 'assignments_cleaned.xlsx')
+        raw_jsonl_file = os.path.join(output_dir, 'assignments_raw.jsonl')
+        checkpoint_file = os.path.join(output_dir, 'assignments_checkpoint.jsonl')
+        previous_jsonl_file = os.path.join(output_dir, 'assignments_raw.prev.jsonl')
+        activity_file = os.path.join(output_dir, 'assignments_activity.json')
+        export_format = get_format(kwargs.get("format"))
+        export_xlsx = bool(kwargs.get("xlsx"))
+
+        shard = kwargs.get("shard")
+        merge_shards = kwargs.get("merge_shards")
+        if merge_shards is not None and merge_shards < 1:
+            raise CommandError(f"--merge-shards needs the shard count (1 or more), got {merge_shards}.")
+        if shard and merge_shards:
+            raise CommandError("--shard and --merge-shards are separate steps; run them one at a time.")
+        if shard and kwargs.get("refresh") == "activity":
+            raise CommandError("--refresh activity keeps one snapshot per run and can't be combined with --shard.")
+        if shard:
+            # each shard journals to its own file; cleaning/ETL happen once, in --merge-shards
+            raw_jsonl_file = shard_path(output_dir, *shard)
 
         # Tunables (env-configurable)
         REQUEST_TIMEOUT = float(os.getenv("CANVAS_TIMEOUT", "30"))
         RETRY_LIMIT = int(os.getenv("CANVAS_RETRIES", "3"))
         BACKOFF_SECONDS = float(os.getenv("CANVAS_BACKOFF", "0.5"))
         MAX_WORKERS = int(os.getenv("CANVAS_WORKERS", "10"))
+        BULK_CHUNK = int(os.getenv("CANVAS_BULK_CHUNK", "50"))
+        RATE_STATE_FILE = os.getenv("CANVAS_RATE_STATE_FILE", os.path.join(log_dir, "canvas_rate_state.json"))
         LOG_LEVEL = os.getenv("CANVAS_LOG_LEVEL", "INFO").upper()
 
         token = os.getenv("CANVAS_API_TOKEN") or getattr(settings, "CANVAS_API_TOKEN", "")
         if not token:
             raise CommandError("CANVAS_API_TOKEN not configured")
 
-        def _get_course_ids():
-            raw = os.getenv("CANVAS_COURSE_IDS") or getattr(settings, "CANVAS_COURSE_IDS", "")
-            if isinstance(raw, (list, tuple)):
-                ids = [str(c).strip() for c in raw if str(c).strip()]
-            else:
-                ids = [cid.strip() for cid in str(raw).split(",") if cid.strip()]
-            if not ids:
-                raise CommandError("CANVAS_COURSE_IDS not configured or empty")
-            return ids
-
-        course_ids = _get_course_ids()
-        base_url_template = "https://usflearn.instructure.com/api/v1/courses/{}/analytics/users/{}/assignments?per_page=100"
+        course_ids = get_course_ids()
+        engine = kwargs.get("engine") or "analytics"
 
         # === LOGGING SETUP ===
         logger = logging.getLogger(__name__)
@@ -69,43 +481,29 @@ class Command(BaseCommand):
         logger.addHandler(stream_handler)
         logger.addHandler(file_handler)
 
+        client = CanvasClient(
+            token=token,
+            timeout=REQUEST_TIMEOUT,
+            retries=RETRY_LIMIT,
+            backoff=BACKOFF_SECONDS,
+            pool_size=MAX_WORKERS,
+            logger=logger,
+            limiter=AdaptiveRateLimiter(max_concurrency=MAX_WORKERS, state_file=RATE_STATE_FILE),
+            metrics=FetchMetrics(),
+        )
+
         def fetch_assignment_data(course_id, student_id):
             """
-            Fetch all pages of assignment analytics for a student with retry/backoff.
+            Fetch all pages of assignment analytics for a student (retry/backoff in CanvasClient).
+            Returns (student_id, items, ok); with ok False the items are only the pages
+            that arrived before the failure.
             """
-            headers = {"Authorization": f"Bearer {token}"}
-            url = base_url_template.format(course_id, student_id)
-            attempts = 0
-            results = []
-
-            while url:
-                try:
-                    resp = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
-                    if resp.status_code == 429:
-                        # rate limited; backoff and retry same page
-                        attempts += 1
-                        if attempts > RETRY_LIMIT:
-                            logger.error(f"Rate limit exceeded for student {student_id} course {course_id}; giving up.")
-                            return student_id, results or None
-                        time.sleep(BACKOFF_SECONDS * attempts)
-                        continue
-                    resp.raise_for_status()
-                    data = resp.json()
-                    if isinstance(data, list):
-                        results.extend(data)
-                    else:
-                        logger.warning(f"Unexpected response shape for student {student_id} course {course_id}")
-                    # handle pagination
-                    url = resp.links.get("next", {}).get("url")
-                    attempts = 0  # reset attempts after success
-                except requests.exceptions.RequestException as e:
-                    attempts += 1
-                    if attempts > RETRY_LIMIT:
-                        logger.error(f"Failed to fetch data for student {student_id} in course {course_id}: {e}")
-                        return student_id, results or None
-                    time.sleep(BACKOFF_SECONDS * attempts)
-            return student_id, results or None
-            
+            url = ANALYTICS_URL.format(course_id, student_id)
+            results, ok = client.get_all(url)
+            if not ok:
+                logger.error(f"Failed to fetch data for student {student_id} in course {course_id}")
+            return student_id, results or None, ok
+
         def merge_student_rosters(output_dir):
             roster_files = glob.glob(os.path.join(output_dir, '*_StudentRoster.csv'))
             if not roster_files:
@@ -119,35 +517,156 @@ class Command(BaseCommand):
             logger.info(f"Merged {len(roster_files)} roster files into {merged_path}")
             return merged_df
 
-        def fetch_all_data_concurrently(course_id, student_ids):
+        def _id_strings(series):
+            # Excel round-trips turn IDs into floats when a column has blanks
+            return {
+                str(int(v)) if isinstance(v, float) and v.is_integer() else str(v).strip()
+                for v in series.dropna()
+            }
+
+        def enrollment_export(course_id):
+            """The course's enrollment export, or None when missing or flagged incomplete."""
+            stem = f"enrollments_cleaned_{course_id}"
+            if os.path.exists(incomplete_marker(output_dir, stem)):
+                logger.warning(f"Enrollment export for course {course_id} is marked incomplete.")
+                return None
+            return find_table(output_dir, stem)
+
+        def build_work_list(course_ids, student_ids):
+            """
+            Map course_id -> roster student IDs actually enrolled in that course,
+            using the per-course enrollment exports from fetch_canvas_enrollments.
+            Courses without a complete export fall back to the whole roster.
+            """
+            work_list = {}
+            for course_id in course_ids:
+                enrollment_file = enrollment_export(course_id)
+                if enrollment_file is None:
+                    logger.warning(f"No usable enrollment export for course {course_id}; querying the full roster.")
+                    work_list[course_id] = list(student_ids)
+                    continue
+                enrolled = _id_strings(read_table(enrollment_file, columns=["Student ID"])["Student ID"])
+                work_list[course_id] = [sid for sid in student_ids if sid in enrolled]
+            return work_list
+
+        def load_activity(course_ids):
+            """
+            {"course:student": [last_activity_at, total_activity_time]} from the
+            enrollment exports. Courses without a complete export are returned separately:
+            their activity is unknown, so their students always count as changed.
+            """
+            activity, unknown_courses = {}, []
+            for course_id in course_ids:
+                enrollment_file = enrollment_export(course_id)
+                if enrollment_file is None:
+                    unknown_courses.append(course_id)
+                    continue
+                df = read_table(enrollment_file)
+                last = df["last_activity_at"] if "last_activity_at" in df.columns else pd.Series(None, index=df.index)
+                total = pd.to_numeric(df.get("total_activity_time(in_hrs)", pd.Series(None, index=df.index)), errors="coerce")
+                for sid, last_at, hours in zip(df["Student ID"].tolist(), last.tolist(), total.tolist()):
+                    sid = next(iter(_id_strings(pd.Series([sid]))), None)
+                    if sid is None:
+                        continue
+                    activity[f"{course_id}:{sid}"] = [
+                        None if pd.isna(last_at) else str(pd.Timestamp(last_at)),
+                        None if pd.isna(hours) else round(float(hours), 4),
+                    ]
+            return activity, unknown_courses
+
+        def select_active_students(work_list, activity, unknown_courses, previous):
+            """Students with any (course, student) activity that differs from the previous run."""
+            old = previous.get("activity", {})
+            changed = set()
+            for course_id, sids in work_list.items():
+                for sid in sids:
+                    key = f"{course_id}:{sid}"
+                    if course_id in unknown_courses or key not in old or old[key] != activity.get(key):
+                        changed.add(sid)
+            return changed
+
+        def iter_previous_units(path):
+            """(course_id, student_id, items) from a previous raw JSONL, or (None, ...) from raw JSON."""
+            if path.endswith(".jsonl"):
+                for record in iter_jsonl(path, skip_invalid=True):
+                    yield record["course_id"], record["student_id"], record["items"]
+                return
+            with open(path, encoding="utf-8") as f:
+                for sid, items in json.load(f).items():
+                    yield None, sid, items
+
+        def fetch_all_data_concurrently(course_id, student_ids, sink=None):
+            """
+            Fetch every student in one course on MAX_WORKERS threads.
+            With ``sink``, each worker hands its (course_id, student_id, data, ok) to
+            the sink as soon as it finishes and only its ok flag is kept here.
+            """
+            def work(sid):
+                student_id, data, ok = fetch_assignment_data(course_id, sid)
+                if sink is None:
+                    return student_id, data
+                sink(course_id, student_id, data, ok)
+                return student_id, ok
+
             results = {}
             with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-                future_to_id = {executor.submit(fetch_assignment_data, course_id, sid): sid for sid in student_ids}
+                future_to_id = {executor.submit(work, sid): sid for sid in student_ids}
                 for future in as_completed(future_to_id):
-                    sid = future_to_id[future]
                     student_id, data = future.result()
                     results[student_id] = data
             return results
 
+        def fetch_chunk(course_id, chunk, sink=None):
+            """fetch_submissions_chunk, handing each student's list to ``sink`` when given."""
+            results, ok = fetch_submissions_chunk(client, course_id, chunk)
+            if not ok:
+                logger.error(f"Failed to fetch submissions for {len(chunk)} students in course {course_id}")
+            if sink is None:
+                return {sid: (data or None) for sid, data in results.items()}
+            for sid, data in results.items():
+                # a listing that failed part-way may have cut off any student's items
+                sink(course_id, sid, data or None, ok)
+            return {sid: ok for sid in results}
+
+        def fetch_course_submissions(course_id, student_ids, sink=None):
+            """
+            Bulk engine: one paginated submissions listing per chunk of BULK_CHUNK
+            students instead of one analytics call per student. Returns the same
+            {student_id: [analytics-shaped item, ...]} mapping as
+            fetch_all_data_concurrently so clean_assignment_data is unchanged.
+            """
+            results = {}
+            chunks = [student_ids[i:i + BULK_CHUNK] for i in range(0, len(student_ids), BULK_CHUNK)]
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                futures = [executor.submit(fetch_chunk, course_id, chunk, sink) for chunk in chunks]
+                for future in as_completed(futures):
+                    results.update(future.result())
+            return results
+
         def clean_assignment_data(json_data):
             rows = []
             for student_id, assignments in json_data.items():
-                if not assignments:
-                    continue
-                for item in assignments:
-                    submission = item.get("submission", {})
-                    rows.append({
-                        "Student ID": student_id,
-                        "assignment_id": item.get("assignment_id"),
-                        "title": item.get("title"),
-                        "points_possible": item.get("points_possible"),
-                        "due_at": item.get("due_at"),
-                        "status": item.get("status"),
-                        "score": submission.get("score"),
-                        "submitted_at": submission.get("submitted_at"),
-                    })
+                rows.extend(assignment_rows(student_id, assignments))
             return pd.DataFrame(rows)
 
+        def clean_assignment_stream(jsonl_path, batch_size=5000):
+            """
+            Streaming counterpart of clean_assignment_data: read the raw JSONL one
+            record at a time and append row batches to the cleaned table, so
+            neither side ever holds the whole term in memory.
+            """
+            with TableStreamWriter(
+                output_dir, "assignments_cleaned", CLEANED_DTYPES, export_format, export_xlsx
+            ) as table:
+                batch = []
+                for record in iter_jsonl(jsonl_path, skip_invalid=True):
+                    batch.extend(assignment_rows(record["student_id"], record["items"]))
+                    if len(batch) >= batch_size:
+                        table.write_rows(batch)
+                        batch = []
+                table.write_rows(batch)
+            return table.path, table.rows
+
         # def extract_transform_load(file_path):
         #     df = pd.read_excel(file_path)
         #     assignments_csv = file_path.replace(".xlsx", "_assignments.csv")
@@ -179,80 +698,49 @@ class Command(BaseCommand):
         #             submissions_writer.writerow([student_id, assignment_id, submitted_at, score, status])
 
         #     print(f"ETL complete. Files saved as:\n {assignments_csv}\n {submissions_csv}")
-        def extract_transform_load(file_path, group_by_due_date=False):
-            """
-            group_by_due_date=False  -> de-dupe purely by title (recommended)
-            group_by_due_date=True   -> de-dupe by (title, date-only(due_at))
-            """
-            df = pd.read_excel(file_path)
-            assignments_csv = file_path.replace(".xlsx", "_assignments.csv")
-            submissions_csv = file_path.replace(".xlsx", "_submissions.csv")
-
-            def _normalize_title(t: str) -> str:
-                if not t:
-                    return ""
-                return re.sub(r"\s+", " ", t).strip().lower()
-
-            def _date_only(x):
-                if pd.isna(x):
-                    return ""
-                dt = pd.to_datetime(x, errors="coerce")
-                if pd.isna(dt):
-                    return ""
-                return dt.strftime("%Y-%m-%d")
-
-            def _canon_id(title, due_at):
-                key = _normalize_title(title)
-                if group_by_due_date:
-                    key = f"{key}|{_date_only(due_at)}"
-                # stable 32-bit positive int for Django PK
-                return zlib.crc32(key.encode("utf-8")) & 0xffffffff
-
-            # maps canonical_id -> (title, chosen_due_at)
-            canon_rows = {}
-            with open(assignments_csv, mode='w', newline='', encoding='utf-8') as assignments_file, \
-                open(submissions_csv, mode='w', newline='', encoding='utf-8') as submissions_file:
-
-                assignments_writer = csv.writer(assignments_file)
-                submissions_writer = csv.writer(submissions_file)
-
-                assignments_writer.writerow(['id', 'title', 'due_date'])
-                submissions_writer.writerow(['student_id', 'assignment_id', 'submitted_at', 'score', 'status'])
-
-                for _, row in df.iterrows():
-                    student_id   = row.get('Student ID')
-                    title        = row.get('title')
-                    due_at       = row.get('due_at')
-                    status       = row.get('status')
-                    submitted_at = row.get('submitted_at')
-                    score        = row.get('score')
-
-                    canon = _canon_id(title, due_at)
-
-                    # keep first title as display; choose earliest non-null due date
-                    if canon not in canon_rows:
-                        canon_rows[canon] = [canon, title, due_at]
-                    else:
-                        prev_due = canon_rows[canon][2]
-                        if pd.isna(prev_due) and not pd.isna(due_at):
-                            canon_rows[canon][2] = due_at
-                        elif not pd.isna(prev_due) and not pd.isna(due_at):
-                            if pd.to_datetime(due_at) < pd.to_datetime(prev_due):
-                                canon_rows[canon][2] = due_at
-
-                    # every submission now points to canonical assignment id
-                    submissions_writer.writerow([student_id, canon, submitted_at, score, status])
-
-                # write unique assignments once
-                for row_out in canon_rows.values():
-                    assignments_writer.writerow(row_out)
-
-            print(f"ETL complete. Files saved as:\n {assignments_csv}\n {submissions_csv}")
+        def write_metrics():
+            suffix = f".shard-{shard[0]}-of-{shard[1]}" if shard else ""
+            report_file = client.metrics.write_json(
+                os.path.join(output_dir, f"assignments_metrics{suffix}.json"),
+                extra={"command": "fetch_canvas_assignments", "engine": engine, "courses": dict(summary)},
+            )
+            self.stdout.write(f"Request metrics saved to: {report_file}")
+            if kwargs.get("metrics_prom"):
+                client.metrics.write_prometheus(kwargs["metrics_prom"])
 
+        def log_summary():
+            for course_id, stats in summary.items():
+                logger.info(
+                    f"[course {course_id}] students:{stats['students']} ok:{stats['ok']} "
+                    f"failed:{stats['failed']} resumed:{stats['resumed']}"
+                )
 
         # === MAIN EXECUTION ===
+        if merge_shards:
+            shards = merge_shards
+            shard_files = [shard_path(output_dir, i, shards) for i in range(1, shards + 1)]
+            missing = [path for path in shard_files if not os.path.exists(path)]
+            if missing:
+                raise CommandError(f"Missing shard outputs: {', '.join(missing)}")
+            units = 0
+            with self.profiler.stage("merge shards"), JsonlWriter(raw_jsonl_file) as merged:
+                for path in shard_files:
+                    for record in iter_jsonl(path, skip_invalid=True):
+                        merged.write(record)
+                        units += 1
+            logger.info(f"Merged {units} (course, student) units from {shards} shards into {raw_jsonl_file}")
+            with self.profiler.stage("clean + write"):
+                cleaned_file, row_count = clean_assignment_stream(raw_jsonl_file)
+            logger.info(f"Cleaned {row_count} assignment rows into {cleaned_file}")
+            with self.profiler.stage("etl"):
+                ETL_ENGINES[kwargs.get("etl") or "chunked"](cleaned_file)
+            self.stdout.write(self.style.SUCCESS(f"Raw data saved to: {raw_jsonl_file}"))
+            self.stdout.write(self.style.SUCCESS(f"Cleaned data saved to: {cleaned_file}"))
+            return
+
         logger.info("Merging student rosters...")
-        merged_roster = merge_student_rosters(output_dir)
+        with self.profiler.stage("roster"):
+            merged_roster = merge_student_rosters(output_dir)
         if merged_roster is None:
             raise CommandError("No student roster files found to derive student IDs.")
         student_ids = merged_roster["Student ID"].astype(str).dropna().unique().tolist()
@@ -260,38 +748,181 @@ class Command(BaseCommand):
             self.stdout.write(self.style.ERROR("No student IDs found in StudentRoster.csv."))
             return
 
+        if kwargs.get("all_pairs"):
+            work_list = {course_id: student_ids for course_id in course_ids}
+        else:
+            with self.profiler.stage("work list"):
+                work_list = build_work_list(course_ids, student_ids)
+        total_pairs = len(course_ids) * len(student_ids)
+        routed_pairs = sum(len(sids) for sids in work_list.values())
+        logger.info(
+            f"Work list: {routed_pairs} (course, student) pairs; "
+            f"skipped {total_pairs - routed_pairs} of {total_pairs} not backed by an enrollment."
+        )
+
+        if shard:
+            work_list = {
+                cid: [sid for sid in sids if in_shard(cid, sid, *shard)] for cid, sids in work_list.items()
+            }
+            logger.info(f"Shard {shard[0]}/{shard[1]}: {sum(len(v) for v in work_list.values())} pairs")
+
+        stream = bool(kwargs.get("stream")) or shard is not None
+        resume = bool(kwargs.get("resume"))
+
+        # === Activity-driven selection: a student with no new Canvas activity can't
+        # have new submissions, so only refetch students whose activity moved ===
+        run_started = pd.Timestamp.now(tz="UTC")
+        with self.profiler.stage("activity"):
+            activity, unknown_courses = load_activity(course_ids)
+        previous = {}
+        if os.path.exists(activity_file):
+            try:
+                with open(activity_file, encoding="utf-8") as f:
+                    previous = json.load(f)
+            except ValueError:
+                logger.warning(f"Ignoring unreadable activity snapshot {activity_file}")
+        full_sweep = True
+        carry_students = set()
+        if (kwargs.get("refresh") or "full") == "activity":
+            last_full = previous.get("full_sweep_at")
+            sweep_age = (run_started - pd.Timestamp(last_full)).total_seconds() / 86400 if last_full else None
+            # carry over from whatever the last run wrote; --stream truncates the
+            # raw JSONL, so set a previous JSONL aside first
+            previous_source = previous.get("raw_file")
+            if stream and previous_source == raw_jsonl_file:
+                if not resume and os.path.exists(raw_jsonl_file):
+                    os.replace(raw_jsonl_file, previous_jsonl_file)
+                previous_source = previous_jsonl_file
+            if sweep_age is None or sweep_age >= kwargs["full_sweep_days"]:
+                logger.info("Activity refresh: no recent full run on record; doing a full sweep.")
+            elif not previous_source or not os.path.exists(previous_source):
+                logger.warning(f"Activity refresh: previous output {previous_source} missing; doing a full sweep.")
+            else:
+                full_sweep = False
+                changed = select_active_students(work_list, activity, unknown_courses, previous)
+                carry_students = {sid for sids in work_list.values() for sid in sids} - changed
+                work_list = {cid: [sid for sid in sids if sid in changed] for cid, sids in work_list.items()}
+                logger.info(
+                    f"Activity refresh: refetching {len(changed)} students with new activity, "
+                    f"carrying over {len(carry_students)} from {previous_source} "
+                    f"(last full sweep {sweep_age:.1f} days ago)."
+                )
+
+        # Every completed (course, student) unit is journaled as one JSONL record as
+        # soon as it arrives: in --stream mode the raw JSONL *is* the journal,
+        # otherwise a separate checkpoint file is kept until the run finishes.
+        journal_file = raw_jsonl_file if stream else checkpoint_file
+
         all_data = {}
-        summary = defaultdict(lambda: {"students": 0, "ok": 0, "failed": 0})
-        for course_id in course_ids:
-            logger.info(f"Fetching assignments for {len(student_ids)} students in course {course_id}...")
-            course_data = fetch_all_data_concurrently(course_id, student_ids)
-            # for sid, data in course_data.items():
-            #     if sid not in all_data or not all_data[sid]:
-            #         all_data[sid] = data
-            for sid, data in course_data.items():
-                summary[course_id]["students"] += 1
-                if not data:
-                    summary[course_id]["failed"] += 1
+        data_lock = threading.Lock()
+        completed = set()
+        if resume and os.path.exists(journal_file):
+            for record in iter_jsonl(journal_file, skip_invalid=True):
+                completed.add((record["course_id"], record["student_id"]))
+                if record["items"] and not stream:
+                    all_data.setdefault(record["student_id"], []).extend(record["items"])
+            logger.info(f"Resuming: {len(completed)} (course, student) units already in {journal_file}")
+        elif resume:
+            logger.warning(f"--resume given but no journal at {journal_file}; starting from scratch.")
+
+        writer = JsonlWriter(journal_file, mode="a" if resume else "w")
+        failed_units = set()
+
+        def emit(course_id, student_id, data, ok):
+            # a unit whose fetch failed part-way is never journaled, so --resume
+            # refetches it instead of treating truncated pages as complete
+            if not ok:
+                with data_lock:
+                    failed_units.add(f"{course_id}:{student_id}")
+                return
+            # journaled even with no items: a student without assignments is done, not failed
+            writer.write({"course_id": course_id, "student_id": student_id, "items": data or []})
+            if data and not stream:
+                with data_lock:
+                    all_data.setdefault(student_id, []).extend(data)
+
+        carried = 0
+        if carry_students:
+            for course_id, sid, items in iter_previous_units(previous_source):
+                if sid not in carry_students or not items or (course_id, sid) in completed:
                     continue
-                if sid not in all_data or not all_data[sid]:
-                    all_data[sid] = list(data)  # make a copy
+                if stream:
+                    writer.write({"course_id": course_id, "student_id": sid, "items": items})
+                    completed.add((course_id, sid))
                 else:
-                    all_data[sid].extend(data)
-                summary[course_id]["ok"] += 1
-        with open(raw_json_file, 'w') as f:
-            json.dump(all_data, f, indent=2)
-        logger.info(f"Raw assignment data saved to {raw_json_file}")
-
-        df_cleaned = clean_assignment_data(all_data)
-        df_cleaned.to_excel(excel_file, index=False)
-        logger.info(f"Cleaned assignment data saved to {excel_file}")
-
-        extract_transform_load(excel_file)
-
-        self.stdout.write(self.style.SUCCESS(f"Raw JSON saved to: {raw_json_file}"))
-        self.stdout.write(self.style.SUCCESS(f"Cleaned Excel saved to: {excel_file}"))
-        # emit summary
-        for course_id, stats in summary.items():
-            logger.info(
-                f"[course {course_id}] students:{stats['students']} ok:{stats['ok']} failed:{stats['failed']}"
+                    all_data.setdefault(sid, []).extend(items)
+                carried += 1
+
+        summary = defaultdict(lambda: {"students": 0, "ok": 0, "failed": 0, "resumed": 0})
+        try:
+            for course_id in course_ids:
+                course_students = [sid for sid in work_list[course_id] if (course_id, sid) not in completed]
+                summary[course_id]["resumed"] = len(work_list[course_id]) - len(course_students)
+                if not course_students:
+                    logger.info(f"Nothing left to fetch in course {course_id}; skipping.")
+                    continue
+                logger.info(f"Fetching assignments for {len(course_students)} students in course {course_id} ({engine})...")
+                with self.profiler.stage("fetch"):
+                    if engine == "submissions":
+                        course_data = fetch_course_submissions(course_id, course_students, emit)
+                    else:
+                        course_data = fetch_all_data_concurrently(course_id, course_students, emit)
+                for sid, ok in course_data.items():
+                    summary[course_id]["students"] += 1
+                    summary[course_id]["ok" if ok else "failed"] += 1
+                    if not ok:
+                        failed_units.add(f"{course_id}:{sid}")
+        finally:
+            writer.close()
+
+        if shard:
+            log_summary()
+            write_metrics()
+            self.stdout.write(self.style.SUCCESS(
+                f"Shard {shard[0]}/{shard[1]} saved to: {raw_jsonl_file}. "
+                f"Run with --merge-shards {shard[1]} once every shard has finished."
+            ))
+            return
+
+        if stream:
+            raw_file = raw_jsonl_file
+            logger.info(f"Raw assignment data streamed to {raw_jsonl_file}")
+            with self.profiler.stage("clean + write"):
+                cleaned_file, row_count = clean_assignment_stream(raw_jsonl_file)
+            logger.info(f"Cleaned {row_count} assignment rows into {cleaned_file}")
+        else:
+            raw_file = raw_json_file
+            with self.profiler.stage("write raw"), open(raw_json_file, 'w') as f:
+                json.dump(all_data, f, indent=2)
+            logger.info(f"Raw assignment data saved to {raw_json_file}")
+            os.remove(checkpoint_file)  # the raw JSON now holds everything the journal did
+
+            with self.profiler.stage("clean"):
+                df_cleaned = clean_assignment_data(all_data)
+            with self.profiler.stage("write"):
+                cleaned_file = write_table(df_cleaned, output_dir, "assignments_cleaned", export_format, export_xlsx)
+            logger.info(f"Cleaned assignment data saved to {cleaned_file}")
+
+        with self.profiler.stage("etl"):
+            ETL_ENGINES[kwargs.get("etl") or ("chunked" if stream else "vectorized")](cleaned_file)
+
+        self.stdout.write(self.style.SUCCESS(f"Raw data saved to: {raw_file}"))
+        self.stdout.write(self.style.SUCCESS(f"Cleaned data saved to: {cleaned_file}"))
+        self.stdout.write(f"Requests skipped by enrollment routing: {total_pairs - routed_pairs} of {total_pairs} pairs")
+        if carry_students:
+            self.stdout.write(
+                f"Activity refresh: {len(carry_students)} unchanged students carried over "
+                f"({carried} units with assignment data), {sum(len(v) for v in work_list.values())} pairs refetched"
             )
+
+        # Snapshot this run's activity for the next --refresh activity; failed units are
+        # left out so they count as changed (and get retried) next time
+        with open(activity_file, "w", encoding="utf-8") as f:
+            json.dump({
+                "synced_at": run_started.isoformat(),
+                "raw_file": raw_file,
+                "full_sweep_at": run_started.isoformat() if full_sweep else previous.get("full_sweep_at"),
+                "activity": {k: v for k, v in activity.items() if k not in failed_units},
+            }, f)
+        log_summary()
+        write_metrics()
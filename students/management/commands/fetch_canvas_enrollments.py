@@ -2,123 +2,184 @@
 import os
 import logging
 from logging.handlers import RotatingFileHandler
-import requests
 import pandas as pd
 from ast import literal_eval
 from datetime import datetime
-import time
+from concurrent.futures import ThreadPoolExecutor
 
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 
-class Command(BaseCommand):
+from students.canvas_client import CanvasClient
+from students.fetch_metrics import FetchMetrics
+from students.profiling import ProfiledCommand
+from students.rate_limiter import AdaptiveRateLimiter
+from students.interchange import (
+    FORMATS, export_xlsx_default, find_table, get_format, incomplete_marker, read_table, write_table,
+)
+from students.management.commands.fetch_canvas_assignments import get_course_ids
+
+GRADE_COMPONENTS = [
+    'current_grade', 'current_score', 'final_grade', 'final_score',
+    'unposted_current_score', 'unposted_current_grade',
+    'unposted_final_score', 'unposted_final_grade'
+]
+
+ENROLLMENT_COLUMNS = [
+    'user_id', 'type', 'role', 'last_activity_at', 'inactive_days',
+    'total_activity_time(in_hrs)', 'sis_course_id', 'sis_section_id', 'sis_user_id', 'grades'
+]
+
+
+def _today():
+    return pd.to_datetime('today').tz_localize(None)
+
+
+def clean_data_rows(df, current_date=None):
+    """
+    Original per-row cleaner, kept as the baseline for benchmark_clean_enrollments.
+    Grades come out as "%.2f" strings ("" when missing).
+    """
+    df['last_activity_at'] = pd.to_datetime(df['last_activity_at'], errors='coerce').dt.tz_localize(None)
+    current_date = current_date if current_date is not None else _today()
+
+    df['inactive_days'] = (current_date - df['last_activity_at']).dt.days
+    df['inactive_days'] = df['inactive_days'].apply(lambda x: max(x, 0) if pd.notnull(x) else None)
+    if 'total_activity_time' in df.columns:
+        df['total_activity_time(in_hrs)'] = df['total_activity_time'] / 3600
+
+    df = df.loc[:, [col for col in ENROLLMENT_COLUMNS if col in df.columns]].copy()
+
+    df.rename(columns={'user_id': 'Student ID'}, inplace=True)
+
+    if 'grades' in df.columns:
+        def parse_grade(value):
+            if isinstance(value, dict):
+                return value
+            elif isinstance(value, str):
+                try:
+                    return literal_eval(value)
+                except:
+                    return {}
+            else:
+                return {}
+
+        df['grades'] = df['grades'].apply(parse_grade)
+
+        for component in GRADE_COMPONENTS:
+            df[component] = df['grades'].apply(
+                lambda x: f"{x.get(component):.2f}" if isinstance(x.get(component), (int, float)) else ""
+            )
+
+        df.drop('grades', axis=1, inplace=True)
+
+    return df
+
+
+def _grade_record(value):
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, str):
+        # raw exports store the dict's repr
+        try:
+            parsed = literal_eval(value)
+        except (ValueError, SyntaxError):
+            return {}
+        return parsed if isinstance(parsed, dict) else {}
+    return {}
+
+
+def clean_data(df, current_date=None):
+    """
+    Columnar cleaner: same columns as clean_data_rows, but grades are expanded
+    in one pass into float columns (rounded to 2 places, NaN when missing or
+    non-numeric) and inactive_days is a clipped nullable integer column.
+    """
+    current_date = current_date if current_date is not None else _today()
+    out = pd.DataFrame(index=df.index)
+    if 'user_id' in df.columns:
+        out['Student ID'] = df['user_id']
+    for col in ('type', 'role'):
+        if col in df.columns:
+            out[col] = df[col]
+
+    if 'last_activity_at' in df.columns:
+        last_activity = pd.to_datetime(df['last_activity_at'], errors='coerce', utc=True).dt.tz_localize(None)
+        out['last_activity_at'] = last_activity
+        out['inactive_days'] = (current_date - last_activity).dt.days.clip(lower=0).astype('Int64')
+    if 'total_activity_time' in df.columns:
+        out['total_activity_time(in_hrs)'] = pd.to_numeric(df['total_activity_time'], errors='coerce') / 3600
+    for col in ('sis_course_id', 'sis_section_id', 'sis_user_id'):
+        if col in df.columns:
+            out[col] = df[col]
+
+    if 'grades' in df.columns:
+        grades = pd.DataFrame.from_records(
+            [_grade_record(v) for v in df['grades'].tolist()],
+            columns=GRADE_COMPONENTS,
+            index=df.index,
+        )
+        for component in GRADE_COMPONENTS:
+            # letter grades and other non-numeric values become NaN, as "" did before
+            out[component] = pd.to_numeric(grades[component], errors='coerce').astype('float64').round(2)
+
+    return out
+
+
+class Command(ProfiledCommand, BaseCommand):
     help = 'Fetch and merge Canvas enrollment data from multiple courses'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--per-page", type=int, default=int(os.getenv("CANVAS_PER_PAGE", "100")),
+            help="Canvas page size for the enrollments listing (Canvas caps this at 100)",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=int(os.getenv("CANVAS_WORKERS", "10")),
+            help="Courses fetched concurrently",
+        )
+        parser.add_argument(
+            "--format", choices=FORMATS, default=None,
+            help="Interchange format for raw/cleaned exports (default: CANVAS_EXPORT_FORMAT or parquet)",
+        )
+        parser.add_argument(
+            "--xlsx", action="store_true", default=export_xlsx_default(),
+            help="Also write human-facing .xlsx copies of every export",
+        )
+        parser.add_argument(
+            "--page-workers", type=int, default=int(os.getenv("CANVAS_PAGE_WORKERS", "4")),
+            help="Pages prefetched concurrently per course when Canvas exposes rel=last",
+        )
+        parser.add_argument(
+            "--metrics-prom", default=os.getenv("CANVAS_METRICS_PROM") or None, metavar="PATH",
+            help="Also write the run's request metrics in Prometheus text format to PATH",
+        )
+
     def handle(self, *args, **kwargs):
         base_dir = settings.BASE_DIR
         output_dir = os.path.join(base_dir, "data_exports")
         os.makedirs(output_dir, exist_ok=True)
 
-        final_cleaned_file = os.path.join(output_dir, 'cleaned_enrollments_data.xlsx')
+        export_format = get_format(kwargs.get("format"))
+        export_xlsx = bool(kwargs.get("xlsx"))
 
         # Tunables
         REQUEST_TIMEOUT = float(os.getenv("CANVAS_TIMEOUT", "30"))
         RETRY_LIMIT = int(os.getenv("CANVAS_RETRIES", "3"))
         BACKOFF_SECONDS = float(os.getenv("CANVAS_BACKOFF", "0.5"))
         LOG_LEVEL = os.getenv("CANVAS_LOG_LEVEL", "INFO").upper()
+        PER_PAGE = kwargs.get("per_page") or 100
+        COURSE_WORKERS = max(1, kwargs.get("workers") or 1)
+        PAGE_WORKERS = max(1, kwargs.get("page_workers") or 1)
+        RATE_STATE_FILE = os.getenv(
+            "CANVAS_RATE_STATE_FILE", os.path.join(base_dir, "log", "canvas_rate_state.json")
+        )
 
         bearer_token = os.getenv("CANVAS_API_TOKEN") or getattr(settings, "CANVAS_API_TOKEN", "")
         if not bearer_token:
             raise CommandError("CANVAS_API_TOKEN not configured")
-        headers = {"Authorization": f"Bearer {bearer_token}"}
 
-        def _get_course_ids():
-            raw = os.getenv("CANVAS_COURSE_IDS") or getattr(settings, "CANVAS_COURSE_IDS", "")
-            if isinstance(raw, (list, tuple)):
-                ids = [str(c).strip() for c in raw if str(c).strip()]
-            else:
-                ids = [cid.strip() for cid in str(raw).split(",") if cid.strip()]
-            if not ids:
-                raise CommandError("CANVAS_COURSE_IDS not configured or empty")
-            return ids
-
-        course_ids = _get_course_ids()
-
-        def get_all_data(api_url, headers):
-            all_data = []
-            attempts = 0
-            logger = logging.getLogger(__name__)
-            while api_url:
-                try:
-                    response = requests.get(api_url, headers=headers, timeout=REQUEST_TIMEOUT)
-                    if response.status_code == 429:
-                        attempts += 1
-                        if attempts > RETRY_LIMIT:
-                            logger.error(f"Rate limit exceeded for {api_url}; giving up.")
-                            break
-                        time.sleep(BACKOFF_SECONDS * attempts)
-                        continue
-                    if response.status_code == 200:
-                        data = response.json()
-                        all_data.extend(data)
-                        api_url = response.links['next']['url'] if 'next' in response.links else None
-                        attempts = 0
-                    else:
-                        logger.warning(f"Failed to fetch data. Status code: {response.status_code}")
-                        break
-                except requests.exceptions.RequestException as e:
-                    attempts += 1
-                    if attempts > RETRY_LIMIT:
-                        logger.error(f"Failed to fetch data from {api_url}: {e}")
-                        break
-                    time.sleep(BACKOFF_SECONDS * attempts)
-            return all_data
-
-        def clean_data(df):
-            df['last_activity_at'] = pd.to_datetime(df['last_activity_at'], errors='coerce').dt.tz_localize(None)
-            current_date = pd.to_datetime('today').tz_localize(None)
-
-            df['inactive_days'] = (current_date - df['last_activity_at']).dt.days
-            df['inactive_days'] = df['inactive_days'].apply(lambda x: max(x, 0) if pd.notnull(x) else None)
-            if 'total_activity_time' in df.columns:
-                df['total_activity_time(in_hrs)'] = df['total_activity_time'] / 3600
-
-            columns_to_keep = [
-                'user_id', 'type', 'role', 'last_activity_at', 'inactive_days',
-                'total_activity_time(in_hrs)', 'sis_course_id', 'sis_section_id', 'sis_user_id', 'grades'
-            ]
-            df = df.loc[:, [col for col in columns_to_keep if col in df.columns]].copy()
-
-            df.rename(columns={'user_id': 'Student ID'}, inplace=True)
-
-            if 'grades' in df.columns:
-                def parse_grade(value):
-                    if isinstance(value, dict):
-                        return value
-                    elif isinstance(value, str):
-                        try:
-                            return literal_eval(value)
-                        except:
-                            return {}
-                    else:
-                        return {}
-
-                df['grades'] = df['grades'].apply(parse_grade)
-
-                grade_components = [
-                    'current_grade', 'current_score', 'final_grade', 'final_score',
-                    'unposted_current_score', 'unposted_current_grade',
-                    'unposted_final_score', 'unposted_final_grade'
-                ]
-
-                for component in grade_components:
-                    df[component] = df['grades'].apply(
-                        lambda x: f"{x.get(component):.2f}" if isinstance(x.get(component), (int, float)) else ""
-                    )
-
-                df.drop('grades', axis=1, inplace=True)
-
-            return df
+        course_ids = get_course_ids()
 
         all_dataframes = []
 
@@ -135,33 +196,93 @@ class Command(BaseCommand):
         logger.addHandler(sh)
         logger.addHandler(fh)
 
-        for course_id in course_ids:
-            api_url = f"https://usflearn.instructure.com/api/v1/courses/{course_id}/enrollments"
-            raw_file = os.path.join(output_dir, f'enrollments_raw_{course_id}.xlsx')
-            cleaned_file = os.path.join(output_dir, f'enrollments_cleaned_{course_id}.xlsx')
+        client = CanvasClient(
+            token=bearer_token,
+            timeout=REQUEST_TIMEOUT,
+            retries=RETRY_LIMIT,
+            backoff=BACKOFF_SECONDS,
+            logger=logger,
+            limiter=AdaptiveRateLimiter(
+                max_concurrency=COURSE_WORKERS * PAGE_WORKERS, state_file=RATE_STATE_FILE
+            ),
+            metrics=FetchMetrics(),
+        )
+
+        def process_course(course_id):
+            api_url = f"courses/{course_id}/enrollments"
 
             logger.info(f"Starting data fetch from Canvas API for course {course_id}...")
-            all_data = get_all_data(api_url, headers)
+            with self.profiler.stage("fetch"):
+                all_data, ok = client.get_all_pages(api_url, params={"per_page": PER_PAGE}, max_workers=PAGE_WORKERS)
+            marker = incomplete_marker(output_dir, f"enrollments_cleaned_{course_id}")
+            if not ok:
+                # a partial listing would silently drop students from assignment routing;
+                # keep the last complete export and flag the course instead
+                logger.error(f"Enrollment listing for course {course_id} failed part-way; keeping the previous export.")
+                open(marker, "w").close()
+                return None, None, None, False
+            if not all_data:
+                logger.warning(f"No data was fetched from the API for course {course_id}.")
+                return None, None, None, True
 
-            if all_data:
+            with self.profiler.stage("write raw"):
                 df_raw = pd.DataFrame(all_data)
-                df_raw.to_excel(raw_file, index=False)
-                logger.info(f"Raw data saved to: {raw_file}")
+                raw_file = write_table(df_raw, output_dir, f"enrollments_raw_{course_id}", export_format, export_xlsx)
+            logger.info(f"Raw data saved to: {raw_file}")
 
+            with self.profiler.stage("clean"):
                 df_cleaned = clean_data(df_raw)
-                df_cleaned.to_excel(cleaned_file, index=False)
-                logger.info(f"Cleaned data saved to: {cleaned_file}")
+            with self.profiler.stage("write"):
+                cleaned_file = write_table(
+                    df_cleaned, output_dir, f"enrollments_cleaned_{course_id}", export_format, export_xlsx
+                )
+            logger.info(f"Cleaned data saved to: {cleaned_file}")
+            if os.path.exists(marker):
+                os.remove(marker)
+            return df_cleaned, raw_file, cleaned_file, True
+
+        # Fan out across courses; merge in configured course order so output is stable
+        with self.profiler.stage("courses"), \
+                ThreadPoolExecutor(max_workers=min(COURSE_WORKERS, len(course_ids))) as executor:
+            course_results = list(executor.map(process_course, course_ids))
 
+        failed_courses = []
+        for course_id, (df_cleaned, raw_file, cleaned_file, ok) in zip(course_ids, course_results):
+            if df_cleaned is not None:
                 all_dataframes.append(df_cleaned)
                 self.stdout.write(self.style.SUCCESS(f"Raw file saved: {raw_file}"))
                 self.stdout.write(self.style.SUCCESS(f"Cleaned file saved: {cleaned_file}"))
+            elif not ok:
+                failed_courses.append(course_id)
+                previous_file = find_table(output_dir, f"enrollments_cleaned_{course_id}")
+                if previous_file:
+                    all_dataframes.append(read_table(previous_file))
+                    self.stdout.write(self.style.ERROR(
+                        f"❌ Fetch failed for course {course_id}; merged its previous export {previous_file} "
+                        f"and marked it incomplete (assignment fetches will query the full roster)."
+                    ))
+                else:
+                    self.stdout.write(self.style.ERROR(
+                        f"❌ Fetch failed for course {course_id} and there is no previous export; "
+                        f"marked it incomplete (assignment fetches will query the full roster)."
+                    ))
             else:
-                logger.warning("No data was fetched from the API.")
                 self.stdout.write(self.style.WARNING(f"No data fetched from API for course {course_id}"))
 
         if all_dataframes:
-            final_df = pd.concat(all_dataframes, ignore_index=True)
-            final_df.to_excel(final_cleaned_file, index=False)
+            with self.profiler.stage("merge + write"):
+                final_df = pd.concat(all_dataframes, ignore_index=True)
+                final_cleaned_file = write_table(
+                    final_df, output_dir, "cleaned_enrollments_data", export_format, export_xlsx
+                )
             self.stdout.write(self.style.SUCCESS(f"Merged cleaned data saved to: {final_cleaned_file}"))
         else:
             self.stdout.write(self.style.WARNING("No data to merge into final cleaned file."))
+
+        report_file = client.metrics.write_json(
+            os.path.join(output_dir, "enrollments_metrics.json"),
+            extra={"command": "fetch_canvas_enrollments", "courses": course_ids, "failed_courses": failed_courses},
+        )
+        self.stdout.write(f"Request metrics saved to: {report_file}")
+        if kwargs.get("metrics_prom"):
+            client.metrics.write_prometheus(kwargs["metrics_prom"])
@@ -1,16 +1,49 @@
 import os
 import csv
+import time
 import pandas as pd
 from datetime import datetime
-from django.utils.timezone import make_aware, is_naive
+from django.utils.timezone import get_current_timezone
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 from django.db import transaction
-from students.models import Studentlist, Enrollment, Assignment, Submission
+from students import picklists, search_index, staging
+from students.bulk_load import BACKENDS, BulkInserter
+from students.profiling import ProfiledCommand
+from students.models import Studentlist, Enrollment, Assignment, Submission, DatasetVersion
+from students.interchange import EXTENSIONS, find_table, get_format, iter_table_chunks
+from students.import_loader import (
+    assignment_frames, build_instances, enrollment_frames, normalize_column, submission_frames,
+)
 
+ENROLLMENT_FIELDS = [
+    "type", "role", "last_activity_at", "total_activity_time", "sis_course_id",
+    "sis_section_id", "sis_user_id", "inactive_days", "current_grade", "current_score",
+    "final_grade", "final_score", "unposted_current_score", "unposted_current_grade",
+    "unposted_final_score", "unposted_final_grade",
+]
 
-class Command(BaseCommand):
-    help = "Wipes and imports students, enrollments, assignments, and submissions."
+
+class Command(ProfiledCommand, BaseCommand):
+    help = "Imports students, enrollments, assignments, and submissions (wipe-and-reload or incremental upsert)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--mode",
+            choices=["replace", "upsert", "staged"],
+            default=os.getenv("IMPORT_MODE", "replace"),
+            help="replace: delete everything and bulk insert; "
+                 "upsert: diff against existing rows by natural key and apply only the changes; "
+                 "staged: load shadow tables, then swap them in with a quick rename",
+        )
+
+        parser.add_argument(
+            "--bulk-backend",
+            choices=BACKENDS,
+            default=None,
+            help="How enrollments/submissions are inserted: odbc (pyodbc fast_executemany, SQL Server only), "
+                 "orm (bulk_create) or auto (default; IMPORT_BULK_BACKEND)",
+        )
 
     def handle(self, *args, **kwargs):
         base_dir = settings.BASE_DIR
@@ -18,217 +51,280 @@ class Command(BaseCommand):
 
         # === File paths ===
         student_roster_file = os.path.join(data_dir, "StudentRoster.csv")
-        enrollment_file = os.path.join(data_dir, "cleaned_enrollments_data.xlsx")
+        # Parquet/Feather/CSV from fetch_canvas_enrollments, or a legacy .xlsx export
+        enrollment_file = find_table(data_dir, "cleaned_enrollments_data") or os.path.join(
+            data_dir, "cleaned_enrollments_data" + EXTENSIONS[get_format()]
+        )
         assignments_file = os.path.join(data_dir, "assignments_cleaned_assignments.csv")
         submissions_file = os.path.join(data_dir, "assignments_cleaned_submissions.csv")
 
-        # === Utility for datetime ===
-        def make_safe_aware(value):
-            if pd.isna(value):
-                return None
-            dt = pd.to_datetime(value, errors="coerce")
-            if pd.isna(dt):
-                return None
-            return make_aware(dt) if is_naive(dt) else dt
-
         # === Preflight: ensure files exist ===
         for required_path in [student_roster_file, enrollment_file, assignments_file, submissions_file]:
             if not os.path.exists(required_path):
                 raise CommandError(f"Required file missing: {required_path}")
 
-        # === Load inputs first (fail fast before wiping DB) ===
-        with open(student_roster_file, newline='', encoding='utf-8') as f:
-            roster_reader = csv.DictReader(f)
-            roster_rows = list(roster_reader)
-        if not roster_rows:
-            raise CommandError("StudentRoster.csv is empty or unreadable.")
-        required_student_cols = {"Student Name", "Student ID", "Student SIS ID", "Email", "Section Name"}
-        if not required_student_cols.issubset(set(roster_rows[0].keys())):
-            raise CommandError(f"StudentRoster.csv missing required columns: {required_student_cols}")
-
-        enrollments_df = pd.read_excel(enrollment_file)
-        # Normalize column names to resilient snake_case for attribute access
-        enrollments_df = enrollments_df.rename(
-            columns=lambda c: str(c)
-            .strip()
-            .lower()
-            .replace(" ", "_")
-            .replace("(", "")
-            .replace(")", "")
-            .replace("/", "_")
-        )
-        if "student_id" not in enrollments_df.columns:
-            raise CommandError("Enrollment file missing required 'Student ID' column.")
-
-        with open(assignments_file, newline='', encoding='utf-8') as f:
-            assignments_reader = list(csv.DictReader(f))
-        if not assignments_reader:
-            raise CommandError("Assignments CSV is empty or unreadable.")
-
-        with open(submissions_file, newline='', encoding='utf-8') as f:
-            submissions_reader = list(csv.DictReader(f))
-
-        # === Clear + import inside a transaction ===
-        with transaction.atomic():
-            self.stdout.write("⚠️ Deleting existing records...")
-            Submission.objects.all().delete()
-            Assignment.objects.all().delete()
-            Enrollment.objects.all().delete()
-            Studentlist.objects.all().delete()
-            self.stdout.write(self.style.WARNING("✅ All existing data cleared."))
-
-            # === Import Students ===
-            self.stdout.write("📥 Importing Student Roster...")
-            students = [
-                Studentlist(
+        batch_size = int(os.getenv("IMPORT_BATCH_SIZE", "2000"))
+        chunk_size = int(os.getenv("IMPORT_CHUNK_SIZE", "50000"))
+        tz = get_current_timezone()
+
+        # === Check inputs first (fail fast before wiping DB); bulk rows are streamed later ===
+        with self.profiler.stage("preflight"):
+            with open(student_roster_file, newline='', encoding='utf-8') as f:
+                roster_reader = csv.DictReader(f)
+                roster_rows = list(roster_reader)
+            if not roster_rows:
+                raise CommandError("StudentRoster.csv is empty or unreadable.")
+            required_student_cols = {"Student Name", "Student ID", "Student SIS ID", "Email", "Section Name"}
+            if not required_student_cols.issubset(set(roster_rows[0].keys())):
+                raise CommandError(f"StudentRoster.csv missing required columns: {required_student_cols}")
+
+            enrollment_head = next(iter_table_chunks(enrollment_file, 1), pd.DataFrame())
+            if "student_id" not in {normalize_column(c) for c in enrollment_head.columns}:
+                raise CommandError("Enrollment file missing required 'Student ID' column.")
+
+            if next(iter_table_chunks(assignments_file, 1), pd.DataFrame()).empty:
+                raise CommandError("Assignments CSV is empty or unreadable.")
+
+            submission_cols = set(pd.read_csv(submissions_file, nrows=0).columns)
+            required_submission_cols = {"student_id", "assignment_id", "submitted_at", "score", "status"}
+            if not required_submission_cols.issubset(submission_cols):
+                raise CommandError(f"Submissions CSV missing required columns: {required_submission_cols}")
+
+        # === Build model instances from the inputs (FKs by raw id, no DB lookups) ===
+        def iter_students(model=Studentlist):
+            for row in roster_rows:
+                yield model(
                     name=row["Student Name"],
                     student_id=row["Student ID"],
                     sis_id=row["Student SIS ID"],
                     email=row["Email"],
                     section_name=row["Section Name"]
                 )
-                for row in roster_rows
-            ]
-            Studentlist.objects.bulk_create(students)
-            self.stdout.write(self.style.SUCCESS(f"✅ Imported {len(students)} students."))
 
-            # === Import Enrollments ===
-            self.stdout.write("📥 Importing Enrollments...")
-            enrollments = []
-            batch_size = int(os.getenv("IMPORT_BATCH_SIZE", "2000"))
-            count = 0
-
-            students_map = {s.student_id: s for s in Studentlist.objects.all()}
-
-            def _safe_val(val):
-                return val if pd.notna(val) else None
-
-            for row in enrollments_df.itertuples(index=False, name="EnrollRow"):
-                raw_id = getattr(row, "student_id", None)
-                student_id = str(raw_id).strip() if raw_id is not None else ""
-                student = students_map.get(student_id)
-                if not student:
-                    continue
-
-                last_active = make_safe_aware(getattr(row, "last_activity_at", None))
-                inactive_days_val = getattr(row, "inactive_days", None)
-                inactive_days = int(inactive_days_val) if pd.notna(inactive_days_val) else None
-
-                enrollments.append(Enrollment(
-                    student=student,
-                    type=_safe_val(getattr(row, "type", None)),
-                    role=_safe_val(getattr(row, "role", None)),
-                    last_activity_at=last_active,
-                    total_activity_time=_safe_val(getattr(row, "total_activity_time_in_hrs", None)),
-                    sis_course_id=_safe_val(getattr(row, "sis_course_id", None)),
-                    sis_section_id=_safe_val(getattr(row, "sis_section_id", None)),
-                    sis_user_id=_safe_val(getattr(row, "sis_user_id", None)),
-                    inactive_days=inactive_days,
-                    current_grade=_safe_val(getattr(row, "current_grade", None)),
-                    current_score=_safe_val(getattr(row, "current_score", None)),
-                    final_grade=_safe_val(getattr(row, "final_grade", None)),
-                    final_score=_safe_val(getattr(row, "final_score", None)),
-                    unposted_current_score=_safe_val(getattr(row, "unposted_current_score", None)),
-                    unposted_current_grade=_safe_val(getattr(row, "unposted_current_grade", None)),
-                    unposted_final_score=_safe_val(getattr(row, "unposted_final_score", None)),
-                    unposted_final_grade=_safe_val(getattr(row, "unposted_final_grade", None)),
+        def iter_enrollments(student_ids, model=Enrollment):
+            for frame in enrollment_frames(enrollment_file, chunk_size, tz):
+                yield from build_instances(model, frame[frame["student_id"].isin(student_ids)])
+
+        def iter_assignments(model=Assignment):
+            issues = {}
+            for frame in assignment_frames(assignments_file, chunk_size, tz, issues):
+                yield from build_instances(model, frame)
+            for bad_id in issues.get("invalid_assignment_ids", []):
+                self.stdout.write(self.style.ERROR(f"Invalid assignment ID in CSV: {bad_id}"))
+
+        def iter_submissions(student_ids, assignment_ids, model=Submission):
+            issues = {}
+            missing_students, missing_assignments = set(), set()
+            for frame in submission_frames(submissions_file, chunk_size, tz, issues):
+                known_student = frame["student_id"].isin(student_ids)
+                known_assignment = frame["assignment_id"].isin(assignment_ids)
+                missing_students.update(frame.loc[~known_student, "student_id"])
+                missing_assignments.update(frame.loc[known_student & ~known_assignment, "assignment_id"])
+                yield from build_instances(model, frame[known_student & known_assignment])
+
+            for student_id in sorted(missing_students, key=str):
+                self.stdout.write(self.style.WARNING(f"❌ Student not found: {student_id}"))
+            for bad_id in issues.get("invalid_assignment_ids", []):
+                self.stdout.write(self.style.ERROR(f"❌ Invalid assignment ID: {bad_id}"))
+            for assignment_id in sorted(missing_assignments):
+                self.stdout.write(self.style.WARNING(f"❌ Assignment not found: {assignment_id}"))
+            if issues.get("invalid_scores"):
+                self.stdout.write(self.style.WARNING(
+                    f"⚠️ {issues['invalid_scores']} submissions had a non-numeric score. Set to NULL."
                 ))
 
-                if len(enrollments) >= batch_size:
-                    Enrollment.objects.bulk_create(enrollments, batch_size=batch_size)
-                    count += len(enrollments)
-                    self.stdout.write(f"✅ Inserted {count} enrollments so far...")
-                    enrollments = []
+        try:
+            inserter = BulkInserter(kwargs.get("bulk_backend"), batch_size=batch_size)
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"🚚 Bulk insert backend: {inserter.backend}")
 
-            if enrollments:
-                Enrollment.objects.bulk_create(enrollments, batch_size=batch_size)
-                count += len(enrollments)
+        def insert_batched(model, objects, label):
+            batch, count = [], 0
+            for obj in objects:
+                batch.append(obj)
+                if len(batch) >= batch_size:
+                    count += inserter.insert(model, batch)
+                    self.stdout.write(f"✅ Inserted {count} {label} so far...")
+                    batch = []
+            if batch:
+                count += inserter.insert(model, batch)
+            rows, per_sec = inserter.rate(model)
+            if rows:
+                self.stdout.write(f"⏱️ {label}: {rows} rows at {per_sec:,.0f} rows/sec ({inserter.backend})")
+            return count
 
-            self.stdout.write(self.style.SUCCESS(f"✅ Imported {count} enrollments."))
+        def import_replace(models=None):
+            """Bulk insert everything; into the live tables (wiped first) or into ``models`` (shadow tables)."""
+            if models is None:
+                models = {m: m for m in (Studentlist, Assignment, Enrollment, Submission)}
+                self.stdout.write("⚠️ Deleting existing records...")
+                with self.profiler.stage("clear tables"):
+                    Submission.objects.all().delete()
+                    Assignment.objects.all().delete()
+                    Enrollment.objects.all().delete()
+                    Studentlist.objects.all().delete()
+                self.stdout.write(self.style.WARNING("✅ All existing data cleared."))
+            counts = {}
+
+            self.stdout.write("📥 Importing Student Roster...")
+            with self.profiler.stage("import students"):
+                students = list(iter_students(models[Studentlist]))
+                models[Studentlist].objects.bulk_create(students)
+            student_ids = {s.student_id for s in students}
+            counts["students"] = len(students)
+            self.stdout.write(self.style.SUCCESS(f"✅ Imported {len(students)} students."))
+
+            self.stdout.write("📥 Importing Enrollments...")
+            with self.profiler.stage("import enrollments"):
+                counts["enrollments"] = insert_batched(
+                    models[Enrollment], iter_enrollments(student_ids, models[Enrollment]), "enrollments"
+                )
+            self.stdout.write(self.style.SUCCESS(f"✅ Imported {counts['enrollments']} enrollments."))
 
-            # === Import Assignments ===
             self.stdout.write("📥 Importing Assignments...")
-            assignments = []
-            for row in assignments_reader:
-                try:
-                    assignment_id = int(row["id"])
-                except (ValueError, TypeError):
-                    self.stdout.write(self.style.ERROR(f"Invalid assignment ID in CSV: {row.get('id')}"))
-                    continue
-
-                due = pd.to_datetime(row.get("due_date"), errors='coerce')
-                assignments.append(Assignment(
-                    id=assignment_id,
-                    title=row["title"],
-                    due_date=make_safe_aware(due) if pd.notna(due) else None
-                ))
-            Assignment.objects.bulk_create(assignments)
+            with self.profiler.stage("import assignments"):
+                assignments = list(iter_assignments(models[Assignment]))
+                models[Assignment].objects.bulk_create(assignments)
+            assignment_ids = {a.id for a in assignments}
+            counts["assignments"] = len(assignments)
             self.stdout.write(self.style.SUCCESS(f"✅ Imported {len(assignments)} assignments."))
 
-            # === Import Submissions ===
             self.stdout.write("📥 Importing Submissions...")
-            
-            # Preload lookups to avoid N+1 queries
-            students_map = {s.student_id: s for s in Studentlist.objects.all()}
-            assignments_map = {a.id: a for a in Assignment.objects.all()}
-            
-            submissions = []
-            batch_size = int(os.getenv("IMPORT_BATCH_SIZE", "2000"))
-            count = 0
-            
-            for row in submissions_reader:
-                # Resolve student quickly
-                student = students_map.get(row.get("student_id"))
-                if not student:
-                    self.stdout.write(self.style.WARNING(f"❌ Student not found: {row.get('student_id')}"))
-                    continue
-        
-                # Resolve assignment quickly
-                try:
-                    assignment_id = int(row.get("assignment_id"))
-                except (ValueError, TypeError):
-                    self.stdout.write(self.style.ERROR(f"❌ Invalid assignment ID: {row.get('assignment_id')}"))
-                    continue
-        
-                assignment = assignments_map.get(assignment_id)
-                if not assignment:
-                    self.stdout.write(self.style.WARNING(f"❌ Assignment not found: {assignment_id}"))
-                    continue
-        
-                # Convert submission datetime
-                submitted = make_safe_aware(row.get("submitted_at"))
-        
-                # Parse score safely
-                raw_score = row.get("score")
-                try:
-                    score = float(raw_score)
-                    if not pd.notna(score):  # catches NaN
-                        score = None
-                except (TypeError, ValueError):
-                    self.stdout.write(self.style.WARNING(
-                        f"⚠️ Invalid score '{raw_score}' for student {row.get('student_id')} assignment {row.get('assignment_id')}. Setting to NULL."
-                    ))
-                    score = None
-        
-                submissions.append(Submission(
-                    student=student,
-                    assignment=assignment,
-                    submitted_at=submitted,
-                    score=score,
-                    status=row.get("status") or "floating"
+            with self.profiler.stage("import submissions"):
+                counts["submissions"] = insert_batched(
+                    models[Submission], iter_submissions(student_ids, assignment_ids, models[Submission]),
+                    "submissions",
+                )
+            self.stdout.write(self.style.SUCCESS(f"✅ Imported {counts['submissions']} submissions."))
+            return counts
+
+        # === Upsert: diff incoming rows against the table by natural key ===
+        def diff_table(model, incoming, key, fields):
+            """
+            Compare ``incoming`` instances with the rows already in ``model``,
+            matched on ``key(obj)``. Existing rows whose ``fields`` differ get
+            the new values copied in and are returned for ``bulk_update``.
+            """
+            incoming_by_key = {}
+            for obj in incoming:
+                incoming_by_key[key(obj)] = obj  # last row wins on duplicate keys
+            # to_python() so e.g. a numeric sis_user_id from Parquet equals the stored string
+            to_python = {f: model._meta.get_field(f).to_python for f in fields}
+            diff = {"create": [], "update": [], "delete": [], "unchanged": 0}
+            for current in model.objects.all().iterator(chunk_size=batch_size):
+                new = incoming_by_key.pop(key(current), None)
+                if new is None:
+                    diff["delete"].append(current.pk)
+                elif any(to_python[f](getattr(current, f)) != to_python[f](getattr(new, f)) for f in fields):
+                    for f in fields:
+                        setattr(current, f, getattr(new, f))
+                    diff["update"].append(current)
+                else:
+                    diff["unchanged"] += 1
+            diff["create"] = list(incoming_by_key.values())
+            return diff
+
+        def delete_rows(model, pks):
+            for i in range(0, len(pks), batch_size):
+                model.objects.filter(pk__in=pks[i:i + batch_size]).delete()
+
+        def write_rows(model, diff, fields):
+            if diff["create"] and model in (Enrollment, Submission):
+                insert_batched(model, diff["create"], model._meta.verbose_name_plural)
+            elif diff["create"]:
+                model.objects.bulk_create(diff["create"], batch_size=batch_size)
+            if diff["update"]:
+                model.objects.bulk_update(diff["update"], fields, batch_size=batch_size)
+
+        def import_upsert():
+            student_fields = ["name", "sis_id", "email", "section_name"]
+            assignment_fields = ["title", "due_date", "sort_key"]
+            submission_fields = ["submitted_at", "score", "status"]
+
+            students = list(iter_students())
+            student_ids = {s.student_id for s in students}
+            assignments = list(iter_assignments())
+            assignment_ids = {a.id for a in assignments}
+
+            def profiled_diff(label, *args):
+                with self.profiler.stage(f"diff {label}"):
+                    return diff_table(*args)
+
+            tables = [
+                ("students", Studentlist, student_fields,
+                 profiled_diff("students", Studentlist, students, lambda s: s.student_id, student_fields)),
+                ("assignments", Assignment, assignment_fields,
+                 profiled_diff("assignments", Assignment, assignments, lambda a: a.id, assignment_fields)),
+                ("enrollments", Enrollment, ENROLLMENT_FIELDS,
+                 profiled_diff("enrollments", Enrollment, iter_enrollments(student_ids),
+                               lambda e: (e.student_id, e.sis_course_id, e.sis_section_id, e.type),
+                               ENROLLMENT_FIELDS)),
+                ("submissions", Submission, submission_fields,
+                 profiled_diff("submissions", Submission, iter_submissions(student_ids, assignment_ids),
+                               lambda s: (s.student_id, s.assignment_id), submission_fields)),
+            ]
+
+            # Children first on delete so removed students/assignments don't cascade
+            # rows out from under the counts; parents first on insert for the FKs.
+            for label, model, _, diff in reversed(tables):
+                with self.profiler.stage(f"delete {label}"):
+                    delete_rows(model, diff["delete"])
+            for label, model, fields, diff in tables:
+                with self.profiler.stage(f"write {label}"):
+                    write_rows(model, diff, fields)
+
+            counts = {}
+            for label, _, _, diff in tables:
+                counts[label] = {
+                    "inserted": len(diff["create"]),
+                    "updated": len(diff["update"]),
+                    "deleted": len(diff["delete"]),
+                    "unchanged": diff["unchanged"],
+                }
+                self.stdout.write(self.style.SUCCESS(
+                    f"✅ {label}: {len(diff['create'])} inserted, {len(diff['update'])} updated, "
+                    f"{len(diff['delete'])} deleted, {diff['unchanged']} unchanged."
                 ))
-        
-                # Bulk insert in batches
-                if len(submissions) >= batch_size:
-                    Submission.objects.bulk_create(submissions, batch_size)
-                    count += len(submissions)
-                    self.stdout.write(f"✅ Inserted {count} submissions so far...")
-                    submissions = []
-        
-            # Insert leftovers
-            if submissions:
-                Submission.objects.bulk_create(submissions, batch_size)
-                count += len(submissions)
-        
-            self.stdout.write(self.style.SUCCESS(f"✅ Imported {count} submissions."))
-            self.stdout.write(self.style.SUCCESS("🎉 All Canvas data successfully imported."))
+            return counts
+
+        def import_staged():
+            leftovers = staging.leftover_tables()
+            if leftovers:
+                self.stdout.write(self.style.WARNING(f"🧹 Dropping tables left by an interrupted load: {', '.join(leftovers)}"))
+                staging.drop_tables(leftovers)
+
+            tag = staging.new_tag()
+            shadow = staging.create_staging(tag)
+            self.stdout.write(f"🧱 Loading into staging tables (*__stg{tag}); live tables stay readable...")
+            try:
+                with transaction.atomic():
+                    counts = import_replace(shadow)
+                start = time.perf_counter()
+                with self.profiler.stage("publish"):
+                    version = staging.publish(tag, mode="staged", row_counts=counts)
+            except BaseException:
+                staging.drop_staging(tag)
+                raise
+            self.stdout.write(self.style.SUCCESS(
+                f"🔀 Published dataset v{version.pk} in {time.perf_counter() - start:.3f}s."
+            ))
+
+        mode = kwargs.get("mode") or "replace"
+        if mode == "staged":
+            try:
+                with staging.load_lock():
+                    import_staged()
+            except staging.LoadInProgress as e:
+                raise CommandError(f"{e}; try again once it has finished.")
+        else:
+            with transaction.atomic():
+                if mode == "upsert":
+                    self.stdout.write("🔄 Applying incremental changes...")
+                    counts = import_upsert()
+                else:
+                    counts = import_replace()
+                DatasetVersion.objects.create(mode=mode, row_counts=counts)
+            picklists.invalidate()
+            search_index.invalidate()
+        self.stdout.write(self.style.SUCCESS("🎉 All Canvas data successfully imported."))
@@ -0,0 +1,374 @@
+import os
+import glob
+import time
+import queue
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from logging.handlers import RotatingFileHandler
+
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import get_current_timezone
+
+from students import staging
+from students.bulk_load import BulkInserter
+from students.canvas_client import CanvasClient
+from students.fetch_metrics import FetchMetrics
+from students.rate_limiter import AdaptiveRateLimiter
+from students.import_loader import aware_datetimes, build_instances, typed_enrollments, typed_submissions
+from students.models import Studentlist, Assignment, Enrollment, Submission, natural_sort_key
+from students.management.commands.fetch_canvas_enrollments import clean_data
+from students.management.commands.fetch_canvas_assignments import (
+    ANALYTICS_URL, _canon_key_id, _date_only, _normalize_title, assignment_rows, fetch_submissions_chunk,
+    get_course_ids,
+)
+
+DONE = object()
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetch enrollments and assignments from Canvas and load them straight into the database "
+        "in one streaming pass (no data_exports/ intermediates), then publish with a table swap"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--engine",
+            choices=["analytics", "submissions"],
+            default=os.getenv("CANVAS_FETCH_ENGINE", "analytics"),
+            help="Assignment fetch engine, as in fetch_canvas_assignments",
+        )
+        parser.add_argument(
+            "--queue-size", type=int, default=int(os.getenv("SYNC_QUEUE_SIZE", "200")),
+            help="Fetched units buffered ahead of the database writer; fetchers block when it is full",
+        )
+        parser.add_argument("--group-by-due-date", action="store_true")
+        parser.add_argument(
+            "--max-failures", type=int, default=int(os.getenv("SYNC_MAX_FAILURES", "0")),
+            help="Publish only if at most this many courses/students failed to fetch (default 0: any "
+                 "failure keeps the live dataset)",
+        )
+        parser.add_argument(
+            "--metrics-prom", default=os.getenv("CANVAS_METRICS_PROM") or None, metavar="PATH",
+            help="Also write the run's request metrics in Prometheus text format to PATH",
+        )
+
+    def handle(self, *args, **kwargs):
+        base_dir = settings.BASE_DIR
+        log_dir = os.path.join(base_dir, "log")
+        roster_dir = os.path.join(base_dir, "data_exports")
+        os.makedirs(log_dir, exist_ok=True)
+
+        # Tunables (same env vars as the fetch/import commands)
+        REQUEST_TIMEOUT = float(os.getenv("CANVAS_TIMEOUT", "30"))
+        RETRY_LIMIT = int(os.getenv("CANVAS_RETRIES", "3"))
+        BACKOFF_SECONDS = float(os.getenv("CANVAS_BACKOFF", "0.5"))
+        MAX_WORKERS = int(os.getenv("CANVAS_WORKERS", "10"))
+        PAGE_WORKERS = int(os.getenv("CANVAS_PAGE_WORKERS", "4"))
+        PER_PAGE = int(os.getenv("CANVAS_PER_PAGE", "100"))
+        BULK_CHUNK = int(os.getenv("CANVAS_BULK_CHUNK", "50"))
+        BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "2000"))
+        RATE_STATE_FILE = os.getenv("CANVAS_RATE_STATE_FILE", os.path.join(log_dir, "canvas_rate_state.json"))
+        LOG_LEVEL = os.getenv("CANVAS_LOG_LEVEL", "INFO").upper()
+        engine = kwargs.get("engine") or "analytics"
+        group_by_due_date = bool(kwargs.get("group_by_due_date"))
+
+        token = os.getenv("CANVAS_API_TOKEN") or getattr(settings, "CANVAS_API_TOKEN", "")
+        if not token:
+            raise CommandError("CANVAS_API_TOKEN not configured")
+
+        course_ids = get_course_ids()
+        max_failures = kwargs["max_failures"]
+        if max_failures < 0:
+            raise CommandError("--max-failures must be 0 or more")
+
+        logger = logging.getLogger(__name__)
+        logger.setLevel(LOG_LEVEL)
+        logger.handlers = []
+        fmt = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(fmt)
+        file_handler = RotatingFileHandler(os.path.join(log_dir, "sync_canvas.log"), maxBytes=100000, backupCount=3)
+        file_handler.setFormatter(fmt)
+        logger.addHandler(stream_handler)
+        logger.addHandler(file_handler)
+
+        # === Roster: the gradebook CSVs are an input, not an intermediate ===
+        roster_files = glob.glob(os.path.join(roster_dir, "*_StudentRoster.csv"))
+        if not roster_files:
+            raise CommandError("No *_StudentRoster.csv files found to derive student IDs.")
+        roster = pd.concat([pd.read_csv(f, dtype=str) for f in roster_files], ignore_index=True)
+        roster = roster.drop_duplicates(subset="Student ID", keep="first")
+        student_ids = set(roster["Student ID"].str.strip())
+
+        client = CanvasClient(
+            token=token,
+            timeout=REQUEST_TIMEOUT,
+            retries=RETRY_LIMIT,
+            backoff=BACKOFF_SECONDS,
+            pool_size=MAX_WORKERS,
+            logger=logger,
+            limiter=AdaptiveRateLimiter(max_concurrency=MAX_WORKERS, state_file=RATE_STATE_FILE),
+            metrics=FetchMetrics(),
+        )
+
+        # === Producers: fetch threads feed one bounded queue ===
+        units = queue.Queue(maxsize=max(1, kwargs["queue_size"]))
+        stop = threading.Event()
+        stats = defaultdict(int)
+        failed_units = []  # "course" or "course:student" whose fetch didn't complete
+        failed_lock = threading.Lock()
+        give_up = threading.Event()  # past --max-failures: stop fetching, the load won't be published
+
+        def fail(units, message):
+            logger.error(message)
+            with failed_lock:
+                failed_units.extend(units)
+                if len(failed_units) > max_failures:
+                    give_up.set()
+
+        def put(item):
+            # blocks while the writer is behind; gives up once the writer has failed
+            while not stop.is_set():
+                try:
+                    units.put(item, timeout=0.5)
+                    stats["queue_high_water"] = max(stats["queue_high_water"], units.qsize())
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        # a unit that failed part-way is counted, never queued: truncated pages must not
+        # be loaded as if they were the student's (or course's) complete data
+        def fetch_student(course_id, student_id):
+            if stop.is_set() or give_up.is_set():
+                return
+            items, ok = client.get_all(ANALYTICS_URL.format(course_id, student_id))
+            if not ok:
+                fail([f"{course_id}:{student_id}"], f"Failed to fetch data for student {student_id} in course {course_id}")
+                return
+            put(("assignments", course_id, student_id, items))
+
+        def fetch_chunk(course_id, chunk):
+            if stop.is_set() or give_up.is_set():
+                return
+            per_student, ok = fetch_submissions_chunk(client, course_id, chunk)
+            if not ok:
+                fail([f"{course_id}:{sid}" for sid in chunk], f"Failed to fetch submissions for {len(chunk)} students in course {course_id}")
+                return
+            for sid, data in per_student.items():
+                if not put(("assignments", course_id, sid, data)):
+                    return
+
+        def fetch_course(course_id, fetch_pool):
+            if give_up.is_set():
+                return []
+            enrollments, ok = client.get_all_pages(
+                f"courses/{course_id}/enrollments", params={"per_page": PER_PAGE}, max_workers=PAGE_WORKERS
+            )
+            if not ok:
+                fail([course_id], f"Failed to fetch enrollments for course {course_id}")
+                return []
+            if not enrollments:
+                # an empty course is far more likely a bad ID or token scope than a real one
+                fail([course_id], f"No enrollments fetched for course {course_id}")
+                return []
+            cleaned = clean_data(pd.DataFrame(enrollments))
+            put(("enrollments", course_id, cleaned))
+
+            enrolled = {str(v) for v in cleaned["Student ID"].dropna().tolist()} & student_ids
+            course_students = sorted(enrolled)
+            logger.info(f"Course {course_id}: {len(course_students)} roster students enrolled; fetching ({engine})...")
+            if engine == "submissions":
+                chunks = [course_students[i:i + BULK_CHUNK] for i in range(0, len(course_students), BULK_CHUNK)]
+                return [fetch_pool.submit(fetch_chunk, course_id, chunk) for chunk in chunks]
+            return [fetch_pool.submit(fetch_student, course_id, sid) for sid in course_students]
+
+        def run_producers():
+            try:
+                with ThreadPoolExecutor(max_workers=MAX_WORKERS) as fetch_pool, \
+                        ThreadPoolExecutor(max_workers=min(len(course_ids), MAX_WORKERS)) as course_pool:
+                    course_futures = [course_pool.submit(fetch_course, cid, fetch_pool) for cid in course_ids]
+                    for course_future in as_completed(course_futures):
+                        for future in course_future.result():
+                            future.result()
+                stats["fetch_seconds"] = time.perf_counter() - started
+            except BaseException as e:
+                put(("error", e))
+            finally:
+                while True:
+                    try:
+                        units.put(DONE, timeout=0.5)
+                        break
+                    except queue.Full:
+                        if stop.is_set():  # writer already gone
+                            break
+
+        # === Consumer: this thread owns the DB connection and the shadow tables ===
+        tz = get_current_timezone()
+        canon_assignments = {}  # canonical id -> [title, due_at] (earliest non-null due)
+        written_assignments = {}  # canonical id -> due_at stored so far
+        written_pairs = set()
+        pending = []
+
+        def canonical_id(title, due_at):
+            key = _normalize_title(title)
+            if group_by_due_date:
+                key = f"{key}|{_date_only(due_at)}"
+            return _canon_key_id(key)
+
+        def flush(models, inserter):
+            if not pending:
+                return
+            frame = pd.DataFrame(pending)
+            pending.clear()
+            new_ids = [cid for cid in frame["assignment_id"].unique().tolist() if cid not in written_assignments]
+            if new_ids:
+                new = pd.DataFrame({
+                    "id": new_ids,
+                    "title": [canon_assignments[cid][0] for cid in new_ids],
+                    "sort_key": [natural_sort_key(canon_assignments[cid][0]) for cid in new_ids],
+                    "due_date": aware_datetimes(pd.Series([canon_assignments[cid][1] for cid in new_ids]), tz),
+                }).apply(lambda s: s.astype(object).where(s.notna(), None))
+                # assignments first: SQL Server checks the submission FK per statement
+                models[Assignment].objects.bulk_create(build_instances(models[Assignment], new), batch_size=BATCH_SIZE)
+                for cid in new_ids:
+                    written_assignments[cid] = canon_assignments[cid][1]
+                stats["assignments"] += len(new_ids)
+            issues = {}
+            typed = typed_submissions(frame, tz, issues)
+            stats["submissions"] += inserter.insert(models[Submission], build_instances(models[Submission], typed))
+            stats["invalid_scores"] += issues.get("invalid_scores", 0)
+
+        def consume(models, inserter):
+            while True:
+                item = units.get()
+                if item is DONE:
+                    break
+                kind = item[0]
+                if kind == "error":
+                    raise item[1]
+                if kind == "enrollments":
+                    typed = typed_enrollments(item[2], tz)
+                    typed = typed[typed["student_id"].isin(student_ids)]
+                    stats["enrollments"] += inserter.insert(models[Enrollment], build_instances(models[Enrollment], typed))
+                    continue
+
+                _, course_id, student_id, items = item
+                stats["units"] += 1
+                for row in assignment_rows(student_id, items):
+                    cid = canonical_id(row["title"], row["due_at"])
+                    entry = canon_assignments.setdefault(cid, [row["title"], row["due_at"]])
+                    due = row["due_at"]
+                    if due and (not entry[1] or pd.to_datetime(due, utc=True) < pd.to_datetime(entry[1], utc=True)):
+                        entry[1] = due
+                    if (student_id, cid) in written_pairs:
+                        stats["duplicate_submissions"] += 1
+                        continue
+                    written_pairs.add((student_id, cid))
+                    pending.append({
+                        "student_id": student_id,
+                        "assignment_id": cid,
+                        "submitted_at": row["submitted_at"],
+                        "score": row["score"],
+                        "status": row["status"],
+                    })
+                if len(pending) >= BATCH_SIZE:
+                    flush(models, inserter)
+            flush(models, inserter)
+
+            # earliest due date may have arrived after the assignment row was written
+            changed = [cid for cid, (_, due) in canon_assignments.items() if written_assignments.get(cid) != due]
+            if changed:
+                dues = aware_datetimes(pd.Series([canon_assignments[cid][1] for cid in changed]), tz)
+                rows = [
+                    models[Assignment](id=cid, title=canon_assignments[cid][0], due_date=None if pd.isna(d) else d)
+                    for cid, d in zip(changed, dues.tolist())
+                ]
+                models[Assignment].objects.bulk_update(rows, ["due_date"], batch_size=BATCH_SIZE)
+
+        try:
+            with staging.load_lock():
+                leftovers = staging.leftover_tables()
+                if leftovers:
+                    self.stdout.write(self.style.WARNING(f"🧹 Dropping tables left by an interrupted load: {', '.join(leftovers)}"))
+                    staging.drop_tables(leftovers)
+                tag = staging.new_tag()
+                models = staging.create_staging(tag)
+                inserter = BulkInserter(batch_size=BATCH_SIZE)
+
+                started = time.perf_counter()
+                producer = threading.Thread(target=run_producers, name="sync-producers", daemon=True)
+                try:
+                    with transaction.atomic():
+                        students = [
+                            models[Studentlist](
+                                name=row["Student Name"],
+                                student_id=str(row["Student ID"]).strip(),
+                                sis_id=row["Student SIS ID"],
+                                email=row["Email"],
+                                section_name=row["Section Name"],
+                            )
+                            for row in roster.to_dict("records")
+                        ]
+                        models[Studentlist].objects.bulk_create(students, batch_size=BATCH_SIZE)
+                        producer.start()
+                        consume(models, inserter)
+                    if len(failed_units) > max_failures:
+                        raise CommandError(
+                            f"{len(failed_units)} courses/students failed to fetch (allowed: {max_failures}): "
+                            f"{', '.join(failed_units[:10])}{' ...' if len(failed_units) > 10 else ''}. "
+                            f"Nothing was published; the live dataset is unchanged."
+                        )
+                    version = staging.publish(tag, mode="sync", row_counts={
+                        "students": len(students),
+                        "enrollments": stats["enrollments"],
+                        "assignments": len(canon_assignments),
+                        "submissions": stats["submissions"],
+                    })
+                except BaseException:
+                    stop.set()
+                    staging.drop_staging(tag)
+                    raise
+                finally:
+                    stop.set()
+                    if producer.is_alive():
+                        producer.join(timeout=5)
+        except staging.LoadInProgress as e:
+            raise CommandError(f"{e}; try again once it has finished.")
+        total = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f"🔀 Published dataset v{version.pk}: {len(students)} students, {stats['enrollments']} enrollments, "
+            f"{len(canon_assignments)} assignments, {stats['submissions']} submissions "
+            f"from {stats['units']} (course, student) units."
+        ))
+        if failed_units:
+            self.stdout.write(self.style.WARNING(
+                f"⚠️ {len(failed_units)} courses/students failed to fetch and are missing from this dataset "
+                f"(allowed: {max_failures}): {', '.join(failed_units[:10])}{' ...' if len(failed_units) > 10 else ''}"
+            ))
+        if stats["duplicate_submissions"]:
+            self.stdout.write(self.style.WARNING(
+                f"⚠️ Skipped {stats['duplicate_submissions']} submissions repeating a (student, assignment) pair."
+            ))
+        if stats["invalid_scores"]:
+            self.stdout.write(self.style.WARNING(f"⚠️ {stats['invalid_scores']} non-numeric scores set to NULL."))
+        self.stdout.write(
+            f"⏱️ fetch {stats.get('fetch_seconds', total):.2f}s, end-to-end {total:.2f}s "
+            f"(queue high-water {stats['queue_high_water']}/{kwargs['queue_size']})"
+        )
+        report_file = client.metrics.write_json(
+            os.path.join(roster_dir, "sync_metrics.json"),
+            extra={"command": "sync_canvas", "engine": engine, "failed_units": failed_units, "rows": {
+                k: stats[k] for k in ("units", "enrollments", "submissions", "duplicate_submissions")
+            }},
+        )
+        self.stdout.write(f"Request metrics saved to: {report_file}")
+        if kwargs.get("metrics_prom"):
+            client.metrics.write_prometheus(kwargs["metrics_prom"])
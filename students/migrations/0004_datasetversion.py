@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0003_delete_student'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('loaded_at', models.DateTimeField(auto_now_add=True)),
+                ('mode', models.CharField(max_length=20)),
+                ('row_counts', models.JSONField(blank=True, default=dict)),
+            ],
+            options={
+                'get_latest_by': 'id',
+            },
+        ),
+    ]
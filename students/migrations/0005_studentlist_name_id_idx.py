@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0004_datasetversion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='studentlist',
+            index=models.Index(fields=['name', 'student_id'], name='studentlist_name_id_idx'),
+        ),
+    ]
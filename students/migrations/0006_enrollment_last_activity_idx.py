@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0005_studentlist_name_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='enrollment',
+            index=models.Index(fields=['last_activity_at', 'id'], name='enrollment_last_activity_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:49
+
+import re
+
+from django.db import migrations, models
+
+
+def fill_sort_keys(apps, schema_editor):
+    # same as students.models.natural_sort_key at the time of this migration
+    Assignment = apps.get_model('students', 'Assignment')
+    rows = list(Assignment.objects.only('id', 'title'))
+    for row in rows:
+        row.sort_key = re.sub(r"\d+", lambda m: m.group().zfill(10), (row.title or "").lower())[:255]
+    Assignment.objects.bulk_update(rows, ['sort_key'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0006_enrollment_last_activity_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assignment',
+            name='sort_key',
+            field=models.CharField(default='', max_length=255),
+        ),
+        migrations.RunPython(fill_sort_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='assignment',
+            index=models.Index(fields=['sort_key', 'id'], name='assignment_sort_key_idx'),
+        ),
+    ]
@@ -1,5 +1,7 @@
 # students/models.py
 
+import re
+
 from django.db import models
 from django.core.validators import EmailValidator
 
@@ -11,13 +13,42 @@ class Studentlist(models.Model):
     email = models.EmailField(validators=[EmailValidator()])
     section_name = models.CharField(max_length=255, db_index=True)
 
+    class Meta:
+        indexes = [
+            # keyset order of the student directory
+            models.Index(fields=['name', 'student_id'], name='studentlist_name_id_idx'),
+        ]
+
     def __str__(self):
         return f"{self.name} ({self.email})"
     
 
+SORT_KEY_DIGITS = 10
+SORT_KEY_LENGTH = 255
+
+
+def natural_sort_key(title):
+    """
+    ``title`` as a string that sorts in natural order: lower-cased, with every
+    run of digits zero-padded, so "Quiz 2" < "Quiz 10" under ORDER BY.
+    Padding can outgrow the 200-character title, so the key is cut to fit
+    its column; only titles equal for that long can tie.
+    """
+    key = re.sub(r"\d+", lambda m: m.group().zfill(SORT_KEY_DIGITS), (title or "").lower())
+    return key[:SORT_KEY_LENGTH]
+
+
 class Assignment(models.Model):
     title = models.CharField(max_length=200, db_index=True)
     due_date = models.DateTimeField(null=True)
+    # natural_sort_key(title), written by the importers
+    sort_key = models.CharField(max_length=SORT_KEY_LENGTH, default='')
+
+    class Meta:
+        indexes = [
+            # pick-list order of the assignments page
+            models.Index(fields=['sort_key', 'id'], name='assignment_sort_key_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -38,6 +69,12 @@ class Submission(models.Model):
 
     class Meta:
         unique_together = ('student', 'assignment')  # Ensure each student has one submission per assignment
+        indexes = [
+            # the assignments page filters: selected assignments by status / by score range
+            # (student + assignment is already covered by the unique_together index)
+            models.Index(fields=['assignment', 'status'], name='sub_assignment_status_idx'),
+            models.Index(fields=['assignment', 'score'], name='sub_assignment_score_idx'),
+        ]
 
     def __str__(self):
         return f"{self.student.name} - {self.assignment.title}"
@@ -62,3 +99,27 @@ class Enrollment(models.Model):
     unposted_current_grade = models.FloatField(null=True, blank=True)
     unposted_final_score = models.FloatField(null=True, blank=True)
     unposted_final_grade = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # range seeks and the inactivity order of the last_login page
+            models.Index(fields=['last_activity_at', 'id'], name='enrollment_last_activity_idx'),
+        ]
+
+
+class DatasetVersion(models.Model):
+    """One row per published import; the newest row is the live dataset."""
+    loaded_at = models.DateTimeField(auto_now_add=True)
+    mode = models.CharField(max_length=20)
+    row_counts = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        get_latest_by = 'id'
+
+    def __str__(self):
+        return f"v{self.pk} ({self.mode}, {self.loaded_at:%Y-%m-%d %H:%M})"
+
+    @classmethod
+    def current(cls):
+        """Id of the live dataset, 0 before the first recorded import."""
+        return cls.objects.order_by('-id').values_list('id', flat=True).first() or 0
@@ -0,0 +1,68 @@
+"""
+Cached dropdown contents for the assignments page.
+
+The assignment and student pick-lists only change when an import publishes
+a new dataset, so they are cached (Django's default cache) under keys that
+include ``DatasetVersion.current()``. A new import therefore makes the old
+entries unreachable. The version itself is cached for
+``PICKLIST_RECHECK_SECONDS`` (default 5), so a warm page load runs no
+queries. The importer calls ``invalidate()`` after publishing, which drops
+the cached version right away when the cache is shared between processes.
+With the per-process local-memory cache, other processes notice within the
+recheck interval.
+
+A cold load runs two indexed queries plus the version lookup:
+
+- assignments ordered by ``sort_key`` (assignment_sort_key_idx);
+- distinct names of students with at least one submission, found by a
+  semi-join on the submission student index and read in
+  studentlist_name_id_idx order, not by a DISTINCT over the whole
+  submissions join.
+"""
+import os
+
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
+
+from students.models import Assignment, DatasetVersion, Studentlist, Submission
+
+VERSION_KEY = "picklists:version"
+
+
+def dataset_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = DatasetVersion.current()
+        cache.set(VERSION_KEY, version, float(os.getenv("PICKLIST_RECHECK_SECONDS", "5")))
+    return version
+
+
+def _cached(name, load):
+    key = f"picklists:v{dataset_version()}:{name}"
+    value = cache.get(key)
+    if value is None:
+        value = load()
+        cache.set(key, value, None)  # superseded by the next version's key, not by time
+    return value
+
+
+def assignment_choices():
+    """[{"id", "title"}] in natural title order."""
+    return _cached("assignments", lambda: list(
+        Assignment.objects.order_by("sort_key", "id").values("id", "title")
+    ))
+
+
+def student_choices():
+    """Distinct names of students with at least one submission, sorted."""
+    return _cached("students", lambda: list(
+        Studentlist.objects
+        .filter(Exists(Submission.objects.filter(student=OuterRef("pk"))))
+        .order_by("name")
+        .values_list("name", flat=True)
+        .distinct()
+    ))
+
+
+def invalidate():
+    cache.delete(VERSION_KEY)
@@ -0,0 +1,192 @@
+"""
+``--profile`` for the Canvas management commands.
+
+Commands mix in ``ProfiledCommand`` and wrap their phases in
+``with self.profiler.stage("fetch"):``. Without ``--profile`` a stage is a
+no-op. With it, the whole command runs under cProfile (worker threads
+included, merged into one dump) and every stage records wall time and its
+tracemalloc peak. At the end the command writes, under ``log/profiles/``
+(or the directory given to ``--profile``):
+
+- ``<command>-<timestamp>.pstats``  (open with ``python -m pstats`` or snakeviz)
+- ``<command>-<timestamp>.stages.json``
+
+and prints the stage table plus the top functions by cumulative time.
+Repeated stages (e.g. one per course) are summed. Stages may also be entered
+from worker threads; those record time only (summed across threads, so it
+can exceed wall time), since tracemalloc keeps a single process-wide peak.
+"""
+import io
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+class StageProfiler:
+    def __init__(self, enabled=False, output_dir=None, name="command", top=25):
+        self.enabled = enabled
+        self.output_dir = output_dir
+        self.name = name
+        self.top = top
+        self.stages = {}  # name -> {"calls", "seconds", "peak_bytes"}
+        self._order = []
+        self._stack = []  # per open stage: highest peak seen before the latest reset_peak()
+        self._profile = None
+        self._thread_profiles = []
+        self._lock = threading.Lock()
+        self._started = None
+
+    # --- lifecycle -------------------------------------------------------------
+
+    def start(self):
+        if not self.enabled:
+            return
+        self._started = time.perf_counter()
+        tracemalloc.start()
+        self._stack = [0]  # the whole run is the outermost stage
+        threading.setprofile(self._profile_thread)
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def _profile_thread(self, *args):
+        # first profile event in a new thread: swap this hook for a real profiler
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # 3.12+: one profiler already sees every thread
+            return
+        with self._lock:
+            self._thread_profiles.append(profile)
+
+    def finish(self, stdout):
+        if not self.enabled or self._profile is None:
+            return None
+        self._profile.disable()
+        threading.setprofile(None)
+        total = time.perf_counter() - self._started
+        total_peak = max(tracemalloc.get_traced_memory()[1], self._stack[0])
+        tracemalloc.stop()
+
+        stats = pstats.Stats(self._profile)
+        with self._lock:
+            for profile in self._thread_profiles:
+                profile.disable()
+                stats.add(profile)
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, f"{self.name}-{time.strftime('%Y%m%d-%H%M%S')}")
+        stats.dump_stats(base + ".pstats")
+        report = {
+            "command": self.name,
+            "total_seconds": round(total, 3),
+            "peak_mib": round(total_peak / 2**20, 2),
+            "stages": [
+                {
+                    "stage": stage,
+                    "calls": self.stages[stage]["calls"],
+                    "seconds": round(self.stages[stage]["seconds"], 3),
+                    "share": round(self.stages[stage]["seconds"] / total, 4) if total else None,
+                    "peak_mib": (
+                        round(self.stages[stage]["peak_bytes"] / 2**20, 2)
+                        if self.stages[stage]["peak_bytes"] is not None else None
+                    ),
+                }
+                for stage in self._order
+            ],
+        }
+        with open(base + ".stages.json", "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+        stdout.write(f"\n⏱️ Profile: {total:.2f}s total, tracemalloc peak {report['peak_mib']:.1f} MiB")
+        for row in report["stages"]:
+            peak = f"{row['peak_mib']:>8.1f} MiB" if row["peak_mib"] is not None else "   (thread)"
+            stdout.write(
+                f"  {row['stage']:<28} {row['seconds']:>9.3f}s {100 * (row['share'] or 0):>6.1f}%  "
+                f"peak {peak}  x{row['calls']}"
+            )
+        buffer = io.StringIO()
+        stats.stream = buffer
+        stats.sort_stats("cumulative").print_stats(self.top)
+        stdout.write(buffer.getvalue())
+        stdout.write(f"Profile saved to: {base}.pstats")
+        stdout.write(f"Stage breakdown saved to: {base}.stages.json")
+        return base
+
+    # --- stages ----------------------------------------------------------------
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        if threading.current_thread() is not threading.main_thread():
+            started = time.perf_counter()
+            try:
+                yield
+            finally:
+                self._record(name, time.perf_counter() - started, None)
+            return
+        # tracemalloc has one peak counter: bank the enclosing stage's peak so far,
+        # measure this stage from a fresh peak, then hand the result back up
+        self._stack[-1] = max(self._stack[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        self._stack.append(0)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            peak = max(tracemalloc.get_traced_memory()[1], self._stack.pop())
+            self._stack[-1] = max(self._stack[-1], peak)
+            self._record(name, elapsed, peak)
+
+    def _record(self, name, seconds, peak):
+        with self._lock:
+            entry = self.stages.get(name)
+            if entry is None:
+                entry = self.stages[name] = {"calls": 0, "seconds": 0.0, "peak_bytes": None}
+                self._order.append(name)
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+            if peak is not None:
+                entry["peak_bytes"] = max(entry["peak_bytes"] or 0, peak)
+
+
+class ProfiledCommand:
+    """
+    Mixin for ``BaseCommand`` subclasses: adds ``--profile [DIR]`` and sets
+    ``self.profiler`` before ``handle`` runs (disabled unless asked for).
+    """
+
+    def create_parser(self, prog_name, subcommand, **kwargs):
+        parser = super().create_parser(prog_name, subcommand, **kwargs)
+        parser.add_argument(
+            "--profile", nargs="?", const="", default=None, metavar="DIR",
+            help="Profile the run: cProfile dump plus per-stage wall time and tracemalloc peak, "
+                 "written to DIR (default log/profiles). Adds noticeable overhead.",
+        )
+        return parser
+
+    def execute(self, *args, **options):
+        output_dir = options.get("profile")
+        if output_dir == "":
+            output_dir = os.path.join(settings.BASE_DIR, "log", "profiles")
+        self.profiler = StageProfiler(
+            enabled=output_dir is not None,
+            output_dir=output_dir,
+            name=self.__module__.rsplit(".", 1)[-1],
+        )
+        self.profiler.start()
+        try:
+            return super().execute(*args, **options)
+        finally:
+            self.profiler.finish(self.stdout)
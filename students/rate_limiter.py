@@ -0,0 +1,217 @@
+"""
+Adaptive, header-driven rate limiter for Canvas API traffic.
+
+Canvas throttles per token with a leaky bucket and reports what is left on
+every response (``X-Rate-Limit-Remaining``) together with what the request
+cost (``X-Request-Cost``). ``AdaptiveRateLimiter`` combines a token bucket
+(requests/second) with an adjustable in-flight cap and tunes both from those
+headers: additive increase while the budget is healthy, multiplicative
+decrease as it runs low, and a shared pause on 429.
+
+Pass ``state_file`` to share the observed budget and any 429 pause with other
+processes (e.g. the enrollment and assignment commands running at once).
+"""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: state is still shared, just without a file lock
+    fcntl = None
+
+SHARED_SYNC_SECONDS = 0.5  # how often the state file is read, and at most how often a reading is written
+
+
+class AdaptiveRateLimiter:
+    def __init__(self, max_concurrency=10, min_concurrency=1, rate=None, max_rate=None,
+                 min_rate=0.5, low_water=None, high_water=None, cooldown=None, state_file=None):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.min_concurrency = max(1, min(int(min_concurrency), self.max_concurrency))
+        self.concurrency = float(self.max_concurrency)
+
+        self.rate = float(rate if rate is not None else os.getenv("CANVAS_RATE", "10"))
+        self.max_rate = float(max_rate if max_rate is not None else os.getenv("CANVAS_MAX_RATE", "50"))
+        self.min_rate = float(min_rate)
+        self.tokens = float(self.max_concurrency)
+
+        self.low_water = float(low_water if low_water is not None else os.getenv("CANVAS_RATE_LOW_WATER", "150"))
+        self.high_water = float(high_water if high_water is not None else os.getenv("CANVAS_RATE_HIGH_WATER", "400"))
+        self.cooldown = float(cooldown if cooldown is not None else os.getenv("CANVAS_RATE_COOLDOWN", "2"))
+
+        self.state_file = state_file
+        self.in_flight = 0
+        self.remaining = None
+        self.paused_until = 0.0
+
+        self._cond = threading.Condition()
+        self._last_refill = time.monotonic()
+        self._shared_checked = 0.0
+        self._shared_written = 0.0
+        self._last_decrease = 0.0
+        # identifies this limiter's own readings in the shared file
+        self._writer = f"{os.getpid()}-{id(self):x}"
+        self._applied_reading = None
+
+    # --- shared state -----------------------------------------------------
+
+    def _locked_state(self, update=None):
+        """
+        Read (and optionally merge ``update`` into) the shared JSON state file.
+        A pause only ever extends: the later ``paused_until`` of the two wins.
+        """
+        if not self.state_file:
+            return {}
+        os.makedirs(os.path.dirname(self.state_file) or ".", exist_ok=True)
+        with open(self.state_file, "a+", encoding="utf-8") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read() or "{}")
+                except ValueError:
+                    state = {}
+                if update:
+                    if "paused_until" in update:
+                        update["paused_until"] = max(update["paused_until"], float(state.get("paused_until", 0)))
+                    state.update(update)
+                    f.seek(0)
+                    f.truncate()
+                    json.dump(state, f)
+                    f.flush()
+                return state
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _sync_shared(self, now):
+        # wall-clock times in the file so other processes can compare them
+        if not self.state_file or now - self._shared_checked < SHARED_SYNC_SECONDS:
+            return
+        self._shared_checked = now
+        try:
+            state = self._locked_state()
+        except OSError:
+            return
+        wall = time.time()
+        paused_until = float(state.get("paused_until", 0)) - wall
+        if paused_until > 0:
+            self.paused_until = max(self.paused_until, now + paused_until)
+        # apply another process's reading once; our own was applied in observe()
+        reading = (state.get("writer"), state.get("updated_at"))
+        if (
+            "remaining" in state
+            and reading[0] != self._writer
+            and reading != self._applied_reading
+            and wall - float(state.get("updated_at", 0)) < 10
+        ):
+            self._applied_reading = reading
+            self._adjust(float(state["remaining"]))
+
+    # --- token bucket -----------------------------------------------------
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self.tokens = min(float(self.max_concurrency), self.tokens + elapsed * self.rate)
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._sync_shared(now)
+                self._refill(now)
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.in_flight >= int(self.concurrency):
+                    wait = None  # woken by release()
+                elif self.tokens < 1:
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    self.tokens -= 1
+                    self.in_flight += 1
+                    return
+                self._cond.wait(timeout=wait if wait is None else min(wait, 1.0))
+
+    def release(self):
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    # --- feedback ---------------------------------------------------------
+
+    def _adjust(self, remaining):
+        self.remaining = remaining
+        if remaining < self.low_water:
+            # back off at most once per second, otherwise a burst of low readings
+            # from every in-flight request would collapse the rate to the floor
+            now = time.monotonic()
+            if now - self._last_decrease < 1.0:
+                return
+            self._last_decrease = now
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.concurrency = max(float(self.min_concurrency), self.concurrency / 2)
+        elif remaining >= self.high_water:
+            self.rate = min(self.max_rate, self.rate + 1)
+            self.concurrency = min(float(self.max_concurrency), self.concurrency + 1)
+
+    def observe(self, resp):
+        """Feed one response's status and rate-limit headers back into the limiter."""
+        update = {}
+        with self._cond:
+            if resp.status_code == 429:
+                self._adjust(0)
+                # honour Canvas's Retry-After when it asks for longer than our cooldown
+                pause = max(self.cooldown, _retry_after_seconds(resp.headers.get("Retry-After")))
+                self.paused_until = max(self.paused_until, time.monotonic() + pause)
+                update["paused_until"] = time.time() + pause
+            else:
+                remaining = resp.headers.get("X-Rate-Limit-Remaining")
+                cost = resp.headers.get("X-Request-Cost")
+                try:
+                    remaining = float(remaining) if remaining is not None else None
+                    cost = float(cost) if cost is not None else 0.0
+                except ValueError:
+                    remaining = None
+                if remaining is not None:
+                    # assume every in-flight request costs about as much as this one
+                    self._adjust(remaining - cost * self.in_flight)
+                    # one reading per interval is plenty for the other processes,
+                    # and spares a locked file rewrite on every response
+                    now = time.monotonic()
+                    if self.state_file and now - self._shared_written >= SHARED_SYNC_SECONDS:
+                        self._shared_written = now
+                        update.update(remaining=remaining, writer=self._writer, updated_at=time.time())
+            self._cond.notify_all()
+        if update and self.state_file:
+            try:
+                self._locked_state(update)
+            except OSError:
+                pass
+
+
+def _retry_after_seconds(value):
+    """Retry-After as seconds (delta-seconds or an HTTP date); 0 when absent or unparseable."""
+    if not value:
+        return 0.0
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return max(0.0, when.timestamp() - time.time())
@@ -0,0 +1,247 @@
+"""
+Per-process n-gram index over the student roster for the directory search.
+
+``icontains`` filters turn into ``LIKE '%x%'`` scans on SQL Server for every
+keystroke. This index keeps the roster in memory instead: name, email and
+sis_id are lower-cased, and every 1-, 2- and 3-character substring of each
+maps to the set of rows containing it. A query token of up to three
+characters is a single posting lookup. A longer token intersects its
+trigrams, smallest posting first, and the few candidates left are checked
+with a real substring test.
+
+Multi-token queries match rows containing every token. Rows are ranked by
+how well each token matched (whole field > field prefix > word prefix >
+substring), weighted by field, then by (name, student_id). Ranking is done
+with set operations over score groups, not per row, and only the groups a
+page touches get sorted.
+
+``get_index()`` builds the index lazily and rebuilds it when
+``DatasetVersion.current()`` moves, i.e. after an import. To keep searches
+off the database, the version is rechecked at most every
+``STUDENT_SEARCH_RECHECK_SECONDS`` (default 5). The importers also call
+``invalidate()`` after publishing, so a process that ran the load drops
+its index at once; other processes follow within the recheck interval.
+Cached query results are shared across request threads behind locks.
+"""
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+
+SEARCH_FIELDS = ("name", "email", "sis_id")
+ROW_FIELDS = ("name", "email", "sis_id", "section_name", "student_id")
+FIELD_WEIGHTS = {"name": 1.0, "sis_id": 0.9, "email": 0.8}
+MAX_GRAM = 3
+SEARCH_CACHE_SIZE = 64  # recent queries kept ranked, so later pages are just slices
+
+# match quality of one token in one field
+EXACT, PREFIX, WORD_PREFIX, SUBSTRING = 100, 60, 40, 20
+
+_WORD_BREAK = re.compile(r"[\s.@_\-,]+")
+
+
+def tokenize(text):
+    return [t for t in (text or "").lower().split() if t]
+
+
+def _grams(text):
+    return {text[i:i + n] for n in range(1, MAX_GRAM + 1) for i in range(len(text) - n + 1)}
+
+
+class SearchResult:
+    """
+    Ranked matches as score groups, best first. Rows within a group are in
+    (name, student_id) order. Groups are only sorted when a page reaches
+    them, so a broad query doesn't pay to order rows nobody looks at.
+    """
+
+    def __init__(self, index, groups):
+        self.index = index
+        self.groups = groups  # [(score, set of row ids)], best score first
+        self.total = sum(len(ids) for _, ids in groups)
+        self._sorted = {}
+        self._lock = threading.Lock()  # cached results are shared by request threads
+
+    def page(self, offset, limit):
+        rows, skipped = [], 0
+        for i, (_, ids) in enumerate(self.groups):
+            if skipped + len(ids) <= offset:
+                skipped += len(ids)
+                continue
+            with self._lock:
+                ordered = self._sorted.get(i)
+                if ordered is None:
+                    ordered = self._sorted[i] = sorted(ids)
+            start = max(0, offset - skipped)
+            rows.extend(self.index.rows[rid] for rid in ordered[start:start + limit - len(rows)])
+            skipped += len(ids)
+            if len(rows) >= limit:
+                break
+        return rows
+
+    def __iter__(self):
+        return iter(self.page(0, self.total))
+
+    def __len__(self):
+        return self.total
+
+
+class StudentSearchIndex:
+    def __init__(self, rows, version=0):
+        self.version = version
+        # stored in (name, student_id) order so row id order is the tie-break order
+        self.rows = sorted(
+            ({f: row.get(f) for f in ROW_FIELDS} for row in rows),
+            key=lambda row: (row["name"] or "", row["student_id"] or ""),
+        )
+        self.text = {f: [(row[f] or "").lower() for row in self.rows] for f in SEARCH_FIELDS}
+        # words joined behind a marker, so "a word starts with x" is one substring test for "\x01x"
+        self.marked = {
+            f: ["\x01" + "\x01".join(_WORD_BREAK.split(value)) for value in self.text[f]] for f in SEARCH_FIELDS
+        }
+        self.postings = {f: {} for f in SEARCH_FIELDS}     # substring n-gram -> ids
+        self.exact = {f: {} for f in SEARCH_FIELDS}        # whole value -> ids
+        self.prefixes = {f: {} for f in SEARCH_FIELDS}     # value prefix (<= 3 chars) -> ids
+        self.word_prefixes = {f: {} for f in SEARCH_FIELDS}  # prefix of any word (<= 3 chars) -> ids
+        for field in SEARCH_FIELDS:
+            postings, exact = self.postings[field], self.exact[field]
+            prefixes, word_prefixes = self.prefixes[field], self.word_prefixes[field]
+            for rid, value in enumerate(self.text[field]):
+                for gram in _grams(value):
+                    postings.setdefault(gram, set()).add(rid)
+                exact.setdefault(value, set()).add(rid)
+                for n in range(1, min(MAX_GRAM, len(value)) + 1):
+                    prefixes.setdefault(value[:n], set()).add(rid)
+                for word in self.marked[field][rid].split("\x01"):
+                    for n in range(1, min(MAX_GRAM, len(word)) + 1):
+                        word_prefixes.setdefault(word[:n], set()).add(rid)
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    @classmethod
+    def build(cls):
+        from students.models import DatasetVersion, Studentlist
+
+        version = DatasetVersion.current()
+        rows = Studentlist.objects.values(*ROW_FIELDS)
+        return cls(list(rows), version=version)
+
+    def candidates(self, token, field):
+        """Row ids whose ``field`` contains ``token``."""
+        postings = self.postings[field]
+        if len(token) <= MAX_GRAM:
+            return postings.get(token, set())
+        grams = sorted(
+            (postings.get(token[i:i + MAX_GRAM], set()) for i in range(len(token) - MAX_GRAM + 1)),
+            key=len,
+        )
+        found = set(grams[0])
+        for posting in grams[1:]:
+            if not found:
+                break
+            found &= posting
+        text = self.text[field]
+        return {rid for rid in found if token in text[rid]}
+
+    def tiers(self, token, field):
+        """{quality: ids} for ``token`` in ``field``; each tier includes the better ones."""
+        contains = self.candidates(token, field)
+        if not contains:
+            return {}
+        head = token[:MAX_GRAM]
+        prefix = self.prefixes[field].get(head, set()) & contains
+        word_prefix = self.word_prefixes[field].get(head, set()) & contains
+        if len(token) > MAX_GRAM:
+            text, marked, needle = self.text[field], self.marked[field], "\x01" + token
+            prefix = {rid for rid in prefix if text[rid].startswith(token)}
+            word_prefix = {rid for rid in word_prefix if needle in marked[rid]}
+        return {
+            EXACT: self.exact[field].get(token, set()) & contains,
+            PREFIX: prefix,
+            WORD_PREFIX: word_prefix | prefix,
+            SUBSTRING: contains,
+        }
+
+    def term_groups(self, token, fields):
+        """Partition the rows matching one token by their best (quality x field weight)."""
+        classes = []
+        for field in fields:
+            for quality, ids in self.tiers(token, field).items():
+                if ids:
+                    classes.append((quality * FIELD_WEIGHTS[field], ids))
+        classes.sort(key=lambda c: -c[0])
+        groups, assigned = [], set()
+        for score, ids in classes:
+            fresh = ids - assigned
+            if fresh:
+                groups.append((score, fresh))
+                assigned |= fresh
+        return groups
+
+    def search(self, q="", name="", email="", sis_id=""):
+        """
+        Ranked rows (a ``SearchResult``) matching every token. ``q`` tokens may
+        match any search field; ``name``/``email``/``sis_id`` tokens only their own.
+        """
+        terms = [(token, SEARCH_FIELDS) for token in tokenize(q)]
+        for field, text in (("name", name), ("email", email), ("sis_id", sis_id)):
+            terms += [(token, (field,)) for token in tokenize(text)]
+        key = tuple(terms)
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+        if not terms:
+            result = SearchResult(self, [(0.0, set(range(len(self.rows))))])
+        else:
+            # a row's score is the sum over tokens, so combine the per-token
+            # partitions by intersecting them; all of this is set arithmetic
+            totals = {0.0: None}
+            for token, fields in terms:
+                combined = {}
+                for base, base_ids in totals.items():
+                    for score, ids in self.term_groups(token, fields):
+                        both = ids if base_ids is None else base_ids & ids
+                        if both:
+                            combined.setdefault(base + score, set()).update(both)
+                totals = combined
+                if not totals:
+                    break
+            result = SearchResult(self, sorted(totals.items(), key=lambda g: -g[0]))
+        with self._cache_lock:
+            self._cache[key] = result
+            while len(self._cache) > SEARCH_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return result
+
+
+_index = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def get_index():
+    """The current process's index, (re)built if the dataset version changed."""
+    global _index, _checked_at
+    from students.models import DatasetVersion
+
+    recheck = float(os.getenv("STUDENT_SEARCH_RECHECK_SECONDS", "5"))
+    now = time.monotonic()
+    if _index is not None and now - _checked_at < recheck:
+        return _index
+    with _lock:
+        if _index is not None and time.monotonic() - _checked_at < recheck:
+            return _index
+        if _index is None or DatasetVersion.current() != _index.version:
+            _index = StudentSearchIndex.build()
+        _checked_at = time.monotonic()
+        return _index
+
+
+def invalidate():
+    """Drop this process's index; the next search rebuilds it."""
+    global _index
+    with _lock:
+        _index = None
@@ -0,0 +1,218 @@
+"""
+Shadow-table loading for ``import_canvas_data --mode staged``.
+
+The roster, assignment, enrollment and submission tables are copied into
+``<table>__stg<tag>`` shadow tables (same columns, indexes and foreign keys,
+the keys pointing at the other shadow tables). The importer fills those
+without touching the live tables, so dashboards keep reading the previous
+dataset at full speed. ``publish`` then renames live -> ``__old<tag>`` and
+shadow -> live in one short schema transaction (``sp_rename`` on SQL Server,
+``ALTER TABLE ... RENAME`` elsewhere) and records a ``DatasetVersion`` row.
+Foreign keys follow the renamed tables on both SQL Server and SQLite.
+Explicitly named indexes (``Meta.indexes``) get a per-tag name on the shadow
+tables where index names are unique per database (SQLite, PostgreSQL) and
+are renamed back once the old tables are gone. SQL Server and MySQL scope
+index names to their table, so there the shadow tables carry the final
+names and ``publish`` has nothing to rename; mssql-django can't rename an
+index and would drop and rebuild it on the live table instead.
+
+Staged loads (this and ``sync_canvas``) run one at a time under
+``load_lock()``, a database-held lock: ``sp_getapplock`` on SQL Server,
+an advisory lock on PostgreSQL, ``GET_LOCK`` on MySQL, and a pid file under
+``log/`` for local SQLite. Leftover shadow tables are only dropped while the
+lock is held, so they can't belong to a load that is still running.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.db.migrations.state import ModelState, StateApps
+
+from students import picklists, search_index
+from students.models import Studentlist, Assignment, Enrollment, Submission, DatasetVersion
+
+# Parents before children: create/rename in this order, drop in reverse
+STAGED_MODELS = (Studentlist, Assignment, Enrollment, Submission)
+
+LOCK_NAME = "craft_staged_load"
+LOCK_KEY = 0x43524146  # PostgreSQL advisory lock key ("CRAF")
+
+
+class LoadInProgress(RuntimeError):
+    pass
+
+
+def _try_lock():
+    with connection.cursor() as cursor:
+        if connection.vendor == "microsoft":
+            cursor.execute(
+                "SET NOCOUNT ON; DECLARE @r int; EXEC @r = sp_getapplock @Resource = %s, @LockMode = 'Exclusive', "
+                "@LockOwner = 'Session', @LockTimeout = 0; SELECT @r",
+                [LOCK_NAME],
+            )
+            return cursor.fetchone()[0] >= 0
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", [LOCK_KEY])
+            return bool(cursor.fetchone()[0])
+        if connection.vendor == "mysql":
+            cursor.execute("SELECT GET_LOCK(%s, 0)", [LOCK_NAME])
+            return cursor.fetchone()[0] == 1
+    return _try_lock_file()
+
+
+def _release_lock():
+    with connection.cursor() as cursor:
+        if connection.vendor == "microsoft":
+            cursor.execute("EXEC sp_releaseapplock @Resource = %s, @LockOwner = 'Session'", [LOCK_NAME])
+            return
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT pg_advisory_unlock(%s)", [LOCK_KEY])
+            return
+        if connection.vendor == "mysql":
+            cursor.execute("SELECT RELEASE_LOCK(%s)", [LOCK_NAME])
+            return
+    os.remove(_lock_file())
+
+
+def _lock_file():
+    return os.path.join(settings.BASE_DIR, "log", f"{LOCK_NAME}.pid")
+
+
+def _try_lock_file():
+    path = _lock_file()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            with open(path, encoding="utf-8") as f:
+                owner = int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return False
+        if os.name == "posix" and owner:
+            try:
+                os.kill(owner, 0)
+                return False
+            except ProcessLookupError:  # the owner died without cleaning up
+                os.remove(path)
+                return _try_lock_file()
+            except PermissionError:
+                return False
+        return False
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(str(os.getpid()))
+    return True
+
+
+@contextmanager
+def load_lock(timeout=None):
+    """
+    Hold the staged-load lock for the block. Waits up to ``timeout`` seconds
+    (default ``STAGING_LOCK_TIMEOUT``, 0 = don't wait) and raises
+    ``LoadInProgress`` if another load still holds it.
+    """
+    if timeout is None:
+        timeout = float(os.getenv("STAGING_LOCK_TIMEOUT", "0"))
+    deadline = time.monotonic() + timeout
+    while not _try_lock():
+        if time.monotonic() >= deadline:
+            raise LoadInProgress("Another staged load or sync_canvas run is in progress")
+        time.sleep(1)
+    try:
+        yield
+    finally:
+        _release_lock()
+
+
+def new_tag():
+    return str(int(time.time()))
+
+
+def staged_table(model, tag):
+    return f"{model._meta.db_table}__stg{tag}"
+
+
+def retired_table(model, tag):
+    return f"{model._meta.db_table}__old{tag}"
+
+
+def index_names_per_table():
+    return connection.vendor in ("microsoft", "mysql")
+
+
+def staged_index(index, tag):
+    if index_names_per_table():
+        return index
+    staged = index.clone()
+    staged.name = f"{index.name[:18]}_s{tag}"
+    return staged
+
+
+def staging_models(tag):
+    """
+    Unregistered copies of ``STAGED_MODELS`` bound to the shadow tables.
+    Returned as ``{live_model: shadow_model}``; foreign keys between the
+    copies resolve to each other, not to the live tables.
+    """
+    states = {}
+    for model in STAGED_MODELS:
+        state = ModelState.from_model(model)
+        state.options["db_table"] = staged_table(model, tag)
+        state.options["indexes"] = [staged_index(index, tag) for index in state.options.get("indexes", [])]
+        states[(state.app_label, state.name_lower)] = state
+    shadow_apps = StateApps(set(), states)
+    return {model: shadow_apps.get_model(model._meta.label) for model in STAGED_MODELS}
+
+
+def create_staging(tag):
+    models = staging_models(tag)
+    with connection.schema_editor() as editor:
+        for model in STAGED_MODELS:
+            editor.create_model(models[model])
+    return models
+
+
+def drop_tables(tables):
+    existing = set(connection.introspection.table_names())
+    with connection.cursor() as cursor:
+        for table in tables:
+            if table in existing:
+                cursor.execute(f"DROP TABLE {connection.ops.quote_name(table)}")
+
+
+def drop_staging(tag):
+    drop_tables([staged_table(model, tag) for model in reversed(STAGED_MODELS)])
+
+
+def leftover_tables():
+    """
+    Shadow/retired tables left behind by interrupted loads. Only meaningful
+    under ``load_lock()``: without it they may belong to a running load.
+    """
+    prefixes = tuple(model._meta.db_table + "__" for model in STAGED_MODELS)
+    return [t for t in connection.introspection.table_names() if t.startswith(prefixes)]
+
+
+def publish(tag, mode="staged", row_counts=None):
+    """
+    Swap the filled shadow tables in for the live ones and record the new
+    dataset version in the same transaction. Only the renames run under the
+    schema lock; the old tables are dropped afterwards, outside it.
+    """
+    with connection.schema_editor(atomic=True) as editor:
+        for model in STAGED_MODELS:
+            live = model._meta.db_table
+            editor.alter_db_table(model, live, retired_table(model, tag))
+            editor.alter_db_table(model, staged_table(model, tag), live)
+        version = DatasetVersion.objects.create(mode=mode, row_counts=row_counts or {})
+    drop_tables([retired_table(model, tag) for model in reversed(STAGED_MODELS)])
+    if not index_names_per_table():
+        with connection.schema_editor() as editor:
+            for model in STAGED_MODELS:
+                for index in model._meta.indexes:
+                    editor.rename_index(model, staged_index(index, tag), index)
+    picklists.invalidate()
+    search_index.invalidate()
+    return version
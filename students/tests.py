@@ -1,3 +1,1069 @@
-from django.test import TestCase
+import argparse
+import csv
+import filecmp
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from types import SimpleNamespace
+from unittest import skipIf
+from zoneinfo import ZoneInfo
+from unittest import mock
 
-# Create your tests here.
+import pandas as pd
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Exists, OuterRef
+from django.test import (
+    RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature,
+)
+from django.urls import reverse
+from django.utils import timezone
+
+from . import picklists, search_index, staging
+from .fetch_metrics import FetchMetrics, endpoint_of
+from .import_loader import (
+    aware_datetimes, normalize_column, python_values, text_ids, typed_enrollments, typed_submissions,
+)
+from .bulk_load import BulkInserter, _input_sizes, _insert_fields, get_backend
+from . import interchange
+from .jsonl_stream import JsonlWriter, iter_jsonl
+from .interchange import TableStreamWriter, find_table, iter_table_chunks, read_table, write_table
+from .management.commands.fetch_canvas_assignments import (
+    in_shard, parse_shard, shard_path,
+    _etl_paths, extract_transform_load_chunked, extract_transform_load_vectorized,
+)
+from .models import (
+    SORT_KEY_LENGTH, Assignment, DatasetVersion, Enrollment, Studentlist, Submission, natural_sort_key,
+)
+from .pagination import InvalidCursor, after, decode_cursor, encode_cursor, keyset_page, page_size_from
+from .rate_limiter import AdaptiveRateLimiter
+from .search_index import (
+    EXACT, FIELD_WEIGHTS, PREFIX, SEARCH_FIELDS, SUBSTRING, WORD_PREFIX, StudentSearchIndex, tokenize,
+)
+from .views import (
+    INACTIVITY_BUCKETS, LAST_LOGIN_ORDER, STUDENT_DIRECTORY_ORDER, SUBMISSION_FEED_ORDER,
+    _inactivity_page, _inactivity_range, inactive_days_since,
+)
+
+STATUSES = ["on_time", "late", "missing", "floating"]
+
+
+def make_roster(students=60, assignments=8, now=None):
+    """A small synthetic dataset: every student has an enrollment and a submission per assignment."""
+    now = now or timezone.now()
+    Studentlist.objects.bulk_create([
+        Studentlist(
+            name=f"Student {i % 20:02d}",  # repeated names, so the id tie-break matters
+            student_id=str(5000000 + i),
+            sis_id=f"U{10000000 + i}",
+            email=f"student{i}@usf.edu",
+            section_name=f"CGS2100.{i % 3:03d}F25.1 Computers",
+        )
+        for i in range(students)
+    ])
+    Assignment.objects.bulk_create([
+        Assignment(id=100 + a, title=f"Quiz {a}", sort_key=natural_sort_key(f"Quiz {a}"))
+        for a in range(assignments)
+    ])
+    Enrollment.objects.bulk_create([
+        Enrollment(
+            student_id=str(5000000 + i), type="StudentEnrollment", role="StudentEnrollment",
+            sis_user_id=f"U{10000000 + i}",
+            last_activity_at=None if i % 7 == 0 else now - timedelta(hours=11 * i),
+        )
+        for i in range(students)
+    ])
+    Submission.objects.bulk_create([
+        Submission(
+            student_id=str(5000000 + i), assignment_id=100 + a,
+            score=(i * 7 + a * 13) % 101, status=STATUSES[(i + a) % len(STATUSES)],
+        )
+        for i in range(students) for a in range(assignments)
+    ])
+
+
+def index_names(model, columns):
+    """Names of the indexes on ``model`` whose leading columns are ``columns``."""
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+    return {
+        name for name, info in constraints.items()
+        if (info["index"] or info["unique"] or info["primary_key"])
+        and tuple(info["columns"][:len(columns)]) == tuple(columns)
+    }
+
+
+@skipUnlessDBFeature("supports_explaining_query_execution")
+class QueryPlanTests(TestCase):
+    """The hot list/filter queries are served by the indexes built for them."""
+
+    @classmethod
+    def setUpTestData(cls):
+        make_roster(students=200, assignments=10)
+
+    def assertUsesIndex(self, queryset, model, columns):
+        expected = index_names(model, columns)
+        self.assertTrue(expected, f"no index on {model.__name__}({', '.join(columns)})")
+        plan = queryset.explain()
+        used = [name for name in expected if re.search(rf"\b{re.escape(name)}\b", plan)]
+        self.assertTrue(used, f"none of {sorted(expected)} in the plan:\n{plan}")
+
+    def feed(self):
+        return Submission.objects.select_related("student", "assignment").order_by(*SUBMISSION_FEED_ORDER)
+
+    def test_feed_by_assignment_and_status(self):
+        self.assertUsesIndex(
+            self.feed().filter(assignment_id__in=[101, 102], status="missing"),
+            Submission, ["assignment_id", "status"],
+        )
+
+    def test_feed_by_assignment_and_score_range(self):
+        self.assertUsesIndex(
+            self.feed().filter(assignment_id__in=[101], score__gte=0, score__lte=50),
+            Submission, ["assignment_id", "score"],
+        )
+
+    def test_feed_by_student_and_assignment(self):
+        self.assertUsesIndex(
+            self.feed().filter(student__name="Student 03", assignment_id__in=[101]),
+            Submission, ["student_id", "assignment_id"],
+        )
+
+    def test_directory_keyset_page(self):
+        self.assertUsesIndex(
+            Studentlist.objects.filter(after(STUDENT_DIRECTORY_ORDER, ["Student 05", "5000005"]))
+            .order_by(*STUDENT_DIRECTORY_ORDER),
+            Studentlist, ["name", "student_id"],
+        )
+
+    def test_last_login_bucket(self):
+        now = timezone.now()
+        self.assertUsesIndex(
+            Enrollment.objects.filter(
+                last_activity_at__lte=now - timedelta(days=8),
+                last_activity_at__gt=now - timedelta(days=15),
+            ).order_by(*LAST_LOGIN_ORDER),
+            Enrollment, ["last_activity_at", "id"],
+        )
+
+    def test_assignment_pick_list(self):
+        self.assertUsesIndex(
+            Assignment.objects.order_by("sort_key", "id").values("id", "title"),
+            Assignment, ["sort_key", "id"],
+        )
+
+    def test_student_pick_list(self):
+        self.assertUsesIndex(
+            Studentlist.objects.filter(Exists(Submission.objects.filter(student=OuterRef("pk"))))
+            .order_by("name").values_list("name", flat=True).distinct(),
+            Submission, ["student_id"],
+        )
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        make_roster(students=45, assignments=1)
+
+    def walk(self, queryset, fields, page_size):
+        rows, cursor, pages = [], None, 0
+        while True:
+            page, cursor = keyset_page(queryset, fields, cursor=cursor, page_size=page_size)
+            rows.extend(page)
+            pages += 1
+            if cursor is None:
+                return rows, pages
+
+    def test_pages_cover_the_full_ordering_once(self):
+        students = Studentlist.objects.values("name", "student_id")
+        rows, pages = self.walk(students, STUDENT_DIRECTORY_ORDER, page_size=7)
+        self.assertEqual(rows, list(students.order_by(*STUDENT_DIRECTORY_ORDER)))
+        self.assertEqual(pages, 7)  # 45 rows: six full pages and a partial one
+
+    def test_exact_multiple_ends_without_an_empty_page(self):
+        rows, pages = self.walk(Studentlist.objects.values("name", "student_id"), STUDENT_DIRECTORY_ORDER, 9)
+        self.assertEqual((len(rows), pages), (45, 5))
+
+    def test_model_rows_follow_relations(self):
+        feed = Submission.objects.select_related("student")
+        rows, _ = self.walk(feed, SUBMISSION_FEED_ORDER, page_size=4)
+        self.assertEqual([s.pk for s in rows], list(feed.order_by(*SUBMISSION_FEED_ORDER).values_list("pk", flat=True)))
+
+    def test_after_is_a_strict_row_comparison(self):
+        students = Studentlist.objects.order_by(*STUDENT_DIRECTORY_ORDER)
+        key = list(students.values_list(*STUDENT_DIRECTORY_ORDER)[10])
+        later = students.filter(after(STUDENT_DIRECTORY_ORDER, key)).values_list(*STUDENT_DIRECTORY_ORDER)
+        self.assertEqual([list(row) for row in later], [list(row) for row in students.values_list(*STUDENT_DIRECTORY_ORDER)[11:]])
+
+    def test_cursor_round_trip_and_rejects(self):
+        self.assertEqual(decode_cursor(encode_cursor(["Student 01", "5000001"]), 2), ["Student 01", "5000001"])
+        with self.assertRaises(InvalidCursor):
+            decode_cursor("not base64 json!", 2)
+        with self.assertRaises(InvalidCursor):
+            decode_cursor(encode_cursor(["only one"]), 2)
+        with self.assertRaises(InvalidCursor):
+            decode_cursor(encode_cursor([["nested"], "5000001"]), 2)
+
+    def test_page_size_is_clamped(self):
+        factory = RequestFactory()
+        self.assertEqual(page_size_from(factory.get("/", {"page_size": "0"}), 50), 1)
+        self.assertEqual(page_size_from(factory.get("/", {"page_size": "100000"}), 50), 500)
+        self.assertEqual(page_size_from(factory.get("/", {"page_size": "abc"}), 50), 50)
+
+
+class StudentDirectoryViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        make_roster(students=30, assignments=1)
+        cls.user = User.objects.create_user("staff")
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_cursor_paging_and_total(self):
+        url = reverse("student_directory")
+        data = self.client.get(url, {"page_size": 8, "include_total": 1}).json()
+        self.assertEqual(data["total"], 30)
+        seen = [row["student_id"] for row in data["students"]]
+        while data["next_cursor"]:
+            data = self.client.get(url, {"page_size": 8, "cursor": data["next_cursor"]}).json()
+            seen += [row["student_id"] for row in data["students"]]
+        expected = Studentlist.objects.order_by(*STUDENT_DIRECTORY_ORDER).values_list("student_id", flat=True)
+        self.assertEqual(seen, list(expected))
+
+    def test_bad_cursor_is_a_400(self):
+        self.assertEqual(self.client.get(reverse("student_directory"), {"cursor": "@@"}).status_code, 400)
+
+    def test_filter_endpoint_stays_unpaged(self):
+        data = self.client.get(reverse("filter_students"), {"sections": "CGS2100.001"}).json()
+        self.assertEqual(len(data["students"]), Studentlist.objects.filter(section_name__startswith="CGS2100.001").count())
+
+
+class InactivityListingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.now = timezone.now()
+        make_roster(students=45, assignments=1, now=cls.now)  # 7 never-active enrollments
+        # Exactly on the bucket edges: 3 days is still "0-3", 4 days starts "4-7", and so on.
+        Enrollment.objects.bulk_create([
+            Enrollment(student_id="5000001", type="StudentEnrollment", role="StudentEnrollment",
+                       sis_user_id="U10000001", last_activity_at=cls.now - timedelta(days=days, seconds=shift))
+            for days in (3, 4, 7, 8, 14, 15) for shift in (-1, 0, 1)
+        ])
+
+    def expected_order(self):
+        never = Enrollment.objects.filter(last_activity_at__isnull=True).order_by("id")
+        active = Enrollment.objects.filter(last_activity_at__isnull=False).order_by(*LAST_LOGIN_ORDER)
+        return list(never.values_list("id", flat=True)) + list(active.values_list("id", flat=True))
+
+    def walk(self, page_size):
+        ids, cursor = [], None
+        while True:
+            rows, cursor = _inactivity_page(Enrollment.objects.all(), cursor, page_size)
+            self.assertLessEqual(len(rows), page_size)
+            ids += [row.id for row in rows]
+            if cursor is None:
+                return ids
+
+    def test_never_active_first_then_longest_inactive(self):
+        for page_size in (1, 4, 7, 100):  # 7 lands exactly on the end of the never-active run
+            with self.subTest(page_size=page_size):
+                self.assertEqual(self.walk(page_size), self.expected_order())
+
+    def test_only_never_active(self):
+        rows, cursor = _inactivity_page(Enrollment.objects.filter(last_activity_at__isnull=True), None, 7)
+        self.assertEqual((len(rows), cursor), (7, None))
+
+    def test_cursor_for_another_listing_is_rejected(self):
+        with self.assertRaises(InvalidCursor):
+            _inactivity_page(Enrollment.objects.all(), encode_cursor(["Student 01", "5000001"]), 10)
+
+    def test_tampered_cursors_are_rejected(self):
+        tampered = [
+            ["never", 5],
+            ["active", ["x"]],
+            ["never", encode_cursor(["not an id"])],
+            ["active", encode_cursor(["not a date", 1])],
+            ["active", encode_cursor([{"a": 1}, 1])],
+        ]
+        for values in tampered:
+            with self.subTest(cursor=values), self.assertRaises(InvalidCursor):
+                _inactivity_page(Enrollment.objects.all(), encode_cursor(values), 10)
+
+    def test_view_answers_a_tampered_cursor_with_400(self):
+        self.client.force_login(User.objects.create_user("staff"))
+        response = self.client.get(reverse("last_login"), {"cursor": encode_cursor(["active", 7])})
+        self.assertEqual(response.status_code, 400)
+
+    def test_bucket_ranges_match_inactive_days(self):
+        enrollments = list(Enrollment.objects.exclude(last_activity_at__isnull=True))
+        for key, fewest, most in INACTIVITY_BUCKETS:
+            with self.subTest(bucket=key):
+                in_range = set(
+                    Enrollment.objects.filter(_inactivity_range(fewest, most, self.now)).values_list("id", flat=True)
+                )
+                expected = {
+                    e.id for e in enrollments
+                    if fewest <= inactive_days_since(e.last_activity_at, self.now) <= (most if most is not None else 10**6)
+                }
+                self.assertEqual(in_range, expected)
+        self.assertIsNone(inactive_days_since(None, self.now))
+
+
+SEARCH_ROSTER = [
+    {"name": "Ann Lee", "email": "alee@usf.edu", "sis_id": "U100", "section_name": "A", "student_id": "7"},
+    {"name": "Ann", "email": "ann@usf.edu", "sis_id": "U101", "section_name": "A", "student_id": "3"},
+    {"name": "Annabel Smith", "email": "asmith@usf.edu", "sis_id": "U102", "section_name": "B", "student_id": "5"},
+    {"name": "Joanna Annis", "email": "joanna.annis@usf.edu", "sis_id": "U103", "section_name": "B", "student_id": "1"},
+    {"name": "Hanna Brown", "email": "hbrown@usf.edu", "sis_id": "ANN7", "section_name": "C", "student_id": "2"},
+    {"name": "Leeann Park", "email": "lpark@usf.edu", "sis_id": "U105", "section_name": "C", "student_id": "4"},
+    {"name": "Ann Lee", "email": "ann.lee2@usf.edu", "sis_id": "U106", "section_name": "C", "student_id": "6"},
+    {"name": "Bob Stone", "email": "bstone@usf.edu", "sis_id": None, "section_name": "A", "student_id": "8"},
+]
+
+
+def linear_search(rows, q="", name="", email="", sis_id=""):
+    """The ranking ``StudentSearchIndex.search`` promises, computed row by row."""
+    terms = [(token, SEARCH_FIELDS) for token in tokenize(q)]
+    for field, text in (("name", name), ("email", email), ("sis_id", sis_id)):
+        terms += [(token, (field,)) for token in tokenize(text)]
+
+    def quality(token, value):
+        value = (value or "").lower()
+        if token not in value:
+            return 0
+        if value == token:
+            return EXACT
+        if value.startswith(token):
+            return PREFIX
+        if any(word.startswith(token) for word in re.split(r"[\s.@_\-,]+", value)):
+            return WORD_PREFIX
+        return SUBSTRING
+
+    ranked = []
+    for row in rows:
+        scores = [max(quality(token, row[f]) * FIELD_WEIGHTS[f] for f in fields) for token, fields in terms]
+        if all(scores):
+            ranked.append((-sum(scores), row["name"], row["student_id"]))
+    return [(name, student_id) for _, name, student_id in sorted(ranked)]
+
+
+class StudentSearchIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = StudentSearchIndex(SEARCH_ROSTER)
+
+    def found(self, **params):
+        return [(row["name"], row["student_id"]) for row in self.index.search(**params)]
+
+    def test_exact_then_prefix_then_word_prefix_then_substring(self):
+        self.assertEqual(self.found(name="ann"), [
+            ("Ann", "3"),            # whole field
+            ("Ann Lee", "6"), ("Ann Lee", "7"), ("Annabel Smith", "5"),  # field prefix, by (name, id)
+            ("Joanna Annis", "1"),   # word prefix
+            ("Hanna Brown", "2"), ("Leeann Park", "4"),  # substring
+        ])
+
+    def test_every_token_must_match(self):
+        self.assertEqual(self.found(q="ann lee"), [("Ann Lee", "6"), ("Ann Lee", "7"), ("Leeann Park", "4")])
+        self.assertEqual(self.found(q="ann zzz"), [])
+
+    def test_field_params_only_search_their_field(self):
+        self.assertEqual(self.found(sis_id="ann"), [("Hanna Brown", "2")])
+        self.assertEqual(self.found(email="annis"), [("Joanna Annis", "1")])
+        self.assertEqual(self.found(q="ann", email="lee"), [("Ann Lee", "6"), ("Ann Lee", "7")])
+
+    def test_matches_a_linear_scan(self):
+        queries = [
+            {"q": "ann"}, {"q": "an"}, {"q": "a"}, {"q": "usf.edu"}, {"q": "lee ann"}, {"q": "U10"},
+            {"q": "annabel"}, {"q": "smith@usf"}, {"q": "e"}, {"name": "lee", "sis_id": "u1"},
+            {"email": "ann"}, {"q": "ANN7"}, {"q": "stone"}, {"q": "nobody"},
+        ]
+        for params in queries:
+            with self.subTest(**params):
+                self.assertEqual(self.found(**params), linear_search(SEARCH_ROSTER, **params))
+
+    def test_empty_query_lists_everyone_in_name_order(self):
+        result = self.index.search()
+        self.assertEqual(result.total, len(SEARCH_ROSTER))
+        self.assertEqual(
+            [(r["name"], r["student_id"]) for r in result],
+            sorted((r["name"], r["student_id"]) for r in SEARCH_ROSTER),
+        )
+
+    def test_pages_are_slices_of_the_ranking(self):
+        result = self.index.search(q="usf")
+        everything = list(result)
+        for offset, limit in ((0, 3), (2, 3), (5, 10), (7, 1), (8, 5)):
+            with self.subTest(offset=offset, limit=limit):
+                self.assertEqual(result.page(offset, limit), everything[offset:offset + limit])
+
+    def test_repeated_queries_share_a_result(self):
+        self.assertIs(self.index.search(q="Ann  lee"), self.index.search(q="ann lee"))
+
+
+class SearchIndexRebuildTests(TestCase):
+    def setUp(self):
+        search_index.invalidate()
+        self.addCleanup(search_index.invalidate)
+
+    def test_invalidate_picks_up_new_students(self):
+        make_roster(students=5, assignments=1)
+        self.assertEqual(search_index.get_index().search(q="student").total, 5)
+        Studentlist.objects.create(name="Zed Newcomer", student_id="9000001", sis_id="U9", email="zed@usf.edu")
+        search_index.invalidate()
+        self.assertEqual([r["student_id"] for r in search_index.get_index().search(q="zed")], ["9000001"])
+
+
+class NaturalSortKeyTests(SimpleTestCase):
+    def test_numbers_sort_by_value(self):
+        titles = ["Quiz 10", "quiz 2", "Quiz 1", "Lab 3 Part 12", "Lab 3 Part 2", "Lab 03", "Exam"]
+        self.assertEqual(sorted(titles, key=natural_sort_key), [
+            "Exam", "Lab 03", "Lab 3 Part 2", "Lab 3 Part 12", "Quiz 1", "quiz 2", "Quiz 10",
+        ])
+
+    def test_key_fits_the_column(self):
+        title = "1 " * 100  # 200 characters that pad out to far more than the column holds
+        self.assertEqual(len(natural_sort_key(title)), SORT_KEY_LENGTH)
+        self.assertEqual(natural_sort_key(None), "")
+
+
+class PicklistTests(TestCase):
+    def setUp(self):
+        cache.clear()  # entries are keyed by dataset version, which every test database starts over at
+
+    def test_assignments_in_natural_order(self):
+        Assignment.objects.bulk_create([
+            Assignment(id=id_, title=title, sort_key=natural_sort_key(title))
+            for id_, title in ((1, "Quiz 10"), (2, "Quiz 9"), (3, "Quiz 1"))
+        ])
+        self.assertEqual([a["title"] for a in picklists.assignment_choices()], ["Quiz 1", "Quiz 9", "Quiz 10"])
+
+
+class ChunkedEtlTests(SimpleTestCase):
+    def setUp(self):
+        self.dirs = [tempfile.mkdtemp(prefix="craft_etl_test_") for _ in range(2)]
+        for d in self.dirs:
+            self.addCleanup(shutil.rmtree, d, ignore_errors=True)
+
+    def test_matches_the_vectorized_csvs(self):
+        rows = []
+        for i in range(40):
+            a = i % 6
+            rows.append({
+                "Student ID": str(5000000 + i // 6), "assignment_id": 100 + a,
+                "title": f"Quiz  {a}" if i % 4 else f"quiz {a}",  # same canonical title, different spelling
+                "points_possible": 10.0,
+                # the earliest due date for a title often turns up in a later chunk
+                "due_at": None if i % 5 == 0 else f"2025-09-{28 - i % 9:02d}T03:59:00Z",
+                "status": "on_time", "score": float(i % 11), "submitted_at": None,
+            })
+        frame = pd.DataFrame(rows)
+        for group_by_due_date in (False, True):
+            with self.subTest(group_by_due_date=group_by_due_date):
+                vectorized, chunked = (write_table(frame, d, "assignments_cleaned", "csv") for d in self.dirs)
+                with redirect_stdout(io.StringIO()):
+                    extract_transform_load_vectorized(vectorized, group_by_due_date)
+                    extract_transform_load_chunked(chunked, group_by_due_date, chunksize=7)
+                for a, b in zip(_etl_paths(vectorized), _etl_paths(chunked)):
+                    self.assertTrue(filecmp.cmp(a, b, shallow=False), os.path.basename(a))
+
+
+class SharedRateStateTests(SimpleTestCase):
+    def setUp(self):
+        work_dir = tempfile.mkdtemp(prefix="craft_rate_test_")
+        self.addCleanup(shutil.rmtree, work_dir, ignore_errors=True)
+        self.state_file = os.path.join(work_dir, "canvas_rate_state.json")
+
+    def limiter(self):
+        return AdaptiveRateLimiter(max_concurrency=4, cooldown=2, state_file=self.state_file)
+
+    def state(self):
+        with open(self.state_file, encoding="utf-8") as f:
+            return json.load(f)
+
+    def test_a_shorter_pause_does_not_cut_a_longer_one(self):
+        self.limiter().observe(SimpleNamespace(status_code=429, headers={"Retry-After": "60"}))
+        self.limiter().observe(SimpleNamespace(status_code=429, headers={}))
+        self.assertGreater(self.state()["paused_until"], time.time() + 50)
+
+    def test_readings_are_written_at_most_once_per_interval(self):
+        limiter = self.limiter()
+        for remaining in (500, 450, 400):
+            limiter.observe(SimpleNamespace(status_code=200, headers={"X-Rate-Limit-Remaining": str(remaining)}))
+        self.assertEqual(self.state()["remaining"], 500)
+
+
+def write_csv(path, header, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def write_import_inputs(base_dir, students, assignments, scores):
+    """
+    The four files import_canvas_data reads, as CSV under ``base_dir/data_exports``.
+    ``students`` are IDs, ``assignments`` {id: title}, ``scores`` {(student, assignment): score}.
+    """
+    data_dir = os.path.join(base_dir, "data_exports")
+    os.makedirs(data_dir, exist_ok=True)
+    write_csv(
+        os.path.join(data_dir, "StudentRoster.csv"),
+        ["Student Name", "Student ID", "Student SIS ID", "Email", "Section Name"],
+        [[f"Student {sid}", sid, f"U{sid}", f"{sid}@usf.edu", "CGS2100.001"] for sid in students],
+    )
+    write_csv(
+        os.path.join(data_dir, "cleaned_enrollments_data.csv"),
+        ["Student ID", "type", "role", "last_activity_at", "sis_course_id", "sis_section_id", "sis_user_id", "current_score"],
+        [[sid, "StudentEnrollment", "StudentEnrollment", "2025-11-02T15:00:00Z", "C1", "C1.001", f"U{sid}", 90.0]
+         for sid in students],
+    )
+    write_csv(
+        os.path.join(data_dir, "assignments_cleaned_assignments.csv"),
+        ["id", "title", "due_date"],
+        [[aid, title, "2025-09-10T03:59:00Z"] for aid, title in assignments.items()],
+    )
+    write_csv(
+        os.path.join(data_dir, "assignments_cleaned_submissions.csv"),
+        ["student_id", "assignment_id", "submitted_at", "score", "status"],
+        [[sid, aid, "2025-09-09T12:00:00Z" if score == score else "", score, "on_time" if score == score else "missing"]
+         for (sid, aid), score in scores.items()],
+    )
+
+
+def dataset_rows():
+    """Everything the import writes, without surrogate keys."""
+    return {
+        "students": set(Studentlist.objects.values_list("student_id", "name", "sis_id", "email", "section_name")),
+        "enrollments": set(Enrollment.objects.values_list("student_id", "sis_course_id", "last_activity_at", "current_score")),
+        "assignments": set(Assignment.objects.values_list("id", "title", "due_date", "sort_key")),
+        "submissions": set(Submission.objects.values_list("student_id", "assignment_id", "submitted_at", "score", "status")),
+    }
+
+
+class TempBaseDirMixin:
+    def setUp(self):
+        super().setUp()
+        self.base_dir = tempfile.mkdtemp(prefix="craft_test_")
+        self.addCleanup(shutil.rmtree, self.base_dir, ignore_errors=True)
+        settings_override = override_settings(BASE_DIR=self.base_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def run_import(self, mode, **options):
+        out = io.StringIO()
+        call_command("import_canvas_data", mode=mode, stdout=out, **options)
+        return out.getvalue()
+
+
+class UpsertImportTests(TempBaseDirMixin, TestCase):
+    students = ["1", "2", "3", "4"]
+    assignments = {101: "Quiz 1", 102: "Quiz 2", 103: "Quiz 10"}
+
+    def setUp(self):
+        super().setUp()
+        scores = {(sid, aid): float(aid - 100) for sid in self.students for aid in self.assignments}
+        write_import_inputs(self.base_dir, self.students, self.assignments, scores)
+        self.run_import("replace")
+
+    def changed_inputs(self):
+        students = ["1", "2", "3", "5"]                          # 4 leaves, 5 joins
+        assignments = {101: "Quiz 1", 102: "Quiz 2 (retake)", 104: "Quiz 4"}  # 103 removed, 102 renamed
+        scores = {(sid, aid): float(aid - 100) for sid in students for aid in assignments}
+        scores[("1", 101)] = 9.5
+        scores[("2", 104)] = float("nan")
+        write_import_inputs(self.base_dir, students, assignments, scores)
+
+    def test_upsert_ends_where_a_replace_would(self):
+        self.changed_inputs()
+        self.run_import("upsert")
+        upserted = dataset_rows()
+        self.run_import("replace")
+        self.assertEqual(upserted, dataset_rows())
+
+    def test_counts_children_before_parents(self):
+        self.changed_inputs()
+        self.run_import("upsert")
+        counts = DatasetVersion.objects.latest().row_counts
+        # student 4's and assignment 103's submissions are counted as deletes, not cascaded away unseen
+        self.assertEqual(counts["submissions"], {"inserted": 6, "updated": 1, "deleted": 6, "unchanged": 5})
+        self.assertEqual(counts["students"], {"inserted": 1, "updated": 0, "deleted": 1, "unchanged": 3})
+        self.assertEqual(counts["assignments"], {"inserted": 1, "updated": 1, "deleted": 1, "unchanged": 1})
+        self.assertEqual(counts["enrollments"], {"inserted": 1, "updated": 0, "deleted": 1, "unchanged": 3})
+        self.assertIsNone(Submission.objects.get(student_id="2", assignment_id=104).score)
+
+    def test_unchanged_inputs_write_nothing(self):
+        self.run_import("upsert")
+        counts = DatasetVersion.objects.latest().row_counts
+        for label, expected in (("students", 4), ("enrollments", 4), ("assignments", 3), ("submissions", 12)):
+            with self.subTest(table=label):
+                self.assertEqual(counts[label], {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": expected})
+
+
+class StagedImportTests(TempBaseDirMixin, TransactionTestCase):
+    # The schema editor can't run inside the atomic block a TestCase wraps each test in on SQLite.
+    tags = iter(range(1000000000, 2000000000))
+
+    def setUp(self):
+        super().setUp()
+        # Tags are whole seconds; the swapped-in tables keep index names carrying theirs, so
+        # two loads within the same second would clash.
+        tag_patch = mock.patch.object(staging, "new_tag", side_effect=lambda: str(next(self.tags)))
+        tag_patch.start()
+        self.addCleanup(tag_patch.stop)
+        self.old_scores = {(sid, 101): 5.0 for sid in ("1", "2")}
+        write_import_inputs(self.base_dir, ["1", "2"], {101: "Quiz 1"}, self.old_scores)
+        self.run_import("replace")
+        self.live = dataset_rows()
+        write_import_inputs(self.base_dir, ["1", "2", "3"], {101: "Quiz 1", 102: "Quiz 2"},
+                            {(sid, aid): 8.0 for sid in ("1", "2", "3") for aid in (101, 102)})
+
+    def test_swaps_in_the_new_dataset(self):
+        self.run_import("staged")
+        staged = dataset_rows()
+        self.assertEqual(len(staged["submissions"]), 6)
+        self.assertEqual(staging.leftover_tables(), [])
+        self.assertEqual(DatasetVersion.objects.latest().mode, "staged")
+        self.assertEqual(DatasetVersion.objects.latest().row_counts["submissions"], 6)
+        self.run_import("replace")
+        self.assertEqual(staged, dataset_rows())
+
+    def test_index_names_survive_the_swap(self):
+        self.run_import("staged")
+        for model in staging.STAGED_MODELS:
+            for index in model._meta.indexes:
+                with self.subTest(index=index.name):
+                    columns = [model._meta.get_field(f).column for f in index.fields]
+                    self.assertIn(index.name, index_names(model, columns))
+
+    def test_failed_publish_keeps_live_data(self):
+        with mock.patch.object(staging, "publish", side_effect=RuntimeError("swap failed")):
+            with self.assertRaises(RuntimeError):
+                self.run_import("staged")
+        self.assertEqual(staging.leftover_tables(), [])
+        self.assertEqual(dataset_rows(), self.live)
+
+    def test_one_staged_load_at_a_time(self):
+        with staging.load_lock():
+            with self.assertRaises(staging.LoadInProgress):
+                with staging.load_lock(timeout=0):
+                    pass
+            with self.assertRaisesMessage(CommandError, "in progress"):
+                self.run_import("staged")
+        self.assertEqual(dataset_rows(), self.live)
+        with staging.load_lock(timeout=0):  # released again
+            pass
+
+
+class BulkBackendTests(TempBaseDirMixin, TestCase):
+    def test_auto_falls_back_to_the_orm_off_sql_server(self):
+        self.assertEqual(get_backend("auto"), "orm")
+        self.assertEqual(get_backend("ORM"), "orm")
+        with mock.patch.dict(os.environ, {"IMPORT_BULK_BACKEND": "orm"}):
+            self.assertEqual(get_backend(), "orm")
+
+    def test_rejects_unknown_and_unavailable_backends(self):
+        with self.assertRaisesMessage(ValueError, "Unknown bulk backend"):
+            get_backend("copy")
+        with self.assertRaisesMessage(ValueError, "needs mssql-django with pyodbc"):
+            get_backend("odbc")
+
+    def test_import_reports_a_bad_backend_as_a_command_error(self):
+        write_import_inputs(self.base_dir, ["1"], {101: "Quiz 1"}, {("1", 101): 1.0})
+        with self.assertRaisesMessage(CommandError, "needs mssql-django with pyodbc"):
+            self.run_import("replace", bulk_backend="odbc")
+        self.assertFalse(Studentlist.objects.exists())
+
+    def test_orm_inserter_counts_rows(self):
+        inserter = BulkInserter("orm", batch_size=2)
+        rows = [Studentlist(student_id=str(i), name=f"S{i}", sis_id=f"U{i}", email=f"{i}@usf.edu") for i in range(5)]
+        self.assertEqual(inserter.insert(Studentlist, rows), 5)
+        self.assertEqual(inserter.insert(Studentlist, []), 0)
+        self.assertEqual(Studentlist.objects.count(), 5)
+        self.assertEqual(inserter.rate(Studentlist)[0], 5)
+        self.assertEqual(inserter.rate(Submission), (0, 0.0))
+
+    def test_odbc_input_sizes_follow_the_column_types(self):
+        fake_pyodbc = SimpleNamespace(
+            SQL_INTEGER="int", SQL_BIGINT="bigint", SQL_DOUBLE="double", SQL_BIT="bit",
+            SQL_TYPE_TIMESTAMP="datetime2", SQL_TYPE_DATE="date", SQL_WVARCHAR="nvarchar",
+        )
+        with mock.patch.dict(sys.modules, {"pyodbc": fake_pyodbc}):
+            fields = _insert_fields(Submission)
+            sizes = dict(zip((f.name for f in fields), _input_sizes(fields)))
+        self.assertNotIn("id", sizes)
+        self.assertEqual(sizes["score"][0], "double")
+        self.assertEqual(sizes["submitted_at"], ("datetime2", 27, 7))
+        # foreign keys bind as the column they point at
+        self.assertEqual(sizes["student"], ("nvarchar", 100, 0))
+        self.assertIn(sizes["assignment"][0], ("int", "bigint"))
+
+
+class TypedLoaderTests(SimpleTestCase):
+    tz = ZoneInfo("America/New_York")
+
+    def submissions(self, **columns):
+        rows = {
+            "student_id": ["1", "2", "3", "4", "5"],
+            "assignment_id": ["101", "102", "103", "104", "105"],
+            "submitted_at": ["2025-09-09T12:00:00Z"] * 5,
+            "score": ["9.5", "nan", "", "NaN", "7"],
+            "status": ["on_time", "missing", "", None, "late"],
+        }
+        rows.update(columns)
+        return pd.DataFrame(rows, dtype=object)
+
+    def test_nan_and_blank_scores_are_not_invalid(self):
+        issues = {}
+        out = typed_submissions(self.submissions(), self.tz, issues)
+        self.assertEqual(out["score"].tolist(), [9.5, None, None, None, 7.0])
+        self.assertEqual(issues["invalid_scores"], 0)
+        self.assertEqual(issues["invalid_assignment_ids"], [])
+
+    def test_non_numeric_scores_are_counted_and_nulled(self):
+        issues = {"invalid_scores": 2}
+        out = typed_submissions(self.submissions(score=["A", "9.5", "n/a", "", "7"]), self.tz, issues)
+        self.assertEqual(out["score"].tolist(), [None, 9.5, None, None, 7.0])
+        self.assertEqual(issues["invalid_scores"], 4)
+
+    def test_bad_assignment_ids_are_dropped_and_listed(self):
+        issues = {}
+        out = typed_submissions(self.submissions(assignment_id=["101", "abc", "102.5", "", "105.0"]), self.tz, issues)
+        self.assertEqual(out["student_id"].tolist(), ["1", "5"])
+        self.assertEqual(out["assignment_id"].tolist(), [101, 105])
+        self.assertIsInstance(out["assignment_id"].iloc[1], int)
+        self.assertEqual(issues["invalid_assignment_ids"], ["abc", "102.5", ""])
+
+    def test_missing_status_defaults_to_floating(self):
+        out = typed_submissions(self.submissions(), self.tz, {})
+        self.assertEqual(out["status"].tolist(), ["on_time", "missing", "floating", "floating", "late"])
+
+    def test_naive_datetimes_are_local_and_offsets_convert_to_utc(self):
+        parsed = aware_datetimes(pd.Series([
+            "2025-09-09 08:00:00", "2025-09-09T08:00:00-04:00", "2025-09-09T12:00:00Z", "", None, "soon",
+        ], dtype=object), self.tz)
+        noon_utc = pd.Timestamp("2025-09-09 12:00", tz="UTC")
+        self.assertEqual(parsed.iloc[:3].tolist(), [noon_utc] * 3)
+        self.assertTrue(parsed.iloc[3:].isna().all())
+
+    def test_datetime_columns_are_localized_once(self):
+        naive = pd.Series(pd.to_datetime(["2025-01-15 07:00"]))
+        self.assertEqual(aware_datetimes(naive, self.tz).iloc[0], pd.Timestamp("2025-01-15 12:00", tz="UTC"))
+        aware = pd.Series(pd.to_datetime(["2025-01-15 07:00"]).tz_localize("UTC"))
+        self.assertEqual(aware_datetimes(aware, self.tz).iloc[0], pd.Timestamp("2025-01-15 07:00", tz="UTC"))
+
+    def test_text_ids_drop_float_suffixes(self):
+        self.assertEqual(text_ids(pd.Series([123.0, 45.0, float("nan")])).tolist()[:2], ["123", "45"])
+        self.assertTrue(pd.isna(text_ids(pd.Series([123.0, float("nan")])).iloc[1]))
+        self.assertEqual(text_ids(pd.Series([" 0012 ", "7"])).tolist(), ["0012", "7"])
+
+    def test_python_values_use_none_for_missing(self):
+        values = python_values(pd.Series([1.5, float("nan")])).tolist()
+        self.assertEqual(values, [1.5, None])
+
+    def test_typed_enrollments(self):
+        chunk = pd.DataFrame({
+            "Student ID": [1001.0, float("nan"), 1003.0],
+            "type": ["StudentEnrollment"] * 3,
+            "last_activity_at": ["2025-11-02T15:00:00Z", "", "2025-11-02 10:00:00"],
+            "total_activity_time(in_hrs)": ["1.5", "2", "x"],
+            "current_score": [88.5, 70, None],
+        })
+        self.assertEqual(normalize_column("total_activity_time(in_hrs)"), "total_activity_time_in_hrs")
+        rows = typed_enrollments(chunk, self.tz).to_dict("records")
+        self.assertEqual([r["student_id"] for r in rows], ["1001", "1003"])
+        self.assertEqual(rows[0]["last_activity_at"], datetime(2025, 11, 2, 15, tzinfo=dt_timezone.utc))
+        self.assertEqual(rows[1]["last_activity_at"], datetime(2025, 11, 2, 15, tzinfo=dt_timezone.utc))
+        self.assertEqual([r["total_activity_time"] for r in rows], [1.5, None])
+        self.assertEqual([r["current_score"] for r in rows], [88.5, None])
+        self.assertIsNone(rows[0]["role"])
+        self.assertIsNone(rows[0]["inactive_days"])
+
+
+class InterchangeFormatTests(SimpleTestCase):
+    frame = pd.DataFrame({
+        "student_id": ["0012", "7", None],
+        "score": [9.5, float("nan"), 3.0],
+        "attempts": pd.array([1, None, 3], dtype="Int64"),
+        "title": ["Quiz 1", "Quiz, \"2\"", ""],
+    })
+    dtypes = {"student_id": "object", "score": "float64", "attempts": "Int64", "title": "object"}
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="craft_interchange_test_")
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+
+    @skipIf(interchange.pyarrow is None, "pyarrow is not installed")
+    def test_arrow_formats_round_trip(self):
+        for fmt in ("parquet", "feather"):
+            with self.subTest(fmt=fmt):
+                path = write_table(self.frame, self.dir, "t", fmt=fmt)
+                self.assertTrue(path.endswith("." + fmt))
+                pd.testing.assert_frame_equal(read_table(path), self.frame)
+
+    @skipIf(interchange.pyarrow is None, "pyarrow is not installed")
+    def test_nested_values_are_stored_as_text(self):
+        path = write_table(pd.DataFrame({"grades": [{"current_score": 90}, None]}), self.dir, "t", fmt="parquet")
+        self.assertEqual(read_table(path)["grades"].tolist(), ["{'current_score': 90}", None])
+
+    def test_csv_round_trip(self):
+        path = write_table(self.frame, self.dir, "t", fmt="csv")
+        df = read_table(path, columns=["title", "score"])
+        self.assertEqual(list(df.columns), ["score", "title"])
+        self.assertEqual(df["title"].fillna("").tolist(), ["Quiz 1", 'Quiz, "2"', ""])
+        self.assertTrue(df["score"].isna().iloc[1])
+
+    def test_unknown_format_is_rejected(self):
+        with self.assertRaisesMessage(ValueError, "Unknown export format"):
+            interchange.get_format("xls")
+
+    def test_find_table_prefers_the_newest_non_excel_copy(self):
+        self.assertIsNone(find_table(self.dir, "t"))
+        xlsx = os.path.join(self.dir, "t.xlsx")
+        open(xlsx, "w").close()
+        self.assertEqual(find_table(self.dir, "t"), xlsx)
+        csv_path = write_table(self.frame, self.dir, "t", fmt="csv")
+        os.utime(xlsx, (time.time() + 60, time.time() + 60))
+        self.assertEqual(find_table(self.dir, "t"), csv_path)
+        if interchange.pyarrow is not None:
+            parquet_path = write_table(self.frame, self.dir, "t", fmt="parquet")
+            os.utime(csv_path, (time.time() - 60, time.time() - 60))
+            self.assertEqual(find_table(self.dir, "t"), parquet_path)
+
+    def test_stream_writer_matches_write_table(self):
+        rows = self.frame.astype(object).where(self.frame.notna(), None).to_dict("records")
+        formats = ("csv", "parquet", "feather") if interchange.pyarrow is not None else ("csv",)
+        for fmt in formats:
+            with self.subTest(fmt=fmt):
+                with TableStreamWriter(self.dir, f"streamed_{fmt}", self.dtypes, fmt=fmt) as writer:
+                    writer.write_rows(rows[:2])
+                    writer.write_rows([])
+                    writer.write_rows(rows[2:])
+                self.assertEqual(writer.rows, 3)
+                expected = read_table(write_table(self.frame, self.dir, f"whole_{fmt}", fmt=fmt))
+                # without pandas metadata a nullable int column reads back as float64
+                pd.testing.assert_frame_equal(read_table(writer.path), expected, check_dtype=False)
+
+    def test_chunks_cover_the_table(self):
+        formats = ("csv", "parquet", "feather") if interchange.pyarrow is not None else ("csv",)
+        for fmt in formats:
+            with self.subTest(fmt=fmt):
+                path = write_table(self.frame, self.dir, "t", fmt=fmt)
+                chunks = list(iter_table_chunks(path, 2))
+                self.assertEqual([len(c) for c in chunks], [2, 1])
+                pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), read_table(path))
+
+    def test_csv_as_text_keeps_raw_cells(self):
+        path = write_table(self.frame, self.dir, "t", fmt="csv")
+        chunk = next(iter_table_chunks(path, 10, columns=["student_id", "score"], csv_as_text=True))
+        self.assertEqual(chunk["student_id"].tolist(), ["0012", "7", ""])
+        self.assertEqual(chunk["score"].tolist(), ["9.5", "", "3.0"])
+
+
+class JsonlStreamTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix="craft_jsonl_test_")
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, "raw.jsonl")
+
+    def test_records_round_trip_one_per_line(self):
+        records = [{"id": 1, "title": "Quiz 1\nretake"}, {"id": 2, "due": timezone.now()}]
+        with JsonlWriter(self.path) as writer:
+            for record in records:
+                writer.write(record)
+        with open(self.path, encoding="utf-8") as f:
+            self.assertEqual(len(f.readlines()), 2)
+        read = list(iter_jsonl(self.path))
+        self.assertEqual(read[0], records[0])
+        self.assertEqual(read[1]["due"], str(records[1]["due"]))
+
+    def test_append_after_a_torn_tail(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write('{"id":1}\n{"id":2,"ti')  # killed mid-record
+        with self.assertRaises(ValueError):
+            list(iter_jsonl(self.path))
+        with JsonlWriter(self.path, mode="a") as writer:
+            writer.write({"id": 3})
+        self.assertEqual(list(iter_jsonl(self.path, skip_invalid=True)), [{"id": 1}, {"id": 3}])
+
+    def test_append_to_a_clean_file_adds_no_blank_line(self):
+        with JsonlWriter(self.path) as writer:
+            writer.write({"id": 1})
+        with JsonlWriter(self.path, mode="a") as writer:
+            writer.write({"id": 2})
+        with open(self.path, encoding="utf-8") as f:
+            self.assertEqual(f.read(), '{"id":1}\n{"id":2}\n')
+
+    def test_blank_lines_are_skipped(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write('\n{"id":1}\n  \n')
+        self.assertEqual(list(iter_jsonl(self.path)), [{"id": 1}])
+
+
+class ShardTests(SimpleTestCase):
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard("2/4"), (2, 4))
+        self.assertEqual(parse_shard("1/1"), (1, 1))
+        for value in ("0/4", "5/4", "1/0", "-1/2", "2", "a/b", "1/2/3", ""):
+            with self.subTest(value=value), self.assertRaises(argparse.ArgumentTypeError):
+                parse_shard(value)
+
+    def test_every_pair_lands_in_exactly_one_shard(self):
+        pairs = [(str(course), str(student)) for course in (111, 222, 333) for student in range(5000000, 5000200)]
+        for shards in (1, 3, 8):
+            with self.subTest(shards=shards):
+                owners = [
+                    [i for i in range(1, shards + 1) if in_shard(course, student, i, shards)]
+                    for course, student in pairs
+                ]
+                self.assertTrue(all(len(o) == 1 for o in owners))
+                sizes = [sum(o == [i] for o in owners) for i in range(1, shards + 1)]
+                self.assertGreater(min(sizes), len(pairs) / shards / 2)  # roughly even
+
+    def test_assignment_is_stable(self):
+        # crc32, not hash(): another process (or machine) must agree on the owner
+        self.assertEqual([i for i in (1, 2, 3) if in_shard("111", "5000002", i, 3)], [3])
+        self.assertEqual([i for i in (1, 2, 3) if in_shard("111", "5000003", i, 3)], [2])
+
+
+@override_settings(CANVAS_API_TOKEN="test-token", CANVAS_COURSE_IDS="111")
+class MergeShardsTests(TempBaseDirMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        env = mock.patch.dict(os.environ, {"CANVAS_LOG_LEVEL": "WARNING"})
+        env.start()
+        self.addCleanup(env.stop)
+        self.addCleanup(self.close_log_handlers)
+
+    def close_log_handlers(self):
+        command_logger = logging.getLogger("students.management.commands.fetch_canvas_assignments")
+        for handler in command_logger.handlers:
+            handler.close()
+        command_logger.handlers = []
+
+    def merge(self, shards):
+        with redirect_stdout(io.StringIO()):
+            self.run_command(merge_shards=shards)
+
+    def run_command(self, **options):
+        call_command("fetch_canvas_assignments", format="csv", stdout=io.StringIO(), **options)
+
+    def unit(self, student_id):
+        return {"course_id": "111", "student_id": student_id, "items": [{
+            "assignment_id": 11100, "title": "Quiz 1", "due_at": "2025-09-01T03:59:00Z", "status": "on_time",
+            "submission": {"score": 4.0, "submitted_at": "2025-09-01T00:00:00Z"},
+        }]}
+
+    def test_rejects_a_shard_count_below_one(self):
+        for shards in (0, -2):
+            with self.subTest(shards=shards), self.assertRaisesMessage(CommandError, "1 or more"):
+                self.run_command(merge_shards=shards)
+
+    def test_fails_on_a_missing_shard(self):
+        output_dir = os.path.join(self.base_dir, "data_exports")
+        os.makedirs(output_dir)
+        open(shard_path(output_dir, 1, 2), "w").close()
+        with self.assertRaisesMessage(CommandError, "Missing shard outputs: " + shard_path(output_dir, 2, 2)):
+            self.run_command(merge_shards=2)
+
+    def test_merges_every_shard(self):
+        output_dir = os.path.join(self.base_dir, "data_exports")
+        os.makedirs(output_dir)
+        students = [str(s) for s in range(5000000, 5000010)]
+        for i in (1, 2):
+            with open(shard_path(output_dir, i, 2), "w", encoding="utf-8") as f:
+                for sid in students:
+                    if in_shard("111", sid, i, 2):
+                        f.write(json.dumps(self.unit(sid)) + "\n")
+                f.write('{"course_id":"111","stud')  # a shard killed mid-write
+        self.merge(2)
+        merged = list(iter_jsonl(os.path.join(output_dir, "assignments_raw.jsonl")))
+        self.assertEqual(sorted(r["student_id"] for r in merged), students)
+        submissions = pd.read_csv(os.path.join(output_dir, "assignments_cleaned_submissions.csv"), dtype=str)
+        self.assertEqual(sorted(submissions["student_id"]), students)
+
+
+class FetchMetricsTests(SimpleTestCase):
+    base = "https://usflearn.instructure.com/api/v1/"
+
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix="craft_metrics_test_")
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.dir = directory
+        self.metrics = FetchMetrics()
+        for status, body in ((200, b"[]"), (200, b"[1,2]"), (429, b""), (200, None)):
+            started = self.metrics.start()
+            self.metrics.finish(started, self.base + "courses/111/users/5000001/assignments?page=2",
+                                resp=SimpleNamespace(status_code=status, content=body))
+        errors = (ConnectionError("reset"), TimeoutError(), ConnectionError("refused"), None)
+        in_flight = [self.metrics.start() for _ in errors]  # all four overlap
+        for started, error in zip(in_flight, errors):
+            self.metrics.finish(started, self.base + "courses/222/students/submissions", error=error)
+        self.metrics.retry(429)
+        self.metrics.retry("ConnectionError")
+        self.metrics.listing(self.base + "courses/111/enrollments", 3)
+        self.metrics.listing(self.base + "courses/222/enrollments", 1)
+
+    def test_endpoint_of_folds_ids(self):
+        self.assertEqual(endpoint_of(self.base + "courses/12/users/34/assignments?page=2"),
+                         "courses/:id/users/:id/assignments")
+        self.assertEqual(endpoint_of(self.base + "courses/sis_course_id:CGS2100.001/enrollments"),
+                         "courses/:id/enrollments")
+        self.assertEqual(endpoint_of(self.base + "users/self/profile"), "users/:id/profile")
+        self.assertEqual(endpoint_of("/courses/12/analytics/"), "courses/:id/analytics")
+
+    def test_snapshot_counts_statuses_and_errors(self):
+        report = self.metrics.snapshot(extra={"failed_units": 2})
+        analytics = report["endpoints"]["courses/:id/users/:id/assignments"]
+        self.assertEqual(analytics["requests"], 4)
+        self.assertEqual(analytics["statuses"], {"200": 3, "429": 1})
+        self.assertEqual(analytics["bytes"], 7)
+        self.assertEqual(analytics["errors"], 0)
+        submissions = report["endpoints"]["courses/:id/students/submissions"]
+        self.assertEqual(submissions["errors"], 4)
+        self.assertEqual(submissions["errors_by_type"], {"ConnectionError": 2, "TimeoutError": 1, "unknown": 1})
+        self.assertEqual(sum(submissions["latency_seconds"]["buckets"].values()), 4)
+        self.assertEqual(report["totals"]["requests"], 8)
+        self.assertEqual(report["totals"]["rate_limited_429"], 1)
+        self.assertEqual(report["totals"]["retries"], 2)
+        self.assertEqual(report["totals"]["errors"], 4)
+        self.assertEqual(report["totals"]["max_in_flight"], 4)
+        self.assertEqual(report["pages_per_listing"]["courses/:id/enrollments"]["pages"], 4)
+        self.assertEqual(report["failed_units"], 2)
+
+    def test_write_json(self):
+        path = self.metrics.write_json(os.path.join(self.dir, "metrics.json"))
+        with open(path, encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["totals"]["requests"], 8)
+
+    def test_write_prometheus(self):
+        path = self.metrics.write_prometheus(os.path.join(self.dir, "metrics.prom"))
+        with open(path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        for expected in (
+            "# TYPE canvas_requests_total counter",
+            'canvas_requests_total{endpoint="courses/:id/users/:id/assignments",status="200"} 3',
+            'canvas_requests_total{endpoint="courses/:id/students/submissions",status="error"} 4',
+            'canvas_request_errors_total{endpoint="courses/:id/students/submissions",error="ConnectionError"} 2',
+            'canvas_request_duration_seconds_bucket{endpoint="courses/:id/users/:id/assignments",le="+Inf"} 4',
+            'canvas_pages_per_listing_bucket{endpoint="courses/:id/enrollments",le="1"} 1',
+            'canvas_pages_per_listing_bucket{endpoint="courses/:id/enrollments",le="+Inf"} 2',
+            'canvas_retries_total{reason="429"} 1',
+            "canvas_rate_limited_total 1",
+            "canvas_max_in_flight 4",
+        ):
+            with self.subTest(line=expected):
+                self.assertIn(expected, lines)
+        samples = [line for line in lines if not line.startswith("#")]
+        self.assertTrue(all(re.match(r"^canvas_\w+(\{.*\})? \S+$", line) for line in samples))
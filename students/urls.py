@@ -13,6 +13,7 @@ urlpatterns = [
     path('select_assignments/', views.assignments_page, name='select_assignments'),
     #path('report/<str:assignment_ids>/', views.performance_report, name='performance_report'),
     path('filter/', views.filter_students, name='filter_students'),
+    path('api/students/', views.student_directory, name='student_directory'),
     path('send_email/', views.send_email, name='send_email'),
     path('logout/', auth_views.LogoutView.as_view(next_page='login'), name='logout'),
     path('password_reset/', auth_views.PasswordResetView.as_view(), name='password_reset'),
@@ -1,21 +1,22 @@
 from django import forms
 from django.shortcuts import  redirect, render
 from django.http import JsonResponse
-from django.db.models import Prefetch,Q
+from django.db.models import Count,Prefetch,Q
 from django.conf import settings
 from collections import defaultdict
 import re
-import requests
 from .models import Studentlist,Enrollment,Assignment,Submission
 from django.shortcuts import render, redirect
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 import json
-from django.core.paginator import Paginator
-import requests
+from datetime import datetime, timedelta, time as dt_time
 from django.contrib.auth.views import LoginView
 from django.contrib.auth.decorators import login_required
 import time
+from .canvas_client import get_client, get_canvas_token
+from .pagination import InvalidCursor, decode_cursor, encode_cursor, keyset_page, page_size_from
+from . import picklists, search_index
 
 class CustomLoginView(LoginView):
     template_name = 'students/login.html'
@@ -24,7 +25,7 @@ class CustomLoginView(LoginView):
 
 @login_required
 def home(request):
-    students = Studentlist.objects.all().order_by('name')
+    # rows are loaded page by page from student_directory, so first paint doesn't scale with the roster
     sections_raw = Studentlist.objects.values_list('section_name', flat=True).distinct()
 
     def format_section(section):
@@ -43,34 +44,115 @@ def home(request):
         'students/home.html',
         {
             'sections': sections,
-            'students': students,
+            'page_size': settings.STUDENT_PAGE_SIZE,
         },
     )
 
-def filter_students(request):
-    name = request.GET.get('name', '')
-    email = request.GET.get('email', '')
-    sections = request.GET.get('sections', '').split(',')
+STUDENT_DIRECTORY_FIELDS = ('name', 'email', 'sis_id', 'section_name', 'student_id')
+STUDENT_DIRECTORY_ORDER = ('name', 'student_id')
+
+
+SEARCH_PARAMS = ('q', 'name', 'email', 'sis_id')
+
 
+def _selected_sections(params):
+    return [section for section in (params.get('sections') or '').split(',') if section]
+
+
+def _section_filter(sections):
     query = Q()
-    if name:
-        query &= Q(name__icontains=name)
-    if email:
-        query &= Q(email__icontains=email)
+    for section in sections:
+        query |= Q(section_name__startswith=section)
+    return query
 
 
-    # Apply section filters if provided
+def _search_page(request, page_size):
+    """
+    Text filters are answered from the in-memory n-gram index, ranked by match
+    quality. The ranking lives in this process, so the cursor is an offset into
+    it, tied to the dataset version it was computed from.
+    """
+    index = search_index.get_index()
+    offset = 0
+    if request.GET.get('cursor'):
+        kind, version, offset = decode_cursor(request.GET['cursor'], 3)
+        if kind != 'search' or version != index.version or not isinstance(offset, int) or offset < 0:
+            raise InvalidCursor("Search results changed; start again from the first page")
+
+    result = index.search(**{param: request.GET.get(param, '') for param in SEARCH_PARAMS})
+    sections = tuple(_selected_sections(request.GET))
     if sections:
-        section_query = Q()
-        for section in sections:
-            if section:
-                section_query |= Q(section_name__startswith=section)
-        query &= section_query
+        rows = [row for row in result if (row['section_name'] or '').startswith(sections)]
+        page, total = rows[offset:offset + page_size], len(rows)
+    else:
+        page, total = result.page(offset, page_size), result.total
 
-    # Fetch students grouped by section and sorted by name
-    students = Studentlist.objects.filter(query).order_by('name')
+    end = offset + len(page)
+    next_cursor = encode_cursor(['search', index.version, end]) if end < total else None
+    return page, next_cursor, total
 
-    return JsonResponse({'students': list(students.values('name', 'email', 'sis_id', 'section_name'))})
+
+def matching_students(params):
+    """
+    Every roster row matching the directory filters in ``params`` (a QueryDict
+    or a plain dict), unpaged and ordered by (name, student_id). Used where the
+    whole filtered set matters: /filter/ and "select all" emails.
+    """
+    sections = tuple(_selected_sections(params))
+    if any(str(params.get(param) or '').strip() for param in SEARCH_PARAMS):
+        rows = search_index.get_index().search(**{param: params.get(param) or '' for param in SEARCH_PARAMS})
+        rows = [row for row in rows if not sections or (row['section_name'] or '').startswith(sections)]
+        return sorted(rows, key=lambda row: (row['name'] or '', row['student_id'] or ''))
+    return list(
+        Studentlist.objects.filter(_section_filter(sections))
+        .order_by(*STUDENT_DIRECTORY_ORDER)
+        .values(*STUDENT_DIRECTORY_FIELDS)
+    )
+
+
+def student_directory(request):
+    """
+    One page of the filtered roster.
+
+    Without a text filter, rows come from the database ordered by
+    (name, student_id). With ``q`` (any field, multi-token) or
+    ``name``/``email``/``sis_id``, rows come ranked from the search index.
+    ``cursor`` continues from ``next_cursor`` of the previous page;
+    ``page_size`` defaults to STUDENT_PAGE_SIZE. The database path pays an
+    extra COUNT for the total, so it's only included with ``include_total=1``.
+    """
+    page_size = page_size_from(request, settings.STUDENT_PAGE_SIZE)
+    want_total = request.GET.get('include_total') in ('1', 'true')
+    try:
+        if any(request.GET.get(param, '').strip() for param in SEARCH_PARAMS):
+            rows, next_cursor, total = _search_page(request, page_size)
+        else:
+            students = Studentlist.objects.filter(
+                _section_filter(_selected_sections(request.GET))
+            ).values(*STUDENT_DIRECTORY_FIELDS)
+            rows, next_cursor = keyset_page(
+                students, STUDENT_DIRECTORY_ORDER, cursor=request.GET.get('cursor'), page_size=page_size,
+            )
+            total = students.count() if want_total else None
+    except InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    data = {'students': rows, 'next_cursor': next_cursor, 'has_next': next_cursor is not None}
+    if want_total:
+        data['total'] = total
+    return JsonResponse(data)
+
+
+def filter_students(request):
+    """
+    Deprecated: every matching student in one unpaged response, as /filter/
+    always returned. The home page uses the paged /api/students/ instead.
+    """
+    students = [
+        {field: row[field] for field in ('name', 'email', 'sis_id', 'section_name')}
+        for row in matching_students(request.GET)
+    ]
+    return JsonResponse({'students': students})
 
 
 
@@ -81,7 +163,7 @@ CANVAS_CONV_URL = "https://usflearn.instructure.com/api/v1/conversations"
 
 # Pull Canvas token from settings/env so no secrets live in code
 def _get_canvas_token():
-    return getattr(settings, "CANVAS_API_TOKEN", "") or ""
+    return get_canvas_token()
 
 # ---------------------------
 # Helper functions for bulk send
@@ -92,11 +174,8 @@ def _send_conversation_batch(token: str, payload: dict, timeout: int = 30):
     Sends one batch to Canvas Conversations API.
     Must use form-encoded payload (not JSON).
     """
-    headers = {
-        "Authorization": f"Bearer {token}",
-        # Do NOT set Content-Type to application/json; Canvas expects form-data for bulk
-    }
-    r = requests.post(CANVAS_CONV_URL, headers=headers, data=payload, timeout=timeout)
+    # Do NOT send JSON here; Canvas expects form-data for bulk.
+    r = get_client(token).post(CANVAS_CONV_URL, data=payload, timeout=timeout)
     return r
 
 
@@ -138,6 +217,14 @@ def send_email_home(request):
 
             data = json.loads(request.body.decode("utf-8"))
             student_ids = data.get("student_ids", [])
+            if data.get("select_all"):
+                # "Select all" means every student matching the filters, not only
+                # the rows the paged list happened to have loaded
+                excluded = {str(sis_id) for sis_id in data.get("excluded_ids") or []}
+                student_ids = [
+                    row["sis_id"] for row in matching_students(data.get("filter") or {})
+                    if str(row["sis_id"]) not in excluded
+                ]
             custom_message = data.get("custom_message", "")
             subject = data.get("subject") or "Reminder for CGS2100"
 
@@ -184,29 +271,118 @@ def send_email_home(request):
 
 
 
+# (key, fewest, most) whole days since the last activity; None = open-ended
+INACTIVITY_BUCKETS = (('0-3', 0, 3), ('4-7', 4, 7), ('8-14', 8, 14), ('15+', 15, None))
+NEVER_ACTIVE = 'never'
+LAST_LOGIN_ORDER = ('last_activity_at', 'id')
+
+
+def inactive_days_since(last_activity_at, now):
+    """Whole days since ``last_activity_at`` as of ``now`` (never negative); None if never active."""
+    if last_activity_at is None:
+        return None
+    return max((now - last_activity_at).days, 0)
+
+
+def _inactivity_range(fewest, most, now):
+    """
+    Q for enrollments inactive between ``fewest`` and ``most`` whole days.
+    ``days = floor((now - t) / 1 day)``, so that is the half-open range
+    ``now - (most + 1) days < t <= now - fewest days`` on the raw column,
+    which the index on last_activity_at can seek.
+    """
+    query = Q(last_activity_at__isnull=False)
+    if fewest:
+        query &= Q(last_activity_at__lte=now - timedelta(days=fewest))
+    if most is not None:
+        query &= Q(last_activity_at__gt=now - timedelta(days=most + 1))
+    return query
+
+
+def _inactivity_page(enrollments, cursor, page_size):
+    """
+    Keyset page over ``enrollments``, longest inactive first: never-active
+    enrollments (by id), then by (last_activity_at, id). The cursor records
+    which of the two runs it is in.
+    """
+    run, inner = decode_cursor(cursor, 2) if cursor else (NEVER_ACTIVE, None)
+    if run not in (NEVER_ACTIVE, 'active') or not (inner is None or isinstance(inner, str)):
+        raise InvalidCursor("Cursor does not match this listing")
+    active = enrollments.filter(last_activity_at__isnull=False)
+    rows = []
+    if run == NEVER_ACTIVE:
+        rows, inner = keyset_page(enrollments.filter(last_activity_at__isnull=True), ('id',), inner, page_size)
+        if inner:
+            return rows, encode_cursor([NEVER_ACTIVE, inner])
+        if len(rows) == page_size:
+            return rows, encode_cursor(['active', None]) if active.exists() else None
+        run, inner = 'active', None
+    more, inner = keyset_page(active, LAST_LOGIN_ORDER, inner, page_size - len(rows))
+    return rows + more, encode_cursor(['active', inner]) if inner else None
+
+
 @login_required
 @csrf_exempt
 def last_login(request):
-    today = timezone.now().date()
-
-    #Adding CALENDAR based filter
-    from datetime import datetime
-
+    """
+    Enrollments by inactivity, computed from last_activity_at at request time
+    (the stored inactive_days is only as fresh as the last fetch).
+
+    ``inactive_since`` (a local date) keeps enrollments with no activity after
+    that day; ``bucket`` narrows to one of INACTIVITY_BUCKETS or "never".
+    Every filter is a plain range on last_activity_at. The per-bucket counts
+    come from one aggregate query, and the rows are keyset-paged with
+    ``cursor`` / ``page_size``.
+    """
+    now = timezone.now()
     inactive_since = request.GET.get('inactive_since', '')
-    base_query = Enrollment.objects.select_related('student').all()
+    bucket = request.GET.get('bucket', '')
+    base_query = Enrollment.objects.all()
 
     if inactive_since:
         try:
             selected_date = datetime.strptime(inactive_since, "%Y-%m-%d").date()
-            base_query = base_query.filter(last_activity_at__date__lte=selected_date)
+            # "on or before that day" == before the next local midnight
+            next_midnight = timezone.make_aware(datetime.combine(selected_date + timedelta(days=1), dt_time.min))
+            base_query = base_query.filter(last_activity_at__lt=next_midnight)
         except ValueError:
-            pass  # Ignore invalid date inputs
-
-    enrollments = base_query.order_by('-inactive_days')
+            inactive_since = ''  # Ignore invalid date inputs
+
+    ranges = {key: _inactivity_range(fewest, most, now) for key, fewest, most in INACTIVITY_BUCKETS}
+    ranges[NEVER_ACTIVE] = Q(last_activity_at__isnull=True)
+    counts = base_query.aggregate(**{
+        f'bucket_{i}': Count('id', filter=condition) for i, condition in enumerate(ranges.values())
+    })
+    buckets = [
+        {'key': key, 'count': counts[f'bucket_{i}'], 'selected': key == bucket}
+        for i, key in enumerate(ranges)
+    ]
+
+    enrollments = base_query
+    if bucket in ranges:
+        enrollments = enrollments.filter(ranges[bucket])
+    else:
+        bucket = ''
+    try:
+        page, next_cursor = _inactivity_page(
+            enrollments.select_related('student'),
+            request.GET.get('cursor'),
+            page_size_from(request, settings.STUDENT_PAGE_SIZE),
+        )
+    except InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    for enrollment in page:
+        enrollment.inactive_days = inactive_days_since(enrollment.last_activity_at, now)
 
     context = {
-        'enrollments': enrollments,
+        'enrollments': page,
         'inactive_since': inactive_since,
+        'bucket': bucket,
+        'buckets': buckets,
+        'total': sum(b['count'] for b in buckets),
+        'matching': next((b['count'] for b in buckets if b['selected']), None),
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
     }
     return render(request, 'students/last_login.html', context)
 
@@ -236,7 +412,7 @@ def send_email(request):
                 # Personalization for inactivity reminders
                 body = custom_message.format(
                     student_name=student.name,
-                    inactive_days=enrollment.inactive_days,
+                    inactive_days=inactive_days_since(enrollment.last_activity_at, timezone.now()),
                 )
 
                 payload = {
@@ -247,14 +423,7 @@ def send_email(request):
                     "force_new": True,
                 }
 
-                response = requests.post(
-                    CANVAS_CONV_URL,
-                    headers={
-                        "Authorization": f"Bearer {token}",
-                        "Content-Type": "application/json",
-                    },
-                    json=payload,
-                )
+                response = get_client(token).post(CANVAS_CONV_URL, json=payload)
 
                 results.append({
                     "email": student.email,
@@ -281,21 +450,16 @@ def send_email(request):
     return JsonResponse({"status": "failure"}, status=400)
 
 
+SUBMISSION_FEED_ORDER = ('student__name', 'id')
+SUBMISSION_FEED_PAGE_SIZE = 20
+
+
 @login_required
 @csrf_exempt
 def assignments_page(request):
-    import re
-
-    def natural_sort_key(title):
-    # Split string into list of parts: ['Bellini #', 1, '', 12, ' more']
-        return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', title)]
-
-    assignments = sorted(Assignment.objects.all(), key=lambda a: natural_sort_key(a.title))
-
-    # assignments = Assignment.objects.all().order_by('title')
-    students = Submission.objects.order_by('student__name').values_list(
-        'student__name', flat=True
-    ).distinct()
+    # both pick-lists are cached per dataset version; see students/picklists.py
+    assignments = picklists.assignment_choices()
+    students = picklists.student_choices()
     selected_assignments = request.GET.getlist('assignments')
     context = {
         'assignments': assignments,
@@ -308,7 +472,6 @@ def assignments_page(request):
         student_name = request.GET.get('student', '')
         status_filter = request.GET.get('status')
         score_filter = request.GET.get('score')
-        page_number = request.GET.get('page', 1)
 
         # Build query
         submissions = Submission.objects.select_related('student', 'assignment')
@@ -342,10 +505,17 @@ def assignments_page(request):
                 except (ValueError, IndexError):
                     pass
 
-        # Paginate results
-        paginator = Paginator(submissions.order_by('student__name'), 20)
-        page = paginator.get_page(page_number)
-        
+        # Keyset page: n+1 rows, no COUNT(*), no OFFSET
+        try:
+            page, next_cursor = keyset_page(
+                submissions,
+                SUBMISSION_FEED_ORDER,
+                cursor=request.GET.get('cursor'),
+                page_size=page_size_from(request, SUBMISSION_FEED_PAGE_SIZE),
+            )
+        except InvalidCursor as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
         # Serialize data
         submissions_data = [{
             'name': sub.student.name,
@@ -359,7 +529,8 @@ def assignments_page(request):
         
         return JsonResponse({
             'submissions': submissions_data,
-            'has_next': page.has_next()
+            'next_cursor': next_cursor,
+            'has_next': next_cursor is not None,
         })
     
     return render(request, 'students/assignments.html', context)
@@ -449,14 +620,7 @@ def send_email_assignments(request):
                 "force_new": True
             }
 
-            resp = requests.post(
-                CANVAS_CONV_URL,
-                headers={
-                    "Authorization": f"Bearer {token}",
-                    "Content-Type": "application/json",
-                },
-                json=payload
-            )
+            resp = get_client(token).post(CANVAS_CONV_URL, json=payload)
 
             results.append({
                 "student": student.email,